@@ -124,6 +124,8 @@ export DJANGO_SETTINGS_MODULE=temucosoft.settings_production
 echo ""
 echo "📊 [7/10] Migrando base de datos..."
 python manage.py migrate --settings=temucosoft.settings_production
+# Tabla de la cache en base de datos (se usa cuando no hay REDIS_URL)
+python manage.py createcachetable --settings=temucosoft.settings_production
 
 # Recolectar archivos estáticos
 echo "📁 Recolectando archivos estáticos..."
@@ -149,13 +151,21 @@ sudo chown -R ubuntu:ubuntu /var/run/gunicorn
 sudo mkdir -p /var/log/django
 sudo chown -R ubuntu:ubuntu /var/log/django
 
-# Copiar archivo de servicio
+# Directorio privado de reportes en segundo plano (lo lee Nginx)
+sudo mkdir -p /var/lib/temucosoft/report_jobs
+sudo chown -R ubuntu:www-data /var/lib/temucosoft
+sudo chmod -R 2750 /var/lib/temucosoft
+
+# Copiar archivos de servicio
 sudo cp gunicorn.service /etc/systemd/system/gunicorn.service
+sudo cp report-worker.service /etc/systemd/system/report-worker.service
 
 # Recargar systemd
 sudo systemctl daemon-reload
 sudo systemctl start gunicorn
 sudo systemctl enable gunicorn
+sudo systemctl start report-worker
+sudo systemctl enable report-worker
 
 echo "✅ Gunicorn configurado"
 
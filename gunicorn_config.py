@@ -18,20 +18,21 @@ bind = "0.0.0.0:8000"  # Escucha en todas las interfaces, puerto 8000
 # Fórmula recomendada: (2 x CPU cores) + 1
 workers = multiprocessing.cpu_count() * 2 + 1
 
-# Tipo de worker (sync es el estándar)
-worker_class = "sync"
+# Tipo de worker: gthread atiende cada request en un hilo, así el timeout
+# no corta las exportaciones en streaming de los reportes (?format=csv)
+worker_class = "gthread"
 
 # Conexiones máximas por worker
 worker_connections = 1000
 
-# Timeout para requests (segundos)
+# Timeout de un worker sin dar señales de vida (segundos)
 timeout = 30
 
 # Tiempo de keep-alive (segundos)
 keepalive = 2
 
 # Threads por worker (para worker_class = gthread)
-threads = 1
+threads = 4
 
 # =============================================================================
 # LOGGING - Configuración de logs
@@ -6,7 +6,8 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from .models import (
     Company, Subscription, User, Branch, Supplier, Product, Inventory, InventoryMovement,
-    Purchase, PurchaseItem, Sale, SaleItem, Order, OrderItem, CartItem, Payment
+    Purchase, PurchaseItem, Sale, SaleItem, Order, OrderItem, StockReservation, CartItem, Payment,
+    SalesDailyRollup, InventoryMovementDailySummary, ReportJob
 )
 
 
@@ -83,13 +84,31 @@ class ProductAdmin(admin.ModelAdmin):
     get_profit_margin.short_description = 'Margen'
 
 
+class NeedsRestockFilter(admin.SimpleListFilter):
+    """Filtro de stock bajo (usa el índice parcial de Inventory)"""
+    title = 'requiere restock'
+    parameter_name = 'restock'
+    
+    def lookups(self, request, model_admin):
+        return [('si', 'Sí')]
+    
+    def queryset(self, request, queryset):
+        if self.value() == 'si':
+            return queryset.needs_restock()
+        return queryset
+
+
 @admin.register(Inventory)
 class InventoryAdmin(admin.ModelAdmin):
     """Administración de inventario"""
-    list_display = ['product', 'branch', 'stock', 'reorder_point', 'needs_restock_display', 'last_restock_date']
-    list_filter = ['branch', 'branch__company', 'updated_at']
+    list_display = [
+        'product', 'branch', 'stock', 'reserved', 'reorder_point', 'needs_restock_display', 'last_restock_date'
+    ]
+    list_filter = [NeedsRestockFilter, 'branch', 'branch__company', 'updated_at']
     search_fields = ['product__name', 'product__sku', 'branch__name']
     ordering = ['stock']
+    # Lo mantienen las reservas de las órdenes (pos_ecommerce/reservations.py)
+    readonly_fields = ['reserved']
     
     def needs_restock_display(self, obj):
         """Indicador visual de restock necesario"""
@@ -145,6 +164,20 @@ class SaleAdmin(admin.ModelAdmin):
     readonly_fields = ['created_at']
 
 
+@admin.register(SalesDailyRollup)
+class SalesDailyRollupAdmin(admin.ModelAdmin):
+    """Resumen diario de ventas (solo lectura, se mantiene automáticamente)"""
+    list_display = ['business_date', 'branch', 'payment_method', 'sales_count', 'total_amount']
+    list_filter = ['payment_method', 'branch__company', 'business_date']
+    ordering = ['-business_date']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(SaleItem)
 class SaleItemAdmin(admin.ModelAdmin):
     """Administración de items de venta"""
@@ -189,6 +222,16 @@ class OrderItemAdmin(admin.ModelAdmin):
     get_subtotal.short_description = 'Subtotal'
 
 
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    """Consulta de reservas de stock de órdenes e-commerce"""
+    list_display = ['order', 'inventory', 'quantity', 'status', 'expires_at', 'created_at']
+    list_filter = ['status', 'expires_at']
+    search_fields = ['order__customer_name', 'inventory__product__name']
+    ordering = ['-created_at']
+    readonly_fields = ['order', 'inventory', 'quantity', 'status', 'expires_at', 'created_at']
+
+
 @admin.register(CartItem)
 class CartItemAdmin(admin.ModelAdmin):
     """Administración de items del carrito"""
@@ -232,3 +275,32 @@ class InventoryMovementAdmin(admin.ModelAdmin):
     def get_branch(self, obj):
         return obj.inventory.branch.name
     get_branch.short_description = 'Sucursal'
+
+
+@admin.register(InventoryMovementDailySummary)
+class InventoryMovementDailySummaryAdmin(admin.ModelAdmin):
+    """Resumen diario de movimientos (solo lectura, se mantiene automáticamente)"""
+    list_display = ['day', 'inventory', 'movement_type', 'movement_count', 'total_quantity']
+    list_filter = ['movement_type', 'inventory__branch', 'day']
+    ordering = ['-day']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ReportJob)
+class ReportJobAdmin(admin.ModelAdmin):
+    """Reportes en segundo plano (solo lectura, los procesa run_report_worker)"""
+    list_display = ['id', 'report_type', 'export_format', 'user', 'status', 'row_count', 'created_at', 'finished_at']
+    list_filter = ['status', 'report_type', 'export_format']
+    search_fields = ['user__username']
+    ordering = ['-created_at']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class PosEcommerceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pos_ecommerce'
+
+    def ready(self):
+        from django.core import checks
+
+        from . import signals  # noqa: F401
+        from .mixins import check_idempotency_cache
+
+        checks.register(check_idempotency_cache, checks.Tags.caches)
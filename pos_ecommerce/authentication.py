@@ -0,0 +1,189 @@
+"""
+Autenticación JWT de la API del sistema POS + E-commerce de TemucoSoft S.A.
+
+- Los tokens llevan, además del id del usuario, los claims `role` y
+  `company_id` (PosTokenObtainPairSerializer).
+- CachedJWTAuthentication no consulta la tabla de usuarios en cada
+  petición: el usuario autenticado (con su empresa, sin el hash de la
+  contraseña) se guarda en la cache por AUTH_USER_CACHE_TIMEOUT segundos.
+  signals.py lo descarta al confirmarse cualquier cambio del usuario o de su
+  empresa; los QuerySet.update() no emiten señales y quedan cubiertos por el
+  vencimiento. Si el rol o la empresa del usuario ya no coinciden con los
+  claims, el token se rechaza y hay que volver a iniciar sesión.
+- El acceso por token es el acceso a la API del plan: los usuarios de
+  empresas cuyo plan no incluye has_api_access (ver entitlements.py) no
+  obtienen tokens y los que ya tenían reciben 403.
+- El last_login del login por token se acumula en memoria y se escribe en
+  lote (una sola consulta) cada LAST_LOGIN_FLUSH_INTERVAL segundos o cada
+  LAST_LOGIN_BATCH_SIZE inicios de sesión, en vez de un UPDATE por login.
+  Un temporizador escribe lo pendiente aunque el worker no reciba más
+  logins: si el proceso muere (SIGKILL, OOM) se pierde como máximo un
+  intervalo.
+"""
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.utils import timezone
+from rest_framework.exceptions import PermissionDenied
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenObtainSerializer
+from rest_framework_simplejwt.settings import api_settings
+
+from .entitlements import feature_error
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+LAST_LOGIN_BATCH_SIZE = 200
+
+_pending_logins = {}  # user_id -> fecha del último login aún no escrito
+_pending_lock = threading.Lock()
+_flush_timer = None  # threading.Timer armado mientras hay logins pendientes
+_last_flush = time.monotonic()
+
+
+def user_cache_key(user_id):
+    return f'auth:usuario:{user_id}'
+
+
+def _user_cache_timeout():
+    return getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 60 * 5)
+
+
+def get_cached_user(user_id):
+    """Usuario activo o inactivo con su empresa, desde la cache (None si no existe)"""
+    key = user_cache_key(user_id)
+    user = cache.get(key)
+    if user is None:
+        user = User.objects.select_related('company').defer('password').filter(pk=user_id).first()
+        if user is not None:
+            cache.add(key, user, _user_cache_timeout())
+    return user
+
+
+def forget_users(*user_ids):
+    """Descarta (al confirmar la transacción) los usuarios cacheados"""
+    keys = [user_cache_key(user_id) for user_id in user_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication que toma el usuario de la cache y valida los claims de rol y empresa"""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('El token no identifica al usuario')
+
+        user = get_cached_user(user_id)
+        if user is None:
+            raise AuthenticationFailed('Usuario no encontrado', code='user_not_found')
+        if not user.is_active:
+            raise AuthenticationFailed('Usuario inactivo', code='user_inactive')
+
+        # Tokens emitidos antes de agregar los claims: se aceptan tal cual
+        if 'role' in validated_token and (
+            validated_token['role'] != user.role or validated_token.get('company_id') != user.company_id
+        ):
+            raise InvalidToken('El rol o la empresa del usuario cambiaron; inicie sesión nuevamente')
+
+        error = feature_error(user.company_id, 'has_api_access')
+        if error:
+            raise PermissionDenied(error)
+        return user
+
+
+class PosTokenObtainPairSerializer(TokenObtainPairSerializer):
+    """Login por token: agrega role y company_id y registra last_login en lote"""
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['role'] = user.role
+        token['company_id'] = user.company_id
+        return token
+
+    def validate(self, attrs):
+        data = TokenObtainSerializer.validate(self, attrs)
+        error = feature_error(self.user.company_id, 'has_api_access')
+        if error:
+            raise PermissionDenied(error)
+        refresh = self.get_token(self.user)
+        data['refresh'] = str(refresh)
+        data['access'] = str(refresh.access_token)
+        if api_settings.UPDATE_LAST_LOGIN:
+            record_login(self.user.pk)
+        return data
+
+
+# ============================================================================
+# last_login en lote
+# ============================================================================
+
+def _flush_interval():
+    return getattr(settings, 'LAST_LOGIN_FLUSH_INTERVAL', 60)
+
+
+def record_login(user_id, when=None):
+    """Anota un inicio de sesión; se escribe junto con los demás en flush_last_logins()"""
+    global _flush_timer
+    with _pending_lock:
+        _pending_logins[user_id] = when or timezone.now()
+        due = (
+            len(_pending_logins) >= LAST_LOGIN_BATCH_SIZE or
+            time.monotonic() - _last_flush >= _flush_interval()
+        )
+        if not due and _flush_timer is None:
+            _flush_timer = threading.Timer(_flush_interval(), _flush_from_timer)
+            _flush_timer.daemon = True
+            _flush_timer.start()
+    if due:
+        flush_last_logins()
+
+
+def flush_last_logins():
+    """Escribe los last_login pendientes con un solo UPDATE. Devuelve cuántos escribió"""
+    global _last_flush, _flush_timer
+    with _pending_lock:
+        pending = dict(_pending_logins)
+        _pending_logins.clear()
+        _last_flush = time.monotonic()
+        if _flush_timer is not None:
+            if _flush_timer is not threading.current_thread():
+                _flush_timer.cancel()
+            _flush_timer = None
+    if not pending:
+        return 0
+    # bulk_update no emite señales: el usuario cacheado no se descarta por esto
+    User.objects.bulk_update(
+        [User(pk=user_id, last_login=when) for user_id, when in pending.items()],
+        ['last_login']
+    )
+    return len(pending)
+
+
+def _flush_from_timer():
+    try:
+        flush_last_logins()
+    except Exception:
+        logger.exception('No se pudieron escribir los last_login pendientes')
+    finally:
+        # La conexión de este hilo no la cierra el ciclo de las peticiones
+        connections.close_all()
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        flush_last_logins()
+    except Exception:
+        # El proceso termina igual, pero la pérdida queda registrada
+        logger.exception('No se pudieron escribir los last_login pendientes al terminar')
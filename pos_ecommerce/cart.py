@@ -0,0 +1,237 @@
+"""
+Carrito de compras (e-commerce) del sistema POS + E-commerce de TemucoSoft S.A.
+
+El carrito vive en la cache compartida, no en la base de datos: agregar,
+cambiar o quitar productos no escribe filas. Solo el checkout convierte el
+carrito en una orden (Order / OrderItem).
+
+- Usuario autenticado: `carrito:usuario:<id>`.
+- Visitante anónimo: `carrito:anonimo:<token>`, con el token guardado en la
+  sesión. El token sobrevive al cambio de clave de sesión del login, y en
+  ese momento el carrito anónimo se suma al del usuario (ver signals.py).
+  Un visitante que solo mira el catálogo no recibe token ni sesión.
+
+Cada escritura renueva el vencimiento (CART_TIMEOUT); un carrito sin
+actividad desaparece solo. Como máximo CART_MAX_ITEMS productos distintos
+y CART_MAX_QUANTITY unidades de cada uno.
+
+Los carritos que quedaron en la tabla CartItem (versiones anteriores) se
+traspasan a la cache la primera vez que se lee el carrito de ese usuario o
+sesión, y sus filas se eliminan. Los que nadie vuelve a leer los elimina
+`manage.py cleanup_carts_and_sessions` (ver cleanup.py) pasado CART_TIMEOUT.
+
+Dos pestañas que modifican el mismo carrito a la vez pueden pisarse (la
+última escritura gana); en un carrito eso no justifica un bloqueo.
+"""
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .models import CartItem, Product
+
+CART_SESSION_KEY = 'cart_token'
+
+
+class CartError(Exception):
+    """Operación inválida sobre el carrito (cantidad o tamaño fuera de rango)"""
+
+
+def _timeout():
+    return getattr(settings, 'CART_TIMEOUT', 60 * 60 * 24 * 7)
+
+
+def _max_items():
+    return getattr(settings, 'CART_MAX_ITEMS', 50)
+
+
+def _max_quantity():
+    return getattr(settings, 'CART_MAX_QUANTITY', 99)
+
+
+class CartLine:
+    """Línea del carrito con el producto cargado (misma interfaz que CartItem en las plantillas)"""
+
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+
+    @property
+    def id(self):
+        # Cada producto aparece una sola vez: la línea se identifica por él
+        return self.product.pk
+
+    @property
+    def product_id(self):
+        return self.product.pk
+
+    def get_subtotal(self):
+        return self.quantity * self.product.price
+
+
+class Cart:
+    """
+    Carrito de un usuario o de una sesión anónima.
+    Las cantidades se guardan como {product_id: cantidad} en orden de llegada.
+    """
+
+    def __init__(self, key, legacy_items=None):
+        self.key = key
+        self._legacy_items = legacy_items
+        self._lines = None
+
+    @classmethod
+    def for_user(cls, user):
+        return cls(f'carrito:usuario:{user.pk}', CartItem.objects.filter(user_id=user.pk))
+
+    @classmethod
+    def for_session(cls, session, create=False):
+        """Carrito anónimo de la sesión; None si no tiene y `create` es False"""
+        token = session.get(CART_SESSION_KEY)
+        if token is None:
+            if not create:
+                return None
+            token = session[CART_SESSION_KEY] = uuid.uuid4().hex
+        legacy = CartItem.objects.filter(session_key=session.session_key) if session.session_key else None
+        return cls(f'carrito:anonimo:{token}', legacy)
+
+    @classmethod
+    def for_request(cls, request, create=False):
+        """
+        Carrito del usuario autenticado o de la sesión. Sin `create`, un
+        visitante sin carrito recibe uno vacío que no se guarda.
+        """
+        if request.user and request.user.is_authenticated:
+            return cls.for_user(request.user)
+        cart = cls.for_session(request.session, create=create)
+        return cart if cart is not None else cls(None)
+
+    # ------------------------------------------------------------------
+    # Lectura
+    # ------------------------------------------------------------------
+
+    @property
+    def lines(self):
+        if self._lines is None:
+            self._lines = self._load()
+        return self._lines
+
+    def _load(self):
+        if self.key is None:
+            return {}
+        lines = cache.get(self.key)
+        if lines is not None:
+            return lines
+        lines = {}
+        if self._legacy_items is not None:
+            with transaction.atomic():
+                for product_id, quantity in self._legacy_items.order_by('created_at', 'id').values_list(
+                    'product_id', 'quantity'
+                ):
+                    lines[product_id] = min(lines.get(product_id, 0) + quantity, _max_quantity())
+                if lines:
+                    self._legacy_items.delete()
+        lines = dict(list(lines.items())[:_max_items()])
+        cache.set(self.key, lines, _timeout())
+        return lines
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __bool__(self):
+        return bool(self.lines)
+
+    def quantity(self, product_id):
+        return self.lines.get(product_id, 0)
+
+    def items(self):
+        """
+        CartLine de cada producto, con los productos leídos en una consulta.
+        Los productos eliminados o desactivados se quitan del carrito.
+        """
+        if not self.lines:
+            return []
+        products = Product.objects.filter(pk__in=list(self.lines), is_active=True).select_related('company')
+        by_id = {product.pk: product for product in products}
+        if len(by_id) != len(self.lines):
+            for product_id in [pk for pk in self.lines if pk not in by_id]:
+                del self.lines[product_id]
+            self.save()
+        return [CartLine(by_id[product_id], quantity) for product_id, quantity in self.lines.items()]
+
+    def total(self, items=None):
+        return sum(line.get_subtotal() for line in (items if items is not None else self.items()))
+
+    # ------------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------------
+
+    def save(self):
+        if self.key is not None:
+            cache.set(self.key, self.lines, _timeout())
+
+    def _check_quantity(self, quantity):
+        if quantity < 1:
+            raise CartError('La cantidad debe ser mayor a 0')
+        if quantity > _max_quantity():
+            raise CartError(f'Máximo {_max_quantity()} unidades por producto')
+
+    def add(self, product_id, quantity=1):
+        """Suma unidades de un producto; devuelve la cantidad resultante"""
+        return self.set_quantity(product_id, self.quantity(product_id) + quantity)
+
+    def set_quantity(self, product_id, quantity):
+        if self.key is None:
+            raise CartError('El carrito no admite cambios')
+        self._check_quantity(quantity)
+        if product_id not in self.lines and len(self.lines) >= _max_items():
+            raise CartError(f'El carrito admite como máximo {_max_items()} productos distintos')
+        self.lines[product_id] = quantity
+        self.save()
+        return quantity
+
+    def remove(self, product_id):
+        """Quita un producto; devuelve False si no estaba"""
+        if product_id not in self.lines:
+            return False
+        del self.lines[product_id]
+        self.save()
+        return True
+
+    def clear(self):
+        self._lines = {}
+        if self.key is not None:
+            cache.delete(self.key)
+
+    def merge_into(self, other):
+        """Suma este carrito a `other` (sin superar los límites) y lo vacía"""
+        for product_id, quantity in self.lines.items():
+            if product_id not in other.lines and len(other.lines) >= _max_items():
+                break
+            other.lines[product_id] = min(other.quantity(product_id) + quantity, _max_quantity())
+        other.save()
+        self.clear()
+
+
+def stale_legacy_items(now=None):
+    """Filas de CartItem sin cambios desde hace más de CART_TIMEOUT (carritos abandonados)"""
+    now = now or timezone.now()
+    return CartItem.objects.filter(updated_at__lt=now - timedelta(seconds=_timeout()))
+
+
+def merge_session_cart(request, user):
+    """Al iniciar sesión, el carrito anónimo pasa al carrito del usuario"""
+    session = getattr(request, 'session', None)
+    if session is None:
+        return
+    anonymous = Cart.for_session(session)
+    if anonymous is None:
+        return
+    if anonymous:
+        anonymous.merge_into(Cart.for_user(user))
+    else:
+        anonymous.clear()
+    session.pop(CART_SESSION_KEY, None)
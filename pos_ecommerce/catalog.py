@@ -0,0 +1,123 @@
+"""
+Catálogo de la tienda (e-commerce) del sistema POS + E-commerce de TemucoSoft S.A.
+
+Las páginas del catálogo (productos, facetas por categoría y paginación) se
+guardan en la cache bajo una versión de catálogo. Cada cambio en un Product
+o en una Company incrementa la versión (ver signals.py), con lo que todas
+las entradas anteriores dejan de usarse sin tener que buscarlas ni
+borrarlas: expiran solas por CATALOG_CACHE_TIMEOUT.
+"""
+import hashlib
+import math
+
+from django.core.cache import cache
+from django.db.models import Count
+from django.template.loader import render_to_string
+
+from .models import Product
+from .search import render_highlight, search_products
+
+CATALOG_VERSION_KEY = 'catalogo:version'
+CATALOG_CACHE_TIMEOUT = 60 * 15
+CATALOG_PAGE_SIZE = 24
+# Las búsquedas más largas se recortan: evita claves de cache sin límite
+CATALOG_SEARCH_MAX_LENGTH = 100
+
+
+def catalog_version():
+    """Versión actual del catálogo (se crea en 1 si la cache no la tiene)"""
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, 1, None)
+        version = cache.get(CATALOG_VERSION_KEY, 1)
+    return version
+
+
+def bump_catalog_version():
+    """Invalida todas las páginas del catálogo guardadas en la cache"""
+    cache.add(CATALOG_VERSION_KEY, 1, None)
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        # La clave expiró entre add() e incr()
+        cache.set(CATALOG_VERSION_KEY, 2, None)
+
+
+def normalize_filters(params):
+    """(categoría, búsqueda, página) válidos a partir de request.GET"""
+    category = params.get('category') or ''
+    if category not in dict(Product.CATEGORY_CHOICES):
+        category = ''
+    search = ' '.join((params.get('search') or '').split())[:CATALOG_SEARCH_MAX_LENGTH]
+    try:
+        page = max(1, int(params.get('page', 1)))
+    except (TypeError, ValueError):
+        page = 1
+    return category, search, page
+
+
+def catalog_queryset(search='', ranked=False):
+    """Productos activos de empresas activas, con la búsqueda aplicada (ver search.py)"""
+    products = Product.objects.filter(is_active=True, company__is_active=True)
+    if search:
+        products = search_products(products, search, ranked=ranked)
+    return products
+
+
+def get_catalog_page(category, search, page):
+    """
+    Página del catálogo ya renderizada, leída de la cache si existe.
+
+    Devuelve un dict con `products_html` (grilla de productos), `facets`
+    (lista de (valor, etiqueta, cantidad) para la búsqueda actual, sin el
+    filtro de categoría), `total`, `page` y `num_pages`.
+    """
+    digest = hashlib.md5(f'{category}|{search}|{page}'.encode()).hexdigest()
+    key = f'catalogo:{catalog_version()}:{digest}'
+    data = cache.get(key)
+    if data is None:
+        data = build_catalog_page(category, search, page)
+        cache.set(key, data, CATALOG_CACHE_TIMEOUT)
+    return data
+
+
+def build_catalog_page(category, search, page):
+    """Arma la página del catálogo con dos consultas (facetas y productos)"""
+    products = catalog_queryset(search)
+
+    counts = dict(
+        products.order_by().values_list('category').annotate(total=Count('id'))
+    )
+    facets = [
+        (value, label, counts.get(value, 0))
+        for value, label in Product.CATEGORY_CHOICES
+    ]
+    # El total sale de las facetas: no hace falta un COUNT(*) aparte
+    total = counts.get(category, 0) if category else sum(counts.values())
+    num_pages = max(1, math.ceil(total / CATALOG_PAGE_SIZE))
+    page = min(page, num_pages)
+
+    if search:
+        # Con búsqueda: por relevancia y con las coincidencias resaltadas
+        products = catalog_queryset(search, ranked=True)
+    else:
+        products = products.order_by('name', 'id')
+    if category:
+        products = products.filter(category=category)
+    offset = (page - 1) * CATALOG_PAGE_SIZE
+    page_products = list(
+        products.only('id', 'name', 'description', 'category', 'price')[offset:offset + CATALOG_PAGE_SIZE]
+    ) if total else []
+    for product in page_products:
+        product.name_html = render_highlight(getattr(product, 'name_highlight', None))
+        product.description_html = render_highlight(getattr(product, 'description_highlight', None))
+
+    return {
+        'products_html': render_to_string(
+            'shop/_catalogo_productos.html', {'products': page_products}
+        ),
+        'facets': facets,
+        'total': total,
+        'page': page,
+        'num_pages': num_pages,
+    }
@@ -0,0 +1,76 @@
+"""
+Limpieza de carritos abandonados y sesiones vencidas del sistema POS + E-commerce de TemucoSoft S.A.
+
+- Filas de CartItem de carritos abandonados (cart.stale_legacy_items): el
+  carrito ya no se guarda en la tabla, pero las filas antiguas que nadie
+  vuelve a leer no se traspasan nunca a la cache.
+- Sesiones vencidas de django_session (solo con los motores de sesión
+  que usan la base de datos). Desde que el carrito vive en la cache, mirar
+  el catálogo o el carrito vacío no crea sesión, pero las existentes
+  siguen ahí hasta vencer.
+
+Se borra de a `batch_size` filas por transacción, recorriendo la tabla
+por su clave primaria: ninguna transacción bloquea más que un lote y el
+resto de la aplicación sigue usando las tablas mientras tanto. A
+diferencia de `manage.py clearsessions`, que borra todo con un solo DELETE.
+
+Lo usa `manage.py cleanup_carts_and_sessions`.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import transaction
+from django.utils import timezone
+
+from .cart import stale_legacy_items
+
+CLEANUP_BATCH_SIZE = 1000
+
+DATABASE_SESSION_ENGINES = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+
+
+def delete_in_batches(queryset, batch_size=CLEANUP_BATCH_SIZE, pause=0):
+    """
+    Elimina las filas de `queryset` de a `batch_size` por transacción, en
+    orden de clave primaria, con `pause` segundos entre lotes. Devuelve
+    cuántas filas eliminó.
+    """
+    deleted = 0
+    last_pk = None
+    while True:
+        batch = queryset.order_by('pk')
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        ids = list(batch.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            # La condición se vuelve a aplicar: una fila que cambió entre la
+            # lectura y el borrado (p. ej. una sesión renovada) se conserva
+            deleted += queryset.filter(pk__in=ids).delete()[0]
+        if len(ids) < batch_size:
+            return deleted
+        last_pk = ids[-1]
+        if pause:
+            time.sleep(pause)
+
+
+def expired_sessions(now=None):
+    """Sesiones vencidas, o None si las sesiones no se guardan en la base de datos"""
+    if settings.SESSION_ENGINE not in DATABASE_SESSION_ENGINES:
+        return None
+    return Session.objects.filter(expire_date__lt=now or timezone.now())
+
+
+def cleanup(batch_size=CLEANUP_BATCH_SIZE, pause=0):
+    """Elimina carritos abandonados y sesiones vencidas; devuelve {'carts': n, 'sessions': n}"""
+    now = timezone.now()
+    sessions = expired_sessions(now)
+    return {
+        'carts': delete_in_batches(stale_legacy_items(now), batch_size, pause),
+        'sessions': delete_in_batches(sessions, batch_size, pause) if sessions is not None else 0,
+    }
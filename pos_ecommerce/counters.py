@@ -0,0 +1,198 @@
+"""
+Contadores del panel (dashboard) del sistema POS + E-commerce de TemucoSoft S.A.
+
+Los números del panel se guardan en la cache compartida, por plataforma,
+por empresa y por vendedor, y se ajustan con incr/decr al confirmarse cada
+alta, baja o cambio de stock (ver signals.py y services.py). Solo se
+ajustan claves que ya existen: si una falta, la siguiente lectura la
+calcula con una consulta a la base de datos.
+
+Cada clave vence a los COUNTER_TIMEOUT segundos, con lo que cualquier
+desvío (cambios hechos con QuerySet.update(), carreras entre un cálculo y
+un ajuste) dura como máximo ese tiempo. `manage.py reconcile_dashboard_counters`
+los recalcula todos de una vez (por ejemplo desde cron).
+"""
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Branch, Company, Inventory, Product, Sale, Subscription
+from .reports import local_day_start
+
+COUNTER_TIMEOUT = 60 * 60
+
+COMPANY_COUNTERS = ('products_count', 'branches_count', 'low_stock')
+PLATFORM_COUNTERS = ('companies_count', 'active_subscriptions')
+
+
+def company_key(company_id, name):
+    return f'panel:empresa:{company_id}:{name}'
+
+
+def platform_key(name):
+    return f'panel:plataforma:{name}'
+
+
+def seller_sales_key(user_id, day):
+    return f'panel:vendedor:{user_id}:ventas:{day.isoformat()}'
+
+
+# ============================================================================
+# Cálculo desde la base de datos (claves ausentes y reconciliación)
+# ============================================================================
+
+def compute_company_counter(company_id, name):
+    if name == 'products_count':
+        return Product.objects.filter(company_id=company_id).count()
+    if name == 'branches_count':
+        return Branch.objects.filter(company_id=company_id).count()
+    return Inventory.objects.filter(branch__company_id=company_id).needs_restock().count()
+
+
+def compute_platform_counter(name):
+    if name == 'companies_count':
+        return Company.objects.count()
+    return Subscription.objects.filter(active=True).count()
+
+
+def compute_seller_sales(user_id, day):
+    start, end = _day_bounds(day)
+    return Sale.objects.filter(user_id=user_id, created_at__gte=start, created_at__lt=end).count()
+
+
+def _day_bounds(day):
+    return local_day_start(day), local_day_start(day + timedelta(days=1))
+
+
+def read_counters(keys, compute):
+    """Lee varias claves; calcula y guarda las que falten"""
+    values = cache.get_many(list(keys))
+    for key, name in keys.items():
+        if key not in values:
+            values[key] = compute(name)
+            cache.add(key, values[key], COUNTER_TIMEOUT)
+    return {name: values[key] for key, name in keys.items()}
+
+
+# ============================================================================
+# Lectura para el panel
+# ============================================================================
+
+def company_counters(company_id):
+    """products_count, branches_count y low_stock de la empresa"""
+    return read_counters(
+        {company_key(company_id, name): name for name in COMPANY_COUNTERS},
+        lambda name: compute_company_counter(company_id, name)
+    )
+
+
+def platform_counters():
+    """companies_count y active_subscriptions de toda la plataforma"""
+    return read_counters({platform_key(name): name for name in PLATFORM_COUNTERS}, compute_platform_counter)
+
+
+def seller_sales_today(user_id):
+    day = timezone.localdate()
+    return read_counters(
+        {seller_sales_key(user_id, day): 'sales_today'},
+        lambda name: compute_seller_sales(user_id, day)
+    )['sales_today']
+
+
+# ============================================================================
+# Ajustes incrementales (al confirmar la transacción)
+# ============================================================================
+
+def _adjust_now(key, delta):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # La clave no existe: se calculará completa en la próxima lectura
+        pass
+
+
+def adjust(key, delta):
+    """Suma `delta` al contador si existe, una vez confirmada la transacción"""
+    if delta:
+        transaction.on_commit(lambda: _adjust_now(key, delta))
+
+
+def forget(key):
+    """Descarta el contador (se recalcula en la próxima lectura), al confirmar"""
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def low_stock_delta(previous, new, reorder_point):
+    """+1 si el inventario pasa a stock bajo, -1 si sale de él, 0 si no cambia"""
+    return int(new <= reorder_point) - int(previous <= reorder_point)
+
+
+def record_low_stock_changes(company_id, changes):
+    """Ajusta low_stock de la empresa con varios cambios (stock_anterior, stock_nuevo, punto_reorden)"""
+    adjust(
+        company_key(company_id, 'low_stock'),
+        sum(low_stock_delta(*change) for change in changes)
+    )
+
+
+def record_sales(user_id, created_ats):
+    """Suma ventas nuevas al contador diario del vendedor"""
+    if not user_id:
+        return
+    per_day = {}
+    for created_at in created_ats:
+        day = timezone.localdate(created_at)
+        per_day[day] = per_day.get(day, 0) + 1
+    for day, count in per_day.items():
+        adjust(seller_sales_key(user_id, day), count)
+
+
+def branch_company_id(branch_id):
+    """Empresa de una sucursal (no cambia nunca, se guarda sin vencimiento)"""
+    key = f'panel:sucursal:{branch_id}:empresa'
+    company_id = cache.get(key)
+    if company_id is None:
+        company_id = Branch.objects.filter(pk=branch_id).values_list('company_id', flat=True).first()
+        if company_id is not None:
+            cache.set(key, company_id, None)
+    return company_id
+
+
+# ============================================================================
+# Reconciliación
+# ============================================================================
+
+def reconcile():
+    """Recalcula todos los contadores con consultas agrupadas. Devuelve cuántos escribió"""
+    company_ids = list(Company.objects.values_list('id', flat=True))
+    grouped = {
+        'products_count': dict(
+            Product.objects.order_by().values_list('company_id').annotate(total=Count('id'))
+        ),
+        'branches_count': dict(
+            Branch.objects.order_by().values_list('company_id').annotate(total=Count('id'))
+        ),
+        'low_stock': dict(
+            Inventory.objects.needs_restock().order_by().values_list('branch__company_id').annotate(
+                total=Count('id')
+            )
+        ),
+    }
+    values = {
+        company_key(company_id, name): grouped[name].get(company_id, 0)
+        for company_id in company_ids for name in COMPANY_COUNTERS
+    }
+    values.update({platform_key(name): compute_platform_counter(name) for name in PLATFORM_COUNTERS})
+
+    day = timezone.localdate()
+    start, end = _day_bounds(day)
+    sellers = Sale.objects.filter(
+        created_at__gte=start, created_at__lt=end, user__isnull=False
+    ).order_by().values_list('user_id').annotate(total=Count('id'))
+    values.update({seller_sales_key(user_id, day): total for user_id, total in sellers})
+
+    cache.set_many(values, COUNTER_TIMEOUT)
+    return len(values)
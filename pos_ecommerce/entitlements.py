@@ -0,0 +1,197 @@
+"""
+Planes de suscripción (entitlements) del sistema POS + E-commerce de TemucoSoft S.A.
+
+El plan de cada empresa (límites y funcionalidades de su Subscription) y su
+uso actual (sucursales y usuarios activos) se guardan en la cache, con lo
+que revisar un permiso o un límite cuesta solo lecturas de la cache:
+
+- `plan:empresa:<id>`: se descarta al confirmarse cualquier cambio de la
+  suscripción (signals.py).
+- `plan:empresa:<id>:uso:<recurso>`: se ajusta con incr/decr al crear o
+  eliminar sucursales y usuarios activos, y se descarta (se recuenta en la
+  próxima lectura) cuando cambia su estado. Igual que los contadores del
+  panel (counters.py), vence a los PLAN_CACHE_TIMEOUT segundos.
+
+Las empresas sin Subscription (creadas antes de los planes o fuera de
+superadmin_create_company) no tienen límites. Con la suscripción vencida o
+inactiva se pierden las funcionalidades (API, reportes), no los datos.
+
+Dos altas simultáneas pueden superar un límite por uno: los límites son
+comerciales y no justifican bloquear la fila de la suscripción.
+"""
+from functools import wraps
+
+from django.contrib import messages
+from django.core.cache import cache
+from django.shortcuts import redirect
+from django.utils import timezone
+
+from . import counters
+from .models import Branch, Subscription, User
+
+PLAN_CACHE_TIMEOUT = 60 * 60
+
+PLAN_FIELDS = (
+    'plan_name', 'active', 'start_date', 'end_date', 'max_branches', 'max_users',
+    'has_api_access', 'has_reports',
+)
+
+# Recurso -> (campo del límite, nombre para los mensajes)
+LIMITS = {
+    'branches': ('max_branches', 'sucursales activas'),
+    'users': ('max_users', 'usuarios activos'),
+}
+
+FEATURE_NAMES = {
+    'has_api_access': 'acceso a la API',
+    'has_reports': 'reportes',
+}
+
+# Marca "la empresa no tiene suscripción" en la cache (cache.get() devuelve None
+# también cuando la clave no existe)
+_NO_PLAN = 'sin-plan'
+
+
+def plan_key(company_id):
+    return f'plan:empresa:{int(company_id)}'
+
+
+def usage_key(company_id, resource):
+    return f'plan:empresa:{int(company_id)}:uso:{resource}'
+
+
+# ============================================================================
+# Plan de la empresa
+# ============================================================================
+
+def company_plans(company_ids):
+    """
+    {company_id: plan} para varias empresas (dict con PLAN_FIELDS, o None sin
+    suscripción). Los ids se normalizan a int: un id recibido como texto
+    (p. ej. desde request.POST) no debe guardar "sin plan" bajo la clave
+    de la empresa porque no coincide con el id entero de la consulta.
+    """
+    keys = {plan_key(company_id): int(company_id) for company_id in company_ids}
+    cached = cache.get_many(list(keys))
+    plans = {keys[key]: value for key, value in cached.items()}
+    missing = [company_id for company_id in keys.values() if company_id not in plans]
+    if missing:
+        found = {
+            row['company_id']: row
+            for row in Subscription.objects.filter(company_id__in=missing).values('company_id', *PLAN_FIELDS)
+        }
+        new = {}
+        for company_id in missing:
+            plan = found.get(company_id)
+            if plan is not None:
+                plan.pop('company_id')
+            plans[company_id] = new[plan_key(company_id)] = plan or _NO_PLAN
+        cache.set_many(new, PLAN_CACHE_TIMEOUT)
+    return {company_id: (None if plan == _NO_PLAN else plan) for company_id, plan in plans.items()}
+
+
+def company_plan(company_id):
+    """Plan de la empresa (dict con PLAN_FIELDS) o None si no tiene suscripción"""
+    return company_plans([company_id])[int(company_id)]
+
+
+def plan_is_valid(plan):
+    """Misma regla que Subscription.is_valid(), sobre el plan cacheado"""
+    today = timezone.now().date()
+    return bool(plan) and plan['active'] and plan['start_date'] <= today <= plan['end_date']
+
+
+def forget_plan(company_id):
+    counters.forget(plan_key(company_id))
+
+
+# ============================================================================
+# Uso actual (sucursales y usuarios activos)
+# ============================================================================
+
+def compute_usage(company_id, resource):
+    model = Branch if resource == 'branches' else User
+    return model.objects.filter(company_id=company_id, is_active=True).count()
+
+
+def company_usage(company_id):
+    """{'branches': n, 'users': n} activos de la empresa"""
+    return counters.read_counters(
+        {usage_key(company_id, resource): resource for resource in LIMITS},
+        lambda resource: compute_usage(company_id, resource)
+    )
+
+
+def record_usage_change(company_id, resource, delta):
+    """Ajusta el uso al confirmar (+1 alta activa, -1 baja activa)"""
+    if company_id:
+        counters.adjust(usage_key(company_id, resource), delta)
+
+
+def forget_usage(company_id, resource):
+    if company_id:
+        counters.forget(usage_key(company_id, resource))
+
+
+# ============================================================================
+# Verificaciones
+# ============================================================================
+
+def has_feature(company_id, feature):
+    """
+    True si el plan vigente de la empresa incluye la funcionalidad
+    (has_api_access, has_reports). Sin empresa (SUPER_ADMIN, clientes
+    finales) o sin suscripción no se restringe.
+    """
+    if not company_id:
+        return True
+    plan = company_plan(company_id)
+    if plan is None:
+        return True
+    return plan_is_valid(plan) and plan[feature]
+
+
+def feature_error(company_id, feature):
+    """Mensaje de error si el plan no incluye la funcionalidad, o None"""
+    if has_feature(company_id, feature):
+        return None
+    return f'El plan de la empresa no incluye {FEATURE_NAMES[feature]} o la suscripción no está vigente'
+
+
+def limit_error(company_id, resource):
+    """Mensaje de error si agregar un recurso activo supera el límite del plan, o None"""
+    if not company_id:
+        return None
+    plan = company_plan(company_id)
+    if plan is None:
+        return None
+    field, label = LIMITS[resource]
+    if company_usage(company_id)[resource] + 1 > plan[field]:
+        return f'El plan {plan["plan_name"]} permite como máximo {plan[field]} {label}'
+    return None
+
+
+def adds_active(instance, is_active, company_id):
+    """
+    True si guardar `instance` activo en `company_id` suma un recurso activo
+    a esa empresa (alta, reactivación o cambio de empresa)
+    """
+    if not is_active:
+        return False
+    if instance is None or instance.pk is None:
+        return True
+    return not instance.is_active or instance.company_id != company_id
+
+
+def plan_feature_required(feature):
+    """Decorador de vistas HTML: redirige al panel si el plan no incluye la funcionalidad"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            error = feature_error(request.user.company_id, feature)
+            if error:
+                messages.error(request, error)
+                return redirect('dashboard')
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
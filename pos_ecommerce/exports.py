@@ -0,0 +1,91 @@
+"""
+Exportación de reportes del sistema POS + E-commerce de TemucoSoft S.A.
+
+Los reportes aceptan `?format=csv|ndjson` y se envían como
+StreamingHttpResponse: las filas se leen con `values_list(...).iterator()`
+en bloques de EXPORT_CHUNK_SIZE y se escriben a medida que llegan, de modo
+que la memoria usada no depende del tamaño del reporte.
+"""
+import csv
+import json
+from datetime import datetime
+from decimal import Decimal
+from itertools import chain
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+EXPORT_FORMATS = ('csv', 'ndjson')
+EXPORT_CHUNK_SIZE = 2000
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+}
+
+
+class _Echo:
+    """Pseudo-archivo para csv.writer: devuelve la línea en vez de guardarla"""
+
+    def write(self, value):
+        return value
+
+
+def get_export_format(request):
+    """Formato de exportación pedido en ?format=, o None para HTML"""
+    export_format = request.GET.get('format')
+    return export_format if export_format in EXPORT_FORMATS else None
+
+
+def export_query(request):
+    """Query string actual sin `format`, para armar los enlaces de descarga"""
+    params = request.GET.copy()
+    params.pop('format', None)
+    return params.urlencode()
+
+
+def stream_export(export_format, name, columns, rows):
+    """
+    Respuesta en streaming con `rows` (iterable de tuplas en el orden de
+    `columns`) como CSV con encabezado o como un objeto JSON por línea.
+    """
+    response = StreamingHttpResponse(
+        render_rows(export_format, columns, rows), content_type=CONTENT_TYPES[export_format]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(name, export_format)}"'
+    # Nginx no debe acumular la respuesta: se entrega a medida que se genera
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def render_rows(export_format, columns, rows):
+    """Genera el contenido línea a línea (CSV con encabezado o NDJSON)"""
+    if export_format == 'csv':
+        writer = csv.writer(_Echo())
+        return (
+            writer.writerow(row)
+            for row in chain([columns], (_normalize(row) for row in rows))
+        )
+    return (
+        json.dumps(dict(zip(columns, _normalize(row))), ensure_ascii=False) + '\n'
+        for row in rows
+    )
+
+
+def export_filename(name, export_format):
+    return f'{name}_{timezone.localdate():%Y%m%d}.{export_format}'
+
+
+def _normalize(row):
+    return [_normalize_value(value) for value in row]
+
+
+def _normalize_value(value):
+    """Fechas en hora local ISO 8601 y decimales como texto exacto"""
+    if isinstance(value, datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
@@ -0,0 +1,34 @@
+"""
+Elimina por lotes los carritos abandonados que quedaron en la tabla
+CartItem y las sesiones vencidas (ver pos_ecommerce/cleanup.py). Pensado
+para ejecutarse periódicamente, por ejemplo una vez al día desde cron, en
+lugar de `manage.py clearsessions`.
+
+Uso:
+    python manage.py cleanup_carts_and_sessions
+    python manage.py cleanup_carts_and_sessions --batch-size 500 --pause 0.1
+"""
+from django.core.management.base import BaseCommand
+
+from pos_ecommerce.cleanup import CLEANUP_BATCH_SIZE, cleanup
+
+
+class Command(BaseCommand):
+    help = 'Elimina por lotes carritos abandonados y sesiones vencidas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=CLEANUP_BATCH_SIZE,
+            help=f'Filas por transacción (por defecto {CLEANUP_BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0.0,
+            help='Segundos de espera entre lotes, para repartir la carga (por defecto 0)'
+        )
+
+    def handle(self, *args, **options):
+        deleted = cleanup(batch_size=options['batch_size'], pause=options['pause'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Carritos abandonados eliminados: {deleted['carts']} filas; "
+            f"sesiones vencidas eliminadas: {deleted['sessions']}"
+        ))
@@ -0,0 +1,63 @@
+"""
+Muestra el plan de ejecución (EXPLAIN) de las consultas de los listados de
+la API y de los reportes, ejecutados como un usuario dado (ver
+pos_ecommerce/query_plans.py). Nada se escribe en la base de datos.
+
+Uso:
+    python manage.py explain_queries --user admin_empresa
+    python manage.py explain_queries --user admin_empresa --verbose
+    python manage.py explain_queries --user admin_empresa --path /api/sales/?branch=1
+    python manage.py explain_queries --user admin_empresa --fail-on-seq-scan
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from pos_ecommerce.models import User
+from pos_ecommerce.query_plans import check_endpoints, regressions
+
+
+class Command(BaseCommand):
+    help = 'Muestra el plan de las consultas de los endpoints y marca los recorridos secuenciales'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', required=True, help='Usuario (username) con el que se ejecutan los endpoints')
+        parser.add_argument(
+            '--path', action='append', dest='paths',
+            help='Endpoint a revisar (se puede repetir). Por defecto, todos los listados y reportes'
+        )
+        parser.add_argument('--verbose', action='store_true', help='Muestra el SQL y el plan de cada consulta')
+        parser.add_argument(
+            '--prefer-indexes', action='store_true',
+            help='PostgreSQL: desactiva enable_seqscan (útil con bases chicas, p. ej. en CI)'
+        )
+        parser.add_argument(
+            '--fail-on-seq-scan', action='store_true',
+            help='Termina con error si hay regresiones (para CI)'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"No existe el usuario {options['user']}")
+
+        report = check_endpoints(user, paths=options['paths'], prefer_indexes=options['prefer_indexes'])
+        for endpoint in report:
+            self.stdout.write(f"{endpoint['path']} [{endpoint['status']}] {len(endpoint['queries'])} consultas")
+            for query in endpoint['queries']:
+                if options['verbose']:
+                    self.stdout.write(f"  {query['sql']}")
+                    for line in query['plan']:
+                        self.stdout.write(f'      {line}')
+                if query['seq_scans']:
+                    self.stdout.write(self.style.WARNING(
+                        f"  recorrido secuencial: {', '.join(query['seq_scans'])}"
+                    ))
+
+        problems = regressions(report)
+        if not problems:
+            self.stdout.write(self.style.SUCCESS('Sin regresiones en los planes de consultas'))
+            return
+        for problem in problems:
+            self.stdout.write(self.style.WARNING(problem))
+        if options['fail_on_seq_scan']:
+            raise CommandError(f'{len(problems)} regresiones en los planes de consultas')
@@ -0,0 +1,33 @@
+"""
+Reconstruye el resumen diario de movimientos (InventoryMovementDailySummary)
+desde el libro de movimientos de inventario.
+
+Uso:
+    python manage.py rebuild_movement_summary
+    python manage.py rebuild_movement_summary --company 3
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from pos_ecommerce.models import Company, Inventory, InventoryMovementDailySummary
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el resumen diario de movimientos por inventario, día y tipo'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--company',
+            type=int,
+            help='ID de la empresa a reconstruir (por defecto, todas)'
+        )
+
+    def handle(self, *args, **options):
+        inventories = None
+        company_id = options.get('company')
+        if company_id:
+            if not Company.objects.filter(pk=company_id).exists():
+                raise CommandError(f'Empresa {company_id} no encontrada')
+            inventories = Inventory.objects.filter(branch__company_id=company_id)
+
+        rows = InventoryMovementDailySummary.rebuild(inventories)
+        self.stdout.write(self.style.SUCCESS(f'Resumen de movimientos reconstruido: {rows} filas'))
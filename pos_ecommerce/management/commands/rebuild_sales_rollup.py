@@ -0,0 +1,32 @@
+"""
+Reconstruye el resumen diario de ventas (SalesDailyRollup) desde la tabla de ventas.
+
+Uso:
+    python manage.py rebuild_sales_rollup
+    python manage.py rebuild_sales_rollup --company 3
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from pos_ecommerce.models import Branch, Company, SalesDailyRollup
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el resumen diario de ventas por sucursal, día y método de pago'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--company',
+            type=int,
+            help='ID de la empresa a reconstruir (por defecto, todas)'
+        )
+
+    def handle(self, *args, **options):
+        branches = None
+        company_id = options.get('company')
+        if company_id:
+            if not Company.objects.filter(pk=company_id).exists():
+                raise CommandError(f'Empresa {company_id} no encontrada')
+            branches = Branch.objects.filter(company_id=company_id)
+
+        rows = SalesDailyRollup.rebuild(branches)
+        self.stdout.write(self.style.SUCCESS(f'Resumen diario reconstruido: {rows} filas'))
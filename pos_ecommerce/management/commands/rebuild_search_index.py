@@ -0,0 +1,24 @@
+"""
+Reconstruye el índice de búsqueda de productos (ver pos_ecommerce/search.py).
+Vuelve a crear lo que falte (triggers de SQLite, columna o índice de
+PostgreSQL) y reindexa todos los productos.
+
+Uso:
+    python manage.py rebuild_search_index
+"""
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from pos_ecommerce.models import Product
+from pos_ecommerce.search import install_search_index
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye el índice de texto completo de productos'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            install_search_index(connection)
+        self.stdout.write(self.style.SUCCESS(
+            f'Índice de búsqueda reconstruido: {Product.objects.count()} productos'
+        ))
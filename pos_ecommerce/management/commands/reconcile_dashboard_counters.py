@@ -0,0 +1,19 @@
+"""
+Recalcula los contadores del panel guardados en la cache (ver
+pos_ecommerce/counters.py). Pensado para ejecutarse periódicamente, por
+ejemplo cada 15 minutos desde cron.
+
+Uso:
+    python manage.py reconcile_dashboard_counters
+"""
+from django.core.management.base import BaseCommand
+
+from pos_ecommerce.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los contadores del panel desde la base de datos'
+
+    def handle(self, *args, **options):
+        written = reconcile()
+        self.stdout.write(self.style.SUCCESS(f'Contadores del panel recalculados: {written} claves'))
@@ -0,0 +1,27 @@
+"""
+Libera las reservas de stock vencidas de las órdenes e-commerce (ver
+pos_ecommerce/reservations.py). Pensado para ejecutarse periódicamente, por
+ejemplo cada 5 minutos desde cron. Cada lote es una transacción corta; las
+reservas que otra transacción tiene tomadas quedan para la próxima pasada.
+
+Uso:
+    python manage.py release_expired_reservations
+    python manage.py release_expired_reservations --batch-size 200
+"""
+from django.core.management.base import BaseCommand
+
+from pos_ecommerce.reservations import SWEEP_BATCH_SIZE, release_expired
+
+
+class Command(BaseCommand):
+    help = 'Libera por lotes las reservas de stock vencidas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=SWEEP_BATCH_SIZE,
+            help=f'Reservas por transacción (por defecto {SWEEP_BATCH_SIZE})'
+        )
+
+    def handle(self, *args, **options):
+        released = release_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Reservas vencidas liberadas: {released}'))
@@ -0,0 +1,87 @@
+"""
+Worker de reportes en segundo plano (ReportJob).
+
+Procesa los trabajos pendientes uno a uno, fuera de los workers de Gunicorn,
+y elimina los resultados vencidos (REPORT_JOBS_RETENTION_DAYS) cuando no
+hay trabajo. Se pueden levantar varios workers: cada trabajo lo toma uno solo.
+
+Uso:
+    python manage.py run_report_worker
+    python manage.py run_report_worker --once    # procesa lo pendiente y termina
+"""
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from pos_ecommerce.models import ReportJob
+from pos_ecommerce.reports import run_report_job
+
+
+class Command(BaseCommand):
+    help = 'Procesa los reportes solicitados en segundo plano'
+
+    PURGE_INTERVAL = 60 * 60  # segundos entre limpiezas de resultados vencidos
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Procesar los trabajos pendientes y terminar'
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=2.0,
+            help='Segundos de espera cuando no hay trabajos (por defecto 2)'
+        )
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        previous_handlers = {
+            signum: signal.signal(signum, self.stop) for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+
+        last_purge = 0
+        processed = 0
+        try:
+            while not self.stopping:
+                job = ReportJob.claim_next()
+                if job is not None:
+                    self.run(job)
+                    processed += 1
+                    continue
+
+                if options['once']:
+                    break
+                if time.monotonic() - last_purge > self.PURGE_INTERVAL:
+                    purged = ReportJob.purge_expired()
+                    if purged:
+                        self.stdout.write(f'Reportes vencidos eliminados: {purged}')
+                    last_purge = time.monotonic()
+                time.sleep(options['sleep'])
+                # Tras esperar, descartar conexiones vencidas o cortadas por la base
+                close_old_connections()
+        finally:
+            for signum, handler in previous_handlers.items():
+                signal.signal(signum, handler)
+
+        self.stdout.write(self.style.SUCCESS(f'Worker detenido. Reportes procesados: {processed}'))
+
+    def run(self, job):
+        started = time.monotonic()
+        try:
+            run_report_job(job)
+        except Exception as e:
+            # El trabajo queda en ERROR y el detalle en el log; el worker sigue con el siguiente
+            self.stderr.write(f'Reporte {job.pk} falló: {e}')
+            return
+        self.stdout.write(
+            f'Reporte {job.pk} ({job.report_type}): {job.row_count} filas '
+            f'en {time.monotonic() - started:.1f}s'
+        )
+
+    def stop(self, signum, frame):
+        # Termina el trabajo en curso antes de salir
+        self.stopping = True
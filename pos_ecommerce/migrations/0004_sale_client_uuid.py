@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_ecommerce', '0003_inventorymovement'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sale',
+            name='client_uuid',
+            field=models.UUIDField(blank=True, help_text='UUID generado por el terminal POS para sincronización idempotente', null=True, unique=True),
+        ),
+    ]
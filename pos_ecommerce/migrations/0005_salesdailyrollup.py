@@ -0,0 +1,56 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:43
+
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def poblar_resumen(apps, schema_editor):
+    """Carga el resumen diario con las ventas existentes"""
+    Sale = apps.get_model('pos_ecommerce', 'Sale')
+    SalesDailyRollup = apps.get_model('pos_ecommerce', 'SalesDailyRollup')
+    grouped = Sale.objects.annotate(
+        business_date=TruncDate('created_at')
+    ).values('branch_id', 'business_date', 'payment_method').annotate(
+        sales_count=models.Count('id'),
+        amount=models.Sum('total_amount')
+    ).order_by()
+    SalesDailyRollup.objects.bulk_create([
+        SalesDailyRollup(
+            branch_id=row['branch_id'],
+            business_date=row['business_date'],
+            payment_method=row['payment_method'],
+            sales_count=row['sales_count'],
+            total_amount=row['amount'] or 0
+        )
+        for row in grouped
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_ecommerce', '0004_sale_client_uuid'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('business_date', models.DateField(verbose_name='Día comercial')),
+                ('payment_method', models.CharField(choices=[('EFECTIVO', 'Efectivo'), ('TARJETA_DEBITO', 'Tarjeta de Débito'), ('TARJETA_CREDITO', 'Tarjeta de Crédito'), ('TRANSFERENCIA', 'Transferencia')], max_length=20)),
+                ('sales_count', models.IntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('branch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='pos_ecommerce.branch')),
+            ],
+            options={
+                'verbose_name': 'Resumen Diario de Ventas',
+                'verbose_name_plural': 'Resúmenes Diarios de Ventas',
+                'ordering': ['business_date'],
+                'unique_together': {('branch', 'business_date', 'payment_method')},
+            },
+        ),
+        migrations.RunPython(poblar_resumen, migrations.RunPython.noop),
+    ]
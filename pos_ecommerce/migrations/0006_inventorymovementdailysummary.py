@@ -0,0 +1,56 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:44
+
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+import django.db.models.deletion
+
+
+def poblar_resumen(apps, schema_editor):
+    """Carga el resumen diario con los movimientos existentes"""
+    InventoryMovement = apps.get_model('pos_ecommerce', 'InventoryMovement')
+    InventoryMovementDailySummary = apps.get_model('pos_ecommerce', 'InventoryMovementDailySummary')
+    grouped = InventoryMovement.objects.annotate(
+        day=TruncDate('created_at')
+    ).values('inventory_id', 'movement_type', 'day').annotate(
+        movement_count=models.Count('id'),
+        quantity=models.Sum('quantity')
+    ).order_by()
+    InventoryMovementDailySummary.objects.bulk_create([
+        InventoryMovementDailySummary(
+            inventory_id=row['inventory_id'],
+            movement_type=row['movement_type'],
+            day=row['day'],
+            movement_count=row['movement_count'],
+            total_quantity=row['quantity'] or 0
+        )
+        for row in grouped
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_ecommerce', '0005_salesdailyrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryMovementDailySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('movement_type', models.CharField(choices=[('COMPRA', 'Ingreso por Compra'), ('VENTA', 'Salida por Venta'), ('AJUSTE_POSITIVO', 'Ajuste Positivo'), ('AJUSTE_NEGATIVO', 'Ajuste Negativo'), ('DEVOLUCION', 'Devolución'), ('TRANSFERENCIA_IN', 'Transferencia Entrada'), ('TRANSFERENCIA_OUT', 'Transferencia Salida')], max_length=20)),
+                ('day', models.DateField(verbose_name='Día')),
+                ('movement_count', models.IntegerField(default=0)),
+                ('total_quantity', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('inventory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_movements', to='pos_ecommerce.inventory')),
+            ],
+            options={
+                'verbose_name': 'Resumen Diario de Movimientos',
+                'verbose_name_plural': 'Resúmenes Diarios de Movimientos',
+                'ordering': ['day'],
+                'unique_together': {('inventory', 'movement_type', 'day')},
+            },
+        ),
+        migrations.RunPython(poblar_resumen, migrations.RunPython.noop),
+    ]
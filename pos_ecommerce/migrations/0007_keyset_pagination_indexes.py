@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_ecommerce', '0006_inventorymovementdailysummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inventorymovement',
+            index=models.Index(fields=['created_at', 'id'], name='pos_movement_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at', 'id'], name='pos_order_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['created_at', 'id'], name='pos_payment_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['created_at', 'id'], name='pos_sale_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-17 02:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_ecommerce', '0007_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('report_type', models.CharField(choices=[('STOCK', 'Stock por Sucursal'), ('VENTAS', 'Ventas'), ('PROVEEDORES', 'Proveedores'), ('MOVIMIENTOS', 'Movimientos de Inventario')], max_length=15)),
+                ('export_format', models.CharField(choices=[('csv', 'CSV'), ('ndjson', 'NDJSON')], default='csv', max_length=10)),
+                ('params', models.JSONField(blank=True, default=dict, help_text='Filtros del reporte (branch, date_from, ...)')),
+                ('status', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('EN_PROCESO', 'En Proceso'), ('COMPLETADO', 'Completado'), ('ERROR', 'Error')], default='PENDIENTE', max_length=15)),
+                ('result_file', models.CharField(blank=True, help_text='Ruta relativa a REPORT_JOBS_ROOT', max_length=255)),
+                ('row_count', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='report_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Trabajo de Reporte',
+                'verbose_name_plural': 'Trabajos de Reporte',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='pos_reportjob_queue_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,95 @@
+from django.db import migrations
+
+# SQL congelado al momento de esta migración: no depende de
+# pos_ecommerce.search, que puede cambiar después sin alterar el historial.
+# `manage.py rebuild_search_index` instala la versión actual del índice.
+
+POSTGRESQL_INSTALL = [
+    'CREATE EXTENSION IF NOT EXISTS unaccent',
+    """
+    DO $$ BEGIN
+        IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = 'spanish_unaccent') THEN
+            CREATE TEXT SEARCH CONFIGURATION spanish_unaccent (COPY = spanish);
+            ALTER TEXT SEARCH CONFIGURATION spanish_unaccent
+                ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem;
+        END IF;
+    END $$
+    """,
+    """
+    ALTER TABLE "pos_ecommerce_product" ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('spanish_unaccent'::regconfig, coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('spanish_unaccent'::regconfig, coalesce(sku, '')), 'A') ||
+        setweight(to_tsvector('spanish_unaccent'::regconfig, coalesce(description, '')), 'B')
+    ) STORED
+    """,
+    'CREATE INDEX IF NOT EXISTS pos_product_search_idx ON "pos_ecommerce_product" USING GIN (search_vector)',
+]
+
+POSTGRESQL_DROP = [
+    'DROP INDEX IF EXISTS pos_product_search_idx',
+    'ALTER TABLE "pos_ecommerce_product" DROP COLUMN IF EXISTS search_vector',
+]
+
+SQLITE_INSTALL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS pos_product_fts USING fts5(
+        name, sku, description, content="pos_ecommerce_product", content_rowid=id,
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS pos_product_fts_ai AFTER INSERT ON "pos_ecommerce_product" BEGIN
+        INSERT INTO pos_product_fts(rowid, name, sku, description)
+        VALUES (new.id, new.name, new.sku, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS pos_product_fts_ad AFTER DELETE ON "pos_ecommerce_product" BEGIN
+        INSERT INTO pos_product_fts(pos_product_fts, rowid, name, sku, description)
+        VALUES ('delete', old.id, old.name, old.sku, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS pos_product_fts_au AFTER UPDATE ON "pos_ecommerce_product" BEGIN
+        INSERT INTO pos_product_fts(pos_product_fts, rowid, name, sku, description)
+        VALUES ('delete', old.id, old.name, old.sku, old.description);
+        INSERT INTO pos_product_fts(rowid, name, sku, description)
+        VALUES (new.id, new.name, new.sku, new.description);
+    END
+    """,
+    "INSERT INTO pos_product_fts(pos_product_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS pos_product_fts_ai',
+    'DROP TRIGGER IF EXISTS pos_product_fts_ad',
+    'DROP TRIGGER IF EXISTS pos_product_fts_au',
+    'DROP TABLE IF EXISTS pos_product_fts',
+]
+
+
+def ejecutar(schema_editor, statements_by_vendor):
+    statements = statements_by_vendor.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement, params=None)
+
+
+def crear_indice(apps, schema_editor):
+    """Columna tsvector + GIN en PostgreSQL, tabla FTS5 con triggers en SQLite"""
+    ejecutar(schema_editor, {'postgresql': POSTGRESQL_INSTALL, 'sqlite': SQLITE_INSTALL})
+
+
+def eliminar_indice(apps, schema_editor):
+    ejecutar(schema_editor, {'postgresql': POSTGRESQL_DROP, 'sqlite': SQLITE_DROP})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_ecommerce', '0008_reportjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(crear_indice, eliminar_indice),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_ecommerce', '0009_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='inventory',
+            index=models.Index(condition=models.Q(('stock__lte', models.F('reorder_point'))), fields=['branch', 'stock'], name='pos_inventory_restock_idx'),
+        ),
+    ]
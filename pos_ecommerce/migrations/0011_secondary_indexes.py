@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_ecommerce', '0010_inventory_restock_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cartitem',
+            index=models.Index(fields=['session_key', 'product'], name='pos_cart_session_product_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cartitem',
+            index=models.Index(fields=['user', 'product'], name='pos_cart_user_product_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='inventorymovement',
+            index=models.Index(fields=['inventory', 'created_at'], name='pos_movement_inv_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['company', 'status', 'created_at'], name='pos_order_company_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['status', 'created_at'], name='pos_payment_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['supplier', 'purchase_date'], name='pos_purchase_supplier_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['branch', 'created_at'], name='pos_sale_branch_created_idx'),
+        ),
+    ]
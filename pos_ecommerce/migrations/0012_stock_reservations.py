@@ -0,0 +1,37 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:21
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_ecommerce', '0011_secondary_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='inventory',
+            name='reserved',
+            field=models.IntegerField(default=0, help_text='Unidades reservadas por órdenes e-commerce pendientes (ver reservations.py)', validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(validators=[django.core.validators.MinValueValidator(1)])),
+                ('status', models.CharField(choices=[('ACTIVA', 'Activa'), ('CONSUMIDA', 'Consumida'), ('LIBERADA', 'Liberada'), ('VENCIDA', 'Vencida')], default='ACTIVA', max_length=10)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('inventory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='pos_ecommerce.inventory')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='pos_ecommerce.order')),
+            ],
+            options={
+                'verbose_name': 'Reserva de Stock',
+                'verbose_name_plural': 'Reservas de Stock',
+                'indexes': [models.Index(condition=models.Q(('status', 'ACTIVA')), fields=['expires_at'], name='pos_reservation_expiry_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pos_ecommerce', '0012_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reportjob',
+            name='attempts',
+            field=models.IntegerField(default=0, help_text='Veces que un worker tomó el trabajo'),
+        ),
+    ]
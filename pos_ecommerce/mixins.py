@@ -0,0 +1,221 @@
+"""
+Mixins reutilizables para los ViewSets del sistema POS + E-commerce.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers, status
+from rest_framework.response import Response
+
+
+class IdempotentMixin:
+    """
+    Soporte de cabecera Idempotency-Key para acciones de escritura.
+
+    La primera respuesta (no 5xx) de cada clave se guarda en la cache junto
+    con la huella del request; los reintentos con la misma clave reciben esa
+    respuesta sin volver a ejecutar la acción. Las claves son por usuario (o
+    sesión) y expiran tras IDEMPOTENCY_KEY_TTL segundos.
+
+    Uso: declarar `idempotent_actions = ['create', 'checkout', ...]`.
+
+    El bloqueo de un request en curso usa cache.add, que debe ser atómico
+    entre los workers: Redis, Memcached o la cache en base de datos (la
+    clave primaria rechaza el segundo INSERT). La cache en disco y la dummy
+    no lo son y check_idempotency_cache las rechaza; la de memoria local
+    solo sirve con un único proceso (desarrollo y tests).
+    """
+    idempotent_actions = []
+    IDEMPOTENCY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+    IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._idempotency_key = None
+
+        key = request.META.get(self.IDEMPOTENCY_HEADER)
+        if not key or self.action not in self.idempotent_actions:
+            return
+        if len(key) > 255:
+            self._replace_handler(request, Response(
+                {'error': 'Idempotency-Key no puede superar 255 caracteres'},
+                status=status.HTTP_400_BAD_REQUEST
+            ))
+            return
+
+        cache_key = self._idempotency_cache_key(request, key)
+        if cache_key is None:
+            return  # Sin usuario ni sesión no hay a quién asociar la clave
+        fingerprint = self._idempotency_fingerprint(request)
+        stored = cache.get(cache_key)
+
+        if stored is not None:
+            if stored['fingerprint'] != fingerprint:
+                response = Response(
+                    {'error': 'Idempotency-Key ya fue usada con otro request'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            else:
+                response = Response(stored['data'], status=stored['status'])
+                response['Idempotent-Replayed'] = 'true'
+            self._replace_handler(request, response)
+            return
+
+        # Evita que dos reintentos simultáneos ejecuten la acción en paralelo
+        if not cache.add(f'{cache_key}:lock', 1, self.IDEMPOTENCY_LOCK_TIMEOUT):
+            self._replace_handler(request, Response(
+                {'error': 'Hay un request en curso con la misma Idempotency-Key'},
+                status=status.HTTP_409_CONFLICT
+            ))
+            return
+
+        self._idempotency_key = (cache_key, fingerprint)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        idempotency = getattr(self, '_idempotency_key', None)
+        if idempotency is not None:
+            cache_key, fingerprint = idempotency
+            if response.status_code < 500:
+                cache.set(cache_key, {
+                    'fingerprint': fingerprint,
+                    'status': response.status_code,
+                    'data': response.data
+                }, getattr(settings, 'IDEMPOTENCY_KEY_TTL', 60 * 60 * 24))
+            self._release_idempotency_lock()
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def handle_exception(self, exc):
+        try:
+            return super().handle_exception(exc)
+        except Exception:
+            # Error no controlado (500): liberar la clave para permitir reintentos
+            self._release_idempotency_lock()
+            raise
+
+    def _release_idempotency_lock(self):
+        idempotency = getattr(self, '_idempotency_key', None)
+        if idempotency is not None:
+            cache.delete(f'{idempotency[0]}:lock')
+            self._idempotency_key = None
+
+    def _replace_handler(self, request, response):
+        """Reemplaza el handler de la acción para devolver `response` directamente"""
+        setattr(self, request.method.lower(), lambda *args, **kwargs: response)
+
+    def _idempotency_cache_key(self, request, key):
+        if request.user and request.user.is_authenticated:
+            owner = f'user:{request.user.pk}'
+        elif request.session.session_key:
+            owner = f'session:{request.session.session_key}'
+        else:
+            return None
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return f'idempotency:{owner}:{digest}'
+
+    def _idempotency_fingerprint(self, request):
+        body = json.dumps(request.data, sort_keys=True, default=str)
+        return hashlib.sha256(f'{request.method}:{request.path}:{body}'.encode()).hexdigest()
+
+
+# Backends de cache cuyo add() no es atómico entre procesos
+NON_ATOMIC_ADD_CACHES = (
+    'django.core.cache.backends.filebased.FileBasedCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def check_idempotency_cache(app_configs, **kwargs):
+    """Chequeo de sistema: la cache por defecto debe tener un add() atómico (IdempotentMixin)"""
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if backend not in NON_ATOMIC_ADD_CACHES:
+        return []
+    return [checks.Error(
+        f'La cache por defecto ({backend}) no tiene un add() atómico: dos requests '
+        'con la misma Idempotency-Key podrían ejecutarse a la vez.',
+        hint='Configure Redis (REDIS_URL), Memcached o DatabaseCache.',
+        id='pos_ecommerce.E001',
+    )]
+
+
+class EagerLoadingMixin:
+    """
+    Aplica select_related/prefetch_related según lo que lee el serializer.
+
+    Recorre los `source` de los campos (p. ej. 'inventory.product.sku') y los
+    serializers anidados (p. ej. `items`) del serializer de la acción, y
+    carga esas relaciones junto con el queryset: relaciones a uno con JOIN y
+    relaciones a muchos con una consulta extra por relación. Así un listado
+    cuesta un número fijo de consultas, sin importar las filas de la página.
+
+    Las relaciones usadas dentro de SerializerMethodField no son visibles
+    desde los campos; se declaran en `select_related_extra` /
+    `prefetch_related_extra`.
+    """
+    select_related_extra = []
+    prefetch_related_extra = []
+    _eager_paths_cache = {}
+
+    def filter_queryset(self, queryset):
+        return self.eager_load(super().filter_queryset(queryset))
+
+    def eager_load(self, queryset, serializer_class=None):
+        """
+        Agrega al queryset las relaciones que usa `serializer_class` (por
+        defecto, el serializer de la acción). Los extras declarados en la
+        vista solo se aplican a su propio serializer.
+        """
+        if serializer_class is None:
+            serializer_class = self.get_serializer_class()
+            select, prefetch = self.get_eager_paths(serializer_class, queryset.model)
+            select = select + [path for path in self.select_related_extra if path not in select]
+            prefetch = prefetch + [path for path in self.prefetch_related_extra if path not in prefetch]
+        else:
+            select, prefetch = self.get_eager_paths(serializer_class, queryset.model)
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+    @classmethod
+    def get_eager_paths(cls, serializer_class, model):
+        """Devuelve (select_related, prefetch_related) para un serializer; se calcula una vez"""
+        key = (serializer_class, model)
+        if key not in cls._eager_paths_cache:
+            select, prefetch = set(), set()
+            _collect_eager_paths(serializer_class(), model, '', False, select, prefetch)
+            cls._eager_paths_cache[key] = (sorted(select), sorted(prefetch))
+        return cls._eager_paths_cache[key]
+
+
+def _collect_eager_paths(serializer, model, prefix, many, select, prefetch):
+    """Acumula en `select`/`prefetch` las rutas ORM que recorren los campos de `serializer`"""
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+
+        nested = field.child if isinstance(field, serializers.ListSerializer) else field
+        is_nested = isinstance(nested, serializers.ModelSerializer)
+        # En un campo simple el último atributo es el valor leído (o el id en un
+        # PrimaryKeyRelatedField); en un serializer anidado es la relación misma
+        attrs = field.source_attrs if is_nested else field.source_attrs[:-1]
+
+        current_model, path, path_many = model, prefix, many
+        for attr in attrs:
+            try:
+                relation = current_model._meta.get_field(attr)
+            except FieldDoesNotExist:
+                break  # Método o propiedad: no se sigue
+            if not relation.is_relation or relation.related_model is None:
+                break
+            path = f'{path}__{attr}' if path else attr
+            path_many = path_many or relation.one_to_many or relation.many_to_many
+            (prefetch if path_many else select).add(path)
+            current_model = relation.related_model
+        else:
+            if is_nested and attrs:
+                _collect_eager_paths(nested, current_model, path, path_many, select, prefetch)
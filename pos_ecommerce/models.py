@@ -2,11 +2,18 @@
 Modelos para el sistema POS + E-commerce de TemucoSoft S.A.
 Cumple con normalización 3NF y requisitos de evaluación.
 """
-from django.db import models
+from django.db import models, connection, transaction
+from django.db.models.functions import Cast, NullIf
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
+from django.conf import settings
 from django.utils import timezone
+from collections import defaultdict
+from datetime import timedelta
 from decimal import Decimal
+import os
+import uuid
 from .validators import (
     validar_rut_chileno,
     validar_fecha_no_futura,
@@ -17,6 +24,57 @@ from .validators import (
 )
 
 
+def upsert_increment(model, key_fields, value_fields, rows):
+    """
+    Suma valores a filas de una tabla de resumen con un único
+    INSERT ... ON CONFLICT DO UPDATE (PostgreSQL y SQLite).
+    
+    `rows` es un dict {tupla de claves: tupla de incrementos}; las filas que
+    no existen se crean con el incremento como valor inicial.
+    """
+    rows = {key: values for key, values in rows.items() if any(values)}
+    if not rows:
+        return
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    fields = [model._meta.get_field(name) for name in key_fields + value_fields]
+    columns = [qn(field.column) for field in fields] + [qn('updated_at')]
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    
+    placeholders = []
+    params = []
+    for key, values in rows.items():
+        placeholders.append(f'({", ".join(["%s"] * len(columns))})')
+        for field, value in zip(fields, tuple(key) + tuple(values)):
+            params.append(field.get_db_prep_value(value, connection))
+        params.append(now)
+    
+    conflict = ', '.join(qn(model._meta.get_field(name).column) for name in key_fields)
+    updates = [
+        f'{qn(field.column)} = {table}.{qn(field.column)} + excluded.{qn(field.column)}'
+        for field in fields[len(key_fields):]
+    ] + [f'{qn("updated_at")} = excluded.{qn("updated_at")}']
+    sql = (
+        f'INSERT INTO {table} ({", ".join(columns)}) VALUES {", ".join(placeholders)} '
+        f'ON CONFLICT ({conflict}) DO UPDATE SET {", ".join(updates)}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def supports_update_returning():
+    """
+    True si la base de datos acepta UPDATE ... RETURNING: PostgreSQL y
+    SQLite >= 3.35. No se usa can_return_columns_from_insert porque esa
+    característica de Django describe INSERT, no UPDATE.
+    """
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35, 0)
+    return False
+
+
 class Company(models.Model):
     """
     Modelo para empresas/clientes (tenants) del sistema.
@@ -77,7 +135,6 @@ class Subscription(models.Model):
     
     def clean(self):
         """Validación personalizada"""
-        from django.core.exceptions import ValidationError
         if self.end_date <= self.start_date:
             raise ValidationError('La fecha de fin debe ser posterior a la fecha de inicio')
 
@@ -231,6 +288,26 @@ class Product(models.Model):
         return 0
 
 
+class InventoryQuerySet(models.QuerySet):
+    
+    def needs_restock(self):
+        """
+        Inventarios con stock bajo (stock <= punto de reorden).
+        La condición es la misma del índice parcial pos_inventory_restock_idx,
+        que solo contiene estas filas: la consulta no recorre toda la tabla.
+        """
+        return self.filter(stock__lte=models.F('reorder_point'))
+    
+    def by_restock_urgency(self):
+        """
+        Ordena por stock / punto de reorden (más urgente primero).
+        Con punto de reorden 0 la proporción es NULL y va al inicio.
+        """
+        return self.annotate(
+            restock_ratio=Cast('stock', models.FloatField()) / NullIf('reorder_point', 0)
+        ).order_by(models.F('restock_ratio').asc(nulls_first=True), 'id')
+
+
 class Inventory(models.Model):
     """
     Modelo para inventario por sucursal.
@@ -246,15 +323,30 @@ class Inventory(models.Model):
         default=10,
         help_text='Punto de reorden: cuando el stock llega a este nivel, reordenar'
     )
+    reserved = models.IntegerField(
+        default=0,
+        validators=[MinValueValidator(0)],
+        help_text='Unidades reservadas por órdenes e-commerce pendientes (ver reservations.py)'
+    )
     last_restock_date = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = InventoryQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'Inventario'
         verbose_name_plural = 'Inventarios'
         unique_together = ['branch', 'product']
         ordering = ['branch', 'product']
+        indexes = [
+            # Índice parcial: solo filas con stock bajo, por sucursal (ver needs_restock)
+            models.Index(
+                fields=['branch', 'stock'],
+                condition=models.Q(stock__lte=models.F('reorder_point')),
+                name='pos_inventory_restock_idx'
+            ),
+        ]
     
     def __str__(self):
         return f"{self.branch.name} - {self.product.name}: {self.stock} unidades"
@@ -263,19 +355,139 @@ class Inventory(models.Model):
         """Verifica si necesita reabastecimiento"""
         return self.stock <= self.reorder_point
     
+    def available_stock(self):
+        """Stock que la tienda online puede vender: el que no está reservado"""
+        return max(0, self.stock - self.reserved)
+    
     def add_stock(self, quantity):
         """Agrega stock"""
-        self.stock += quantity
+        self.stock = Inventory.apply_stock_delta(self.pk, quantity, restock=True)
         self.last_restock_date = timezone.now()
-        self.save()
     
     def remove_stock(self, quantity):
         """Quita stock"""
-        if self.stock >= quantity:
-            self.stock -= quantity
-            self.save()
+        new_stock = Inventory.apply_stock_delta(self.pk, -quantity)
+        if new_stock is None:
+            return False
+        self.stock = new_stock
+        return True
+    
+    @classmethod
+    def apply_stock_delta(cls, inventory_id, delta, restock=False):
+        """
+        Aplica un cambio de stock con un único UPDATE condicionado.
+        
+        El cálculo se hace en la base de datos (stock = stock + delta) y una
+        salida solo se aplica si no toca las unidades reservadas por órdenes
+        e-commerce (stock - reserved + delta >= 0), por lo que ventas
+        concurrentes del mismo SKU no pierden actualizaciones ni venden lo
+        reservado. Devuelve el stock resultante o None si no había stock
+        disponible suficiente.
+        """
+        now = timezone.now()
+        qn = connection.ops.quote_name
+        assignments = [f'{qn("stock")} = {qn("stock")} + %s', f'{qn("updated_at")} = %s']
+        params = [delta, connection.ops.adapt_datetimefield_value(now)]
+        if restock:
+            assignments.append(f'{qn("last_restock_date")} = %s')
+            params.append(connection.ops.adapt_datetimefield_value(now))
+        sql = (
+            f'UPDATE {qn(cls._meta.db_table)} SET {", ".join(assignments)} '
+            f'WHERE {qn("id")} = %s AND {qn("stock")} + %s >= '
+            + (qn('reserved') if delta < 0 else '0')
+        )
+        params += [inventory_id, delta]
+        
+        with transaction.atomic(), connection.cursor() as cursor:
+            if supports_update_returning():
+                cursor.execute(f'{sql} RETURNING {qn("stock")}', params)
+                row = cursor.fetchone()
+                return row[0] if row else None
+            
+            # Sin RETURNING: la fila queda bloqueada por el UPDATE hasta el
+            # fin de la transacción, así que la lectura posterior es consistente
+            cursor.execute(sql, params)
+            if cursor.rowcount == 0:
+                return None
+            return cls.objects.values_list('stock', flat=True).get(pk=inventory_id)
+    
+    @classmethod
+    def apply_stock_deltas(cls, deltas):
+        """
+        Aplica varios cambios de stock {inventory_id: delta} en un solo UPDATE.
+        
+        Cada fila solo se actualiza si su stock no reservado alcanza para el
+        delta; si alguna fila no cumple la condición se devuelve False y la
+        transacción que llama debe revertirse.
+        """
+        if not deltas:
+            return True
+        guard = models.Q()
+        for inventory_id, delta in deltas.items():
+            if delta < 0:
+                guard |= models.Q(pk=inventory_id, stock__gte=models.F('reserved') - delta)
+            else:
+                guard |= models.Q(pk=inventory_id)
+        updated = cls.objects.filter(guard).update(
+            stock=models.F('stock') + models.Case(
+                *[models.When(pk=inventory_id, then=models.Value(delta))
+                  for inventory_id, delta in deltas.items()],
+                output_field=models.IntegerField()
+            ),
+            updated_at=timezone.now()
+        )
+        return updated == len(deltas)
+    
+    @classmethod
+    def apply_reserved_deltas(cls, deltas):
+        """
+        Aplica varios cambios de reserva {inventory_id: delta} en un solo UPDATE.
+        
+        Una reserva (delta positivo) solo se aplica si el stock no reservado
+        alcanza; una liberación (negativo), si hay tanto reservado. Devuelve
+        cuántas filas se actualizaron: si son menos que los deltas, la
+        transacción que llama debe revertirse.
+        """
+        if not deltas:
+            return 0
+        guard = models.Q()
+        for inventory_id, delta in deltas.items():
+            if delta >= 0:
+                guard |= models.Q(pk=inventory_id, stock__gte=models.F('reserved') + delta)
+            else:
+                guard |= models.Q(pk=inventory_id, reserved__gte=-delta)
+        return cls.objects.filter(guard).update(
+            reserved=models.F('reserved') + models.Case(
+                *[models.When(pk=inventory_id, then=models.Value(delta))
+                  for inventory_id, delta in deltas.items()],
+                output_field=models.IntegerField()
+            ),
+            updated_at=timezone.now()
+        )
+    
+    @classmethod
+    def consume_reserved(cls, quantities):
+        """
+        Convierte reservas en salidas de stock {inventory_id: cantidad}: stock
+        y reserved bajan juntos en un solo UPDATE, solo si ambos alcanzan.
+        Devuelve False si alguna fila no cumple (la transacción debe revertirse).
+        """
+        if not quantities:
             return True
-        return False
+        guard = models.Q()
+        for inventory_id, quantity in quantities.items():
+            guard |= models.Q(pk=inventory_id, stock__gte=quantity, reserved__gte=quantity)
+        amount = models.Case(
+            *[models.When(pk=inventory_id, then=models.Value(quantity))
+              for inventory_id, quantity in quantities.items()],
+            output_field=models.IntegerField()
+        )
+        updated = cls.objects.filter(guard).update(
+            stock=models.F('stock') - amount,
+            reserved=models.F('reserved') - amount,
+            updated_at=timezone.now()
+        )
+        return updated == len(quantities)
 
 
 class InventoryMovement(models.Model):
@@ -346,28 +558,160 @@ class InventoryMovement(models.Model):
         verbose_name = 'Movimiento de Inventario'
         verbose_name_plural = 'Movimientos de Inventario'
         ordering = ['-created_at']
+        indexes = [
+            # Paginación por cursor (KeysetPagination)
+            models.Index(fields=['created_at', 'id'], name='pos_movement_created_id_idx'),
+            # Historial de un inventario (?inventory=) ordenado por fecha
+            models.Index(fields=['inventory', 'created_at'], name='pos_movement_inv_created_idx'),
+        ]
+    
+    # Tipos de movimiento que suman stock; el resto lo descuentan
+    INCOMING_TYPES = ['COMPRA', 'AJUSTE_POSITIVO', 'DEVOLUCION', 'TRANSFERENCIA_IN']
     
     def __str__(self):
         return f"{self.get_movement_type_display()} - {self.inventory.product.name} ({self.quantity})"
     
+    def get_stock_delta(self):
+        """Cambio de stock que produce el movimiento (positivo o negativo)"""
+        if self.movement_type in self.INCOMING_TYPES:
+            return self.quantity
+        return -self.quantity  # VENTA, AJUSTE_NEGATIVO, TRANSFERENCIA_OUT
+    
     def save(self, *args, **kwargs):
         """
-        Al guardar, actualiza automáticamente el stock del inventario
+        Al guardar, actualiza automáticamente el stock del inventario.
+        
+        El stock se modifica con un UPDATE condicionado y los valores
+        previous_stock/new_stock se toman del resultado devuelto por la base
+        de datos, no de una lectura previa.
         """
         if not self.pk:  # Solo en creación
-            self.previous_stock = self.inventory.stock
-            
-            # Calcular nuevo stock según tipo de movimiento
-            if self.movement_type in ['COMPRA', 'AJUSTE_POSITIVO', 'DEVOLUCION', 'TRANSFERENCIA_IN']:
-                self.new_stock = self.previous_stock + self.quantity
-            else:  # VENTA, AJUSTE_NEGATIVO, TRANSFERENCIA_OUT
-                self.new_stock = self.previous_stock - self.quantity
+            delta = self.get_stock_delta()
+            with transaction.atomic():
+                new_stock = Inventory.apply_stock_delta(
+                    self.inventory_id, delta, restock=self.movement_type == 'COMPRA'
+                )
+                if new_stock is None:
+                    raise ValidationError(
+                        f'Stock insuficiente para registrar el movimiento ({self.quantity} unidades)'
+                    )
+                self.new_stock = new_stock
+                self.previous_stock = new_stock - delta
+                
+                # Mantener sincronizada la instancia ya cargada en memoria
+                if self._meta.get_field('inventory').is_cached(self):
+                    self.inventory.stock = new_stock
+                
+                super().save(*args, **kwargs)
+                InventoryMovementDailySummary.apply_movements([self])
+            return
+        
+        with transaction.atomic():
+            previous = InventoryMovement.objects.filter(pk=self.pk).values(
+                'inventory_id', 'movement_type', 'quantity', 'created_at'
+            ).first()
+            super().save(*args, **kwargs)
             
-            # Actualizar el inventario
-            self.inventory.stock = self.new_stock
-            self.inventory.save()
+            deltas = InventoryMovementDailySummary.new_deltas()
+            if previous:
+                InventoryMovementDailySummary.add_to_deltas(
+                    deltas, previous['inventory_id'], previous['movement_type'],
+                    previous['created_at'], previous['quantity'], sign=-1
+                )
+            InventoryMovementDailySummary.add_to_deltas(
+                deltas, self.inventory_id, self.movement_type, self.created_at, self.quantity
+            )
+            InventoryMovementDailySummary.apply_deltas(deltas)
+
+
+class InventoryMovementDailySummary(models.Model):
+    """
+    Resumen diario de movimientos por inventario y tipo de movimiento.
+    Se actualiza al registrar cada movimiento, para que los resúmenes por
+    tipo no tengan que recorrer el libro completo de movimientos.
+    Se puede reconstruir con `manage.py rebuild_movement_summary`.
+    """
+    inventory = models.ForeignKey(Inventory, on_delete=models.CASCADE, related_name='daily_movements')
+    movement_type = models.CharField(max_length=20, choices=InventoryMovement.MOVEMENT_TYPE_CHOICES)
+    day = models.DateField(verbose_name='Día')
+    movement_count = models.IntegerField(default=0)
+    total_quantity = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Resumen Diario de Movimientos'
+        verbose_name_plural = 'Resúmenes Diarios de Movimientos'
+        unique_together = ['inventory', 'movement_type', 'day']
+        ordering = ['day']
+    
+    def __str__(self):
+        return f"{self.inventory_id} - {self.get_movement_type_display()} - {self.day}"
+    
+    @staticmethod
+    def new_deltas():
+        """Acumulador {(inventory_id, tipo, día): [cantidad de movimientos, unidades]}"""
+        return defaultdict(lambda: [0, 0])
+    
+    @staticmethod
+    def add_to_deltas(deltas, inventory_id, movement_type, created_at, quantity, sign=1):
+        """Suma (sign=1) o resta (sign=-1) un movimiento al acumulador"""
+        key = (inventory_id, movement_type, timezone.localdate(created_at))
+        deltas[key][0] += sign
+        deltas[key][1] += sign * quantity
+    
+    @classmethod
+    def apply_movements(cls, movements, sign=1):
+        """Aplica una lista de movimientos al resumen con un único upsert"""
+        deltas = cls.new_deltas()
+        for movement in movements:
+            cls.add_to_deltas(
+                deltas, movement.inventory_id, movement.movement_type,
+                movement.created_at, movement.quantity, sign
+            )
+        cls.apply_deltas(deltas)
+    
+    @classmethod
+    def apply_deltas(cls, deltas):
+        """Incrementa los contadores en la base de datos (creando filas si faltan)"""
+        upsert_increment(
+            cls, ['inventory', 'movement_type', 'day'], ['movement_count', 'total_quantity'],
+            {key: tuple(values) for key, values in deltas.items()}
+        )
+    
+    @classmethod
+    def rebuild(cls, inventories=None):
+        """
+        Recalcula el resumen desde el libro de movimientos.
+        `inventories` limita la reconstrucción a un queryset de inventarios.
+        """
+        from django.db.models.functions import TruncDate
+        
+        movements = InventoryMovement.objects.all()
+        summaries = cls.objects.all()
+        if inventories is not None:
+            movements = movements.filter(inventory__in=inventories)
+            summaries = summaries.filter(inventory__in=inventories)
         
-        super().save(*args, **kwargs)
+        grouped = movements.annotate(
+            day=TruncDate('created_at')
+        ).values('inventory_id', 'movement_type', 'day').annotate(
+            movement_count=models.Count('id'),
+            total_quantity=models.Sum('quantity')
+        ).order_by()
+        
+        with transaction.atomic():
+            summaries.delete()
+            created = cls.objects.bulk_create([
+                cls(
+                    inventory_id=row['inventory_id'],
+                    movement_type=row['movement_type'],
+                    day=row['day'],
+                    movement_count=row['movement_count'],
+                    total_quantity=row['total_quantity'] or 0
+                )
+                for row in grouped
+            ], batch_size=1000)
+        return len(created)
 
 
 class Purchase(models.Model):
@@ -389,6 +733,10 @@ class Purchase(models.Model):
         verbose_name = 'Compra'
         verbose_name_plural = 'Compras'
         ordering = ['-purchase_date']
+        indexes = [
+            # Última compra por proveedor (reporte de proveedores)
+            models.Index(fields=['supplier', 'purchase_date'], name='pos_purchase_supplier_date_idx'),
+        ]
     
     def __str__(self):
         return f"Compra #{self.id} - {self.supplier.name} - {self.purchase_date.strftime('%d/%m/%Y')}"
@@ -439,6 +787,12 @@ class Sale(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='sales')
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHOD_CHOICES)
     total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    client_uuid = models.UUIDField(
+        null=True,
+        blank=True,
+        unique=True,
+        help_text='UUID generado por el terminal POS para sincronización idempotente'
+    )
     created_at = models.DateTimeField(auto_now_add=True, validators=[validar_fecha_no_futura])
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -446,10 +800,40 @@ class Sale(models.Model):
         verbose_name = 'Venta POS'
         verbose_name_plural = 'Ventas POS'
         ordering = ['-created_at']
+        indexes = [
+            # Paginación por cursor (KeysetPagination)
+            models.Index(fields=['created_at', 'id'], name='pos_sale_created_id_idx'),
+            # Ventas de una sucursal por período (?branch=, reporte de ventas)
+            models.Index(fields=['branch', 'created_at'], name='pos_sale_branch_created_idx'),
+        ]
     
     def __str__(self):
         return f"Venta #{self.id} - {self.branch.name} - {self.created_at.strftime('%d/%m/%Y %H:%M')}"
     
+    def save(self, *args, **kwargs):
+        """
+        Guarda la venta y actualiza el resumen diario en la misma transacción.
+        Si la venta ya existía, se descuenta su aporte anterior al resumen.
+        """
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = Sale.objects.filter(pk=self.pk).values(
+                    'branch_id', 'created_at', 'payment_method', 'total_amount'
+                ).first()
+            super().save(*args, **kwargs)
+            
+            deltas = SalesDailyRollup.new_deltas()
+            if previous:
+                SalesDailyRollup.add_to_deltas(
+                    deltas, previous['branch_id'], previous['created_at'],
+                    previous['payment_method'], previous['total_amount'], sign=-1
+                )
+            SalesDailyRollup.add_to_deltas(
+                deltas, self.branch_id, self.created_at, self.payment_method, self.total_amount
+            )
+            SalesDailyRollup.apply_deltas(deltas)
+    
     def calculate_total(self):
         """Calcula el total de la venta"""
         total = sum(item.get_subtotal() for item in self.items.all())
@@ -458,6 +842,98 @@ class Sale(models.Model):
         return total
 
 
+class SalesDailyRollup(models.Model):
+    """
+    Resumen diario de ventas POS por sucursal, día comercial y método de pago.
+    Se mantiene de forma incremental al registrar ventas, para que los
+    reportes dependan de la cantidad de días y no de la cantidad de boletas.
+    Se puede reconstruir con `manage.py rebuild_sales_rollup`.
+    """
+    branch = models.ForeignKey(Branch, on_delete=models.CASCADE, related_name='daily_sales')
+    business_date = models.DateField(verbose_name='Día comercial')
+    payment_method = models.CharField(max_length=20, choices=Sale.PAYMENT_METHOD_CHOICES)
+    sales_count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Resumen Diario de Ventas'
+        verbose_name_plural = 'Resúmenes Diarios de Ventas'
+        unique_together = ['branch', 'business_date', 'payment_method']
+        ordering = ['business_date']
+    
+    def __str__(self):
+        return f"{self.branch.name} - {self.business_date} - {self.get_payment_method_display()}"
+    
+    @staticmethod
+    def new_deltas():
+        """Acumulador {(branch_id, día, método): [cantidad, monto]}"""
+        return defaultdict(lambda: [0, Decimal('0')])
+    
+    @staticmethod
+    def add_to_deltas(deltas, branch_id, created_at, payment_method, total_amount, sign=1):
+        """Suma (sign=1) o resta (sign=-1) una venta al acumulador"""
+        key = (branch_id, timezone.localdate(created_at), payment_method)
+        deltas[key][0] += sign
+        deltas[key][1] += sign * Decimal(total_amount)
+    
+    @classmethod
+    def apply_sales(cls, sales, sign=1):
+        """Aplica una lista de ventas al resumen con un único INSERT ... ON CONFLICT"""
+        deltas = cls.new_deltas()
+        for sale in sales:
+            cls.add_to_deltas(
+                deltas, sale.branch_id, sale.created_at, sale.payment_method, sale.total_amount, sign
+            )
+        cls.apply_deltas(deltas)
+    
+    @classmethod
+    def apply_deltas(cls, deltas):
+        """
+        Incrementa los contadores de cada fila (creándola si no existe).
+        El incremento se hace en la base de datos, sin leer antes la fila.
+        """
+        upsert_increment(
+            cls, ['branch', 'business_date', 'payment_method'], ['sales_count', 'total_amount'],
+            {key: tuple(values) for key, values in deltas.items()}
+        )
+    
+    @classmethod
+    def rebuild(cls, branches=None):
+        """
+        Recalcula el resumen desde la tabla de ventas.
+        `branches` limita la reconstrucción a un queryset de sucursales.
+        """
+        from django.db.models.functions import TruncDate
+        
+        sales = Sale.objects.all()
+        rollups = cls.objects.all()
+        if branches is not None:
+            sales = sales.filter(branch__in=branches)
+            rollups = rollups.filter(branch__in=branches)
+        
+        grouped = sales.annotate(
+            business_date=TruncDate('created_at')
+        ).values('branch_id', 'business_date', 'payment_method').annotate(
+            sales_count=models.Count('id'),
+            amount=models.Sum('total_amount')
+        ).order_by()
+        
+        with transaction.atomic():
+            rollups.delete()
+            created = cls.objects.bulk_create([
+                cls(
+                    branch_id=row['branch_id'],
+                    business_date=row['business_date'],
+                    payment_method=row['payment_method'],
+                    sales_count=row['sales_count'],
+                    total_amount=row['amount'] or 0
+                )
+                for row in grouped
+            ], batch_size=1000)
+        return len(created)
+
+
 class SaleItem(models.Model):
     """
     Modelo para items de una venta.
@@ -512,6 +988,12 @@ class Order(models.Model):
         verbose_name = 'Orden E-commerce'
         verbose_name_plural = 'Órdenes E-commerce'
         ordering = ['-created_at']
+        indexes = [
+            # Paginación por cursor (KeysetPagination)
+            models.Index(fields=['created_at', 'id'], name='pos_order_created_id_idx'),
+            # Órdenes de la empresa por estado (?status=), de la más reciente
+            models.Index(fields=['company', 'status', 'created_at'], name='pos_order_company_status_idx'),
+        ]
     
     def __str__(self):
         return f"Orden #{self.id} - {self.customer_name} - {self.get_status_display()}"
@@ -546,6 +1028,42 @@ class OrderItem(models.Model):
         return self.quantity * self.unit_price
 
 
+class StockReservation(models.Model):
+    """
+    Reserva de stock de una orden e-commerce en el inventario de una sucursal.
+    Se crea con la orden PENDIENTE y vence a los STOCK_RESERVATION_TTL
+    segundos; Inventory.reserved suma las reservas activas (ver reservations.py).
+    """
+    STATUS_CHOICES = [
+        ('ACTIVA', 'Activa'),
+        ('CONSUMIDA', 'Consumida'),
+        ('LIBERADA', 'Liberada'),
+        ('VENCIDA', 'Vencida'),
+    ]
+    
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    inventory = models.ForeignKey(Inventory, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.IntegerField(validators=[MinValueValidator(1)])
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='ACTIVA')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = 'Reserva de Stock'
+        verbose_name_plural = 'Reservas de Stock'
+        indexes = [
+            # Índice parcial: reservas activas por vencimiento (release_expired_reservations)
+            models.Index(
+                fields=['expires_at'],
+                condition=models.Q(status='ACTIVA'),
+                name='pos_reservation_expiry_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"Orden #{self.order_id} - inventario {self.inventory_id} x{self.quantity} ({self.get_status_display()})"
+
+
 class CartItem(models.Model):
     """
     Modelo para items del carrito de compras.
@@ -561,6 +1079,12 @@ class CartItem(models.Model):
     class Meta:
         verbose_name = 'Item del Carrito'
         verbose_name_plural = 'Items del Carrito'
+        indexes = [
+            # Carrito anónimo por sesión y get_or_create(session_key, product)
+            models.Index(fields=['session_key', 'product'], name='pos_cart_session_product_idx'),
+            # get_or_create(user, product) al agregar al carrito
+            models.Index(fields=['user', 'product'], name='pos_cart_user_product_idx'),
+        ]
     
     def __str__(self):
         owner = self.user.username if self.user else f"Session: {self.session_key}"
@@ -614,6 +1138,12 @@ class Payment(models.Model):
         verbose_name = 'Pago'
         verbose_name_plural = 'Pagos'
         ordering = ['-created_at']
+        indexes = [
+            # Paginación por cursor (KeysetPagination)
+            models.Index(fields=['created_at', 'id'], name='pos_payment_created_id_idx'),
+            # Pagos por estado (?status=, conciliación de pendientes)
+            models.Index(fields=['status', 'created_at'], name='pos_payment_status_created_idx'),
+        ]
     
     def __str__(self):
         if self.sale:
@@ -625,3 +1155,110 @@ class Payment(models.Model):
     def is_completed(self):
         """Verifica si el pago está completado"""
         return self.status == 'COMPLETADO'
+
+
+class ReportJob(models.Model):
+    """
+    Reporte generado en segundo plano por `manage.py run_report_worker`.
+    El resultado (CSV o NDJSON) queda en REPORT_JOBS_ROOT y se descarga
+    desde la API; en producción lo entrega Nginx con X-Accel-Redirect.
+    """
+    REPORT_TYPE_CHOICES = [
+        ('STOCK', 'Stock por Sucursal'),
+        ('VENTAS', 'Ventas'),
+        ('PROVEEDORES', 'Proveedores'),
+        ('MOVIMIENTOS', 'Movimientos de Inventario'),
+    ]
+    
+    FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('ndjson', 'NDJSON'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('PENDIENTE', 'Pendiente'),
+        ('EN_PROCESO', 'En Proceso'),
+        ('COMPLETADO', 'Completado'),
+        ('ERROR', 'Error'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='report_jobs')
+    report_type = models.CharField(max_length=15, choices=REPORT_TYPE_CHOICES)
+    export_format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default='csv')
+    params = models.JSONField(default=dict, blank=True, help_text='Filtros del reporte (branch, date_from, ...)')
+    status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='PENDIENTE')
+    result_file = models.CharField(max_length=255, blank=True, help_text='Ruta relativa a REPORT_JOBS_ROOT')
+    row_count = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0, help_text='Veces que un worker tomó el trabajo')
+    
+    class Meta:
+        verbose_name = 'Trabajo de Reporte'
+        verbose_name_plural = 'Trabajos de Reporte'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='pos_reportjob_queue_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_report_type_display()} ({self.export_format}) - {self.get_status_display()}"
+    
+    @property
+    def result_path(self):
+        """Ruta absoluta del archivo de resultado (None si aún no existe)"""
+        if not self.result_file:
+            return None
+        return os.path.join(settings.REPORT_JOBS_ROOT, self.result_file)
+    
+    @classmethod
+    def claim_next(cls):
+        """
+        Toma el trabajo pendiente más antiguo y lo marca EN_PROCESO.
+        El UPDATE condicionado por estado (y fecha de inicio) evita que dos
+        workers tomen el mismo.
+        
+        Un trabajo EN_PROCESO desde hace más de REPORT_JOBS_TIMEOUT segundos
+        quedó abandonado (el worker se cayó o fue detenido): se vuelve a
+        tomar, hasta REPORT_JOBS_MAX_ATTEMPTS veces; después se marca ERROR
+        para que quien lo consulta deje de esperar.
+        """
+        now = timezone.now()
+        stale = models.Q(
+            status='EN_PROCESO',
+            started_at__lt=now - timedelta(seconds=settings.REPORT_JOBS_TIMEOUT)
+        )
+        cls.objects.filter(stale, attempts__gte=settings.REPORT_JOBS_MAX_ATTEMPTS).update(
+            status='ERROR',
+            error='El reporte se interrumpió repetidamente; solicítelo nuevamente',
+            finished_at=now
+        )
+        
+        candidates = cls.objects.filter(models.Q(status='PENDIENTE') | stale).order_by('created_at')
+        for job_id, status, started_at in candidates.values_list('id', 'status', 'started_at')[:10]:
+            claimed = cls.objects.filter(pk=job_id, status=status, started_at=started_at).update(
+                status='EN_PROCESO', started_at=now, attempts=models.F('attempts') + 1
+            )
+            if claimed:
+                return cls.objects.select_related('user').get(pk=job_id)
+        return None
+    
+    def delete_result(self):
+        """Elimina el archivo de resultado, si existe"""
+        if self.result_path and os.path.exists(self.result_path):
+            os.remove(self.result_path)
+    
+    @classmethod
+    def purge_expired(cls):
+        """Elimina trabajos (y archivos) terminados hace más de REPORT_JOBS_RETENTION_DAYS"""
+        limit = timezone.now() - timedelta(days=settings.REPORT_JOBS_RETENTION_DAYS)
+        expired = list(cls.objects.filter(
+            status__in=['COMPLETADO', 'ERROR'], finished_at__lt=limit
+        )[:500])
+        for job in expired:
+            job.delete_result()
+        cls.objects.filter(pk__in=[job.pk for job in expired]).delete()
+        return len(expired)
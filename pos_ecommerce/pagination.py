@@ -0,0 +1,157 @@
+"""
+Paginación para los ViewSets del sistema POS + E-commerce de TemucoSoft S.A.
+"""
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginación por cursor (keyset) sobre (created_at, id), de más nuevo a más antiguo.
+
+    Cada página se obtiene con `WHERE (created_at, id) < (cursor)` y un LIMIT,
+    sin COUNT(*) ni OFFSET: el costo no crece con la profundidad de la página
+    y las filas insertadas mientras se recorre no desplazan ni repiten
+    resultados. El cursor es opaco (base64) y se sigue con los enlaces
+    `next` / `previous`. El orden es fijo: `?ordering=` responde 400.
+
+    Con `?total=approx` la respuesta incluye `approximate_total`: en
+    PostgreSQL es la estimación del planificador; en otros motores es un
+    conteo acotado a APPROXIMATE_TOTAL_CAP filas.
+    """
+    page_size = 50
+    max_page_size = 500
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    total_query_param = 'total'
+    ordering_query_param = 'ordering'
+    APPROXIMATE_TOTAL_CAP = 10000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.ordering_query_param in request.query_params:
+            raise ValidationError({
+                self.ordering_query_param: 'Este listado se ordena siempre por fecha de creación, de más nuevo a más antiguo'
+            })
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+
+        self.approximate_total = None
+        if request.query_params.get(self.total_query_param) == 'approx':
+            self.approximate_total = self.get_approximate_total(queryset)
+
+        if position is None:
+            reverse = False
+            queryset = queryset.order_by('-created_at', '-id')
+        else:
+            created_at, pk, reverse = position
+            if reverse:
+                queryset = queryset.filter(
+                    Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+                ).order_by('created_at', 'id')
+            else:
+                queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+                ).order_by('-created_at', '-id')
+
+        # Una fila extra indica si hay más allá de esta página
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        if reverse:
+            self.has_next, self.has_previous = bool(results), has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        payload = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+        ])
+        if self.approximate_total is not None:
+            payload['approximate_total'] = self.approximate_total
+        payload['results'] = data
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'approximate_total': {'type': 'integer'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        return self.encode_cursor(last.created_at, last.pk, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            # Página vacía tras el final: volver al inicio
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        first = self.page[0]
+        return self.encode_cursor(first.created_at, first.pk, reverse=True)
+
+    def encode_cursor(self, created_at, pk, reverse):
+        data = {'t': created_at.isoformat(), 'id': pk}
+        if reverse:
+            data['r'] = 1
+        token = base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        """Devuelve (created_at, id, reverse) o None si no hay cursor"""
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+            created_at = parse_datetime(data['t'])
+            pk = int(data['id'])
+        except (TypeError, ValueError, KeyError, binascii.Error):
+            raise NotFound('Cursor inválido')
+        if created_at is None:
+            raise NotFound('Cursor inválido')
+        return created_at, pk, bool(data.get('r'))
+
+    def get_approximate_total(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql':
+            sql, params = queryset.order_by().query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+        return queryset.order_by()[:self.APPROXIMATE_TOTAL_CAP].count()
@@ -4,6 +4,8 @@ Implementa el sistema de autorización requerido en la evaluación.
 """
 from rest_framework.permissions import BasePermission, SAFE_METHODS
 
+from .entitlements import has_feature
+
 
 class IsSuperAdmin(BasePermission):
     """
@@ -151,14 +153,18 @@ class CanCreateSale(BasePermission):
 class CanViewReports(BasePermission):
     """
     Permiso para ver reportes.
-    Solo admin_cliente y gerente pueden ver reportes.
+    Solo admin_cliente y gerente pueden ver reportes, y solo si el plan
+    vigente de su empresa incluye reportes (has_reports).
     """
+    message = 'El plan de la empresa no incluye reportes o la suscripción no está vigente'
+
     def has_permission(self, request, view):
         return (
             request.user and
             request.user.is_authenticated and
             request.user.is_active and
-            request.user.role in ['ADMIN_CLIENTE', 'GERENTE']
+            request.user.role in ['ADMIN_CLIENTE', 'GERENTE'] and
+            has_feature(request.user.company_id, 'has_reports')
         )
 
 
@@ -0,0 +1,154 @@
+"""
+Búsqueda de productos por SKU para el POS del sistema POS + E-commerce de TemucoSoft S.A.
+
+Cada proceso guarda en memoria, por empresa, un índice SKU -> (id, nombre,
+precio) de los productos activos más las sucursales activas, y por
+sucursal el stock de cada producto. Así el escaneo de un código en caja
+se resuelve sin consultas a la base de datos.
+
+La validez del índice se controla con sellos de versión guardados en la
+cache compartida (una sola lectura por búsqueda):
+
+- `pos_lookup:empresa:<id>`: cambia al modificar productos o sucursales.
+- `pos_lookup:stock:<id>`: cambia al modificar el stock de la sucursal.
+
+signals.py incrementa los sellos al confirmarse cada cambio; quien cambie
+stock sin pasar por el libro de movimientos (apply_stock_deltas, add_stock)
+debe llamar a bump_stock_version(). Si el sello no coincide con el del
+índice en memoria, esa parte se vuelve a cargar con una consulta.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Branch, Inventory, Product
+
+PREFIX_LOOKUP_LIMIT = 20
+
+_indexes = {}  # company_id -> CompanySkuIndex
+_lock = threading.Lock()
+
+
+def _company_key(company_id):
+    return f'pos_lookup:empresa:{company_id}'
+
+
+def _stock_key(branch_id):
+    return f'pos_lookup:stock:{branch_id}'
+
+
+def _initial_stamp():
+    # Un sello que desaparece de la cache se recrea con un valor nuevo,
+    # nunca con uno que un índice en memoria ya pueda tener
+    return time.time_ns()
+
+
+def _read_stamps(keys):
+    stamps = cache.get_many(keys)
+    for key in keys:
+        if key not in stamps:
+            cache.add(key, _initial_stamp(), None)
+            stamps[key] = cache.get(key)
+    return stamps
+
+
+def _bump(key):
+    cache.add(key, _initial_stamp(), None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _initial_stamp(), None)
+
+
+def bump_company_version(company_id):
+    """Invalida (al confirmar la transacción) los productos y sucursales indexados de la empresa"""
+    transaction.on_commit(lambda: _bump(_company_key(company_id)))
+
+
+def bump_stock_version(*branch_ids):
+    """Invalida (al confirmar la transacción) el stock indexado de las sucursales"""
+    keys = [_stock_key(branch_id) for branch_id in set(branch_ids)]
+
+    def bump():
+        for key in keys:
+            _bump(key)
+    transaction.on_commit(bump)
+
+
+class CompanySkuIndex:
+    """Índice en memoria de una empresa (productos por SKU y stock por sucursal)"""
+
+    def __init__(self, company_id, version):
+        self.company_id = company_id
+        self.version = version
+        rows = Product.objects.filter(company_id=company_id, is_active=True).values_list(
+            'sku', 'id', 'name', 'price'
+        ).order_by('sku')
+        self.by_sku = {sku: (pk, name, price) for sku, pk, name, price in rows}
+        self.skus = list(self.by_sku)  # ordenados, para búsquedas por prefijo
+        self.branch_ids = set(
+            Branch.objects.filter(company_id=company_id, is_active=True).values_list('id', flat=True)
+        )
+        self.stock = {}  # branch_id -> (versión, {product_id: stock})
+
+    def branch_stock(self, branch_id, version):
+        cached = self.stock.get(branch_id)
+        if cached is None or cached[0] != version:
+            cached = (version, dict(
+                Inventory.objects.filter(branch_id=branch_id).values_list('product_id', 'stock')
+            ))
+            self.stock[branch_id] = cached
+        return cached[1]
+
+    def find(self, sku, prefix=False, limit=PREFIX_LOOKUP_LIMIT):
+        """SKUs que coinciden: exacto, o los primeros `limit` que empiezan con `sku`"""
+        if not prefix:
+            return [sku] if sku in self.by_sku else []
+        matches = []
+        for candidate in self.skus[bisect_left(self.skus, sku):]:
+            if not candidate.startswith(sku) or len(matches) >= limit:
+                break
+            matches.append(candidate)
+        return matches
+
+
+def lookup_sku(company_id, branch_id, sku, prefix=False, limit=PREFIX_LOOKUP_LIMIT):
+    """
+    Productos de la empresa con ese SKU (o prefijo de SKU) y su stock en la
+    sucursal. Devuelve None si la sucursal no es de la empresa o no está activa.
+    """
+    stamps = _read_stamps([_company_key(company_id), _stock_key(branch_id)])
+    company_version = stamps[_company_key(company_id)]
+    stock_version = stamps[_stock_key(branch_id)]
+
+    index = _indexes.get(company_id)
+    if index is None or index.version != company_version:
+        with _lock:
+            index = _indexes.get(company_id)
+            if index is None or index.version != company_version:
+                index = CompanySkuIndex(company_id, company_version)
+                _indexes[company_id] = index
+
+    if branch_id not in index.branch_ids:
+        return None
+    stock = index.branch_stock(branch_id, stock_version)
+    results = []
+    for match in index.find(sku, prefix=prefix, limit=limit):
+        pk, name, price = index.by_sku[match]
+        results.append({
+            'id': pk,
+            'sku': match,
+            'name': name,
+            'price': price,
+            # None: el producto no tiene inventario en la sucursal
+            'stock': stock.get(pk),
+        })
+    return results
+
+
+def clear_indexes():
+    """Descarta los índices en memoria de este proceso"""
+    _indexes.clear()
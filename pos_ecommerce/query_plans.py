@@ -0,0 +1,200 @@
+"""
+Planes de ejecución de las consultas del sistema POS + E-commerce de TemucoSoft S.A.
+
+Ejecuta los listados de la API y los reportes como un usuario dado,
+captura cada consulta SQL y obtiene su plan con EXPLAIN (PostgreSQL y
+SQLite). Se marca como regresión:
+
+- todo recorrido secuencial (Seq Scan / SCAN sin índice) sobre una de las
+  tablas grandes de LARGE_TABLES: en esas tablas cada consulta de un
+  endpoint debe resolverse con un índice;
+- que un filtro de EXPECTED_INDEXES deje de usar su índice compuesto (los
+  índices de las claves foráneas evitan el recorrido secuencial, pero no
+  sirven para filtrar y ordenar a la vez).
+
+Con pocos datos PostgreSQL prefiere recorrer la tabla aunque exista el
+índice: `prefer_indexes=True` desactiva enable_seqscan durante el EXPLAIN,
+con lo que solo quedan los recorridos que ningún índice puede evitar.
+
+Lo usan `manage.py explain_queries` y el test de planes de consultas.
+"""
+import json
+import re
+from datetime import timedelta
+from urllib.parse import parse_qsl, urlsplit
+
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve, reverse
+from django.utils import timezone
+from rest_framework.test import force_authenticate
+
+from .models import (
+    CartItem, Inventory, InventoryMovement, InventoryMovementDailySummary, Order, OrderItem,
+    Payment, Product, Purchase, PurchaseItem, Sale, SaleItem, SalesDailyRollup
+)
+
+# Tablas que crecen con la operación: no deben recorrerse completas
+LARGE_TABLES = {
+    model._meta.db_table for model in (
+        Sale, SaleItem, Payment, Order, OrderItem, InventoryMovement, Purchase, PurchaseItem,
+        CartItem, Inventory, Product, SalesDailyRollup, InventoryMovementDailySummary
+    )
+}
+
+# (nombre de la URL, parámetro de filtro) -> índice que debe aparecer en el plan
+EXPECTED_INDEXES = {
+    ('sale-list', 'branch'): 'pos_sale_branch_created_idx',
+    ('report_sales', 'date_from'): 'pos_sale_branch_created_idx',
+    ('order-list', 'status'): 'pos_order_company_status_idx',
+    ('payment-list', 'status'): 'pos_payment_status_created_idx',
+    ('inventory-movement-list', 'inventory'): 'pos_movement_inv_created_idx',
+    ('report_suppliers', None): 'pos_purchase_supplier_date_idx',
+    ('inventory-low-stock', None): 'pos_inventory_restock_idx',
+}
+
+_ALIAS = re.compile(r'"(\w+)" (?:AS )?"?([A-Z]\d+)"?')
+
+
+def endpoint_paths(user):
+    """Listados del router, el feed de stock bajo y los reportes, con filtros típicos"""
+    from .urls import router
+
+    paths = [reverse(f'{basename}-list') for _, _, basename in router.registry]
+    paths.append(reverse('inventory-low-stock'))
+
+    desde = (timezone.localdate() - timedelta(days=30)).isoformat()
+    paths += [
+        reverse('report_stock'),
+        f"{reverse('report_sales')}?date_from={desde}",
+        reverse('report_suppliers'),
+        f"{reverse('report_movements')}?date_from={desde}",
+        f"{reverse('order-list')}?status=PENDIENTE",
+        f"{reverse('payment-list')}?status=COMPLETADO",
+    ]
+    branch = user.company.branches.order_by('pk').first() if user.company_id else None
+    if branch is not None:
+        inventory = Inventory.objects.filter(branch=branch).order_by('pk').first()
+        paths += [
+            f"{reverse('sale-list')}?branch={branch.pk}",
+            f"{reverse('report_sales')}?branch={branch.pk}&date_from={desde}",
+        ]
+        if inventory is not None:
+            paths.append(f"{reverse('inventory-movement-list')}?inventory={inventory.pk}")
+    return paths
+
+
+def capture_queries(user, path):
+    """Ejecuta un GET como `user` y devuelve el SQL de cada consulta (sin escribir nada)"""
+    factory = RequestFactory()
+    request = factory.get(path)
+    request.user = user or AnonymousUser()
+    force_authenticate(request, user=user)
+    match = resolve(request.path_info)
+
+    with transaction.atomic(), CaptureQueriesContext(connection) as captured:
+        response = match.func(request, *match.args, **match.kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        transaction.set_rollback(True)
+    return response.status_code, [query['sql'] for query in captured.captured_queries]
+
+
+def expected_index(path):
+    """Índice que debe usar el endpoint según EXPECTED_INDEXES (o None)"""
+    url = urlsplit(path)
+    url_name = resolve(url.path).url_name
+    for param, _ in parse_qsl(url.query):
+        if (url_name, param) in EXPECTED_INDEXES:
+            return EXPECTED_INDEXES[(url_name, param)]
+    return EXPECTED_INDEXES.get((url_name, None))
+
+
+def explain(sql, prefer_indexes=False):
+    """
+    Plan de una consulta como (líneas, tablas recorridas secuencialmente).
+    Solo PostgreSQL y SQLite; en otros motores devuelve ([], set()).
+    """
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return [], set()
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            if prefer_indexes:
+                # SET LOCAL: vuelve al valor anterior al terminar el bloque atomic
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}')
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return _postgresql_plan(plan[0]['Plan'])
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return _sqlite_plan(cursor.fetchall(), sql)
+    return [], set()
+
+
+def _postgresql_plan(node, depth=0):
+    lines = ['  ' * depth + node['Node Type'] + (
+        f" on {node['Relation Name']}" if 'Relation Name' in node else ''
+    ) + (f" using {node['Index Name']}" if 'Index Name' in node else '')]
+    scans = {node['Relation Name']} if node['Node Type'] == 'Seq Scan' else set()
+    for child in node.get('Plans', []):
+        child_lines, child_scans = _postgresql_plan(child, depth + 1)
+        lines += child_lines
+        scans |= child_scans
+    return lines, scans
+
+
+def _sqlite_plan(rows, sql):
+    # Las subconsultas de Django usan alias (U0, T3...): se traducen a la tabla
+    aliases = {alias: table for table, alias in _ALIAS.findall(sql)}
+    lines, scans = [], set()
+    for row in rows:
+        detail = row[-1]
+        lines.append(detail)
+        parts = detail.split()
+        if len(parts) == 2 and parts[0] == 'SCAN':
+            scans.add(aliases.get(parts[1], parts[1]))
+    return lines, scans
+
+
+def check_endpoints(user, paths=None, prefer_indexes=False):
+    """
+    Recorre los endpoints y devuelve una lista de dicts con path, status,
+    índice esperado (expected_index, si usa alguno de sus planes: index_used)
+    y por consulta su sql, plan y tablas grandes recorridas secuencialmente.
+    """
+    report = []
+    for path in paths or endpoint_paths(user):
+        status_code, queries = capture_queries(user, path)
+        entries = []
+        for sql in queries:
+            lines, scans = explain(sql, prefer_indexes=prefer_indexes)
+            entries.append({'sql': sql, 'plan': lines, 'seq_scans': sorted(scans & LARGE_TABLES)})
+        index = expected_index(path)
+        report.append({
+            'path': path,
+            'status': status_code,
+            'queries': entries,
+            'expected_index': index,
+            'index_used': index is not None and any(
+                index in line for entry in entries for line in entry['plan']
+            ),
+        })
+    return report
+
+
+def regressions(report):
+    """Mensajes de los recorridos secuenciales sobre tablas grandes y de los índices esperados sin usar"""
+    messages = [
+        f"{endpoint['path']}: recorrido secuencial de {', '.join(query['seq_scans'])} en {query['sql'][:300]}"
+        for endpoint in report for query in endpoint['queries'] if query['seq_scans']
+    ]
+    messages += [
+        f"{endpoint['path']}: no usa el índice {endpoint['expected_index']}"
+        for endpoint in report
+        if endpoint['expected_index'] and endpoint['status'] == 200 and not endpoint['index_used']
+    ]
+    return messages
@@ -0,0 +1,201 @@
+"""
+Consultas de los reportes del sistema POS + E-commerce de TemucoSoft S.A.
+
+Los filtros de cada reporte se aplican aquí a partir de un dict de
+parámetros (request.GET o los guardados en un ReportJob), de modo que la
+vista HTML, la exportación en streaming y los trabajos en segundo plano
+entreguen exactamente las mismas filas.
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Count, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .exports import EXPORT_CHUNK_SIZE, render_rows
+from .models import Inventory, InventoryMovement, Product, Sale, Supplier
+
+logger = logging.getLogger(__name__)
+
+# Lo que ve el cliente en ReportJob.error; el detalle queda en el log
+REPORT_JOB_ERROR = 'No se pudo generar el reporte; intente nuevamente o contacte a soporte'
+
+
+def parse_report_date(value):
+    """Convierte 'YYYY-MM-DD' (o un datetime ISO) en date; None si no es válida"""
+    if not value:
+        return None
+    try:
+        return parse_date(value[:10])
+    except ValueError:
+        return None
+
+
+def local_day_start(day):
+    """Inicio del día en la zona horaria local (TIME_ZONE)"""
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+
+
+def _for_company(queryset, user, lookup):
+    if user.role != 'SUPER_ADMIN' and user.company_id:
+        queryset = queryset.filter(**{lookup: user.company_id})
+    return queryset
+
+
+def _in_period(queryset, params):
+    date_from = parse_report_date(params.get('date_from'))
+    date_to = parse_report_date(params.get('date_to'))
+    if date_from:
+        queryset = queryset.filter(created_at__gte=local_day_start(date_from))
+    if date_to:
+        queryset = queryset.filter(created_at__lt=local_day_start(date_to + timedelta(days=1)))
+    return queryset
+
+
+def inventory_queryset(user, params):
+    """Inventario del reporte de stock (?branch=, ?category=)"""
+    inventory = _for_company(Inventory.objects.all(), user, 'branch__company_id')
+    if params.get('branch'):
+        inventory = inventory.filter(branch_id=params['branch'])
+    if params.get('category'):
+        inventory = inventory.filter(product__category=params['category'])
+    return inventory
+
+
+def sales_queryset(user, params):
+    """Ventas del reporte de ventas (?branch=, ?date_from=, ?date_to=)"""
+    sales = _for_company(Sale.objects.all(), user, 'branch__company_id')
+    if params.get('branch'):
+        sales = sales.filter(branch_id=params['branch'])
+    return _in_period(sales, params)
+
+
+def suppliers_queryset(user, params=None):
+    """Proveedores del reporte de proveedores"""
+    return _for_company(Supplier.objects.all(), user, 'company_id')
+
+
+def movements_queryset(user, params):
+    """Movimientos del reporte de movimientos (?tipo=, ?date_from=, ?date_to=)"""
+    movements = _for_company(InventoryMovement.objects.all(), user, 'inventory__branch__company_id')
+    if params.get('tipo'):
+        movements = movements.filter(movement_type=params['tipo'])
+    return _in_period(movements, params)
+
+
+# ============================================================================
+# Exportaciones: (nombre, columnas, filas) con filas leídas en bloques
+# ============================================================================
+
+def export_stock(user, params):
+    categorias = dict(Product.CATEGORY_CHOICES)
+    rows = inventory_queryset(user, params).order_by('branch__name', 'product__name').values_list(
+        'branch__name', 'product__name', 'product__sku', 'product__category',
+        'stock', 'reorder_point', 'last_restock_date'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    return 'reporte_stock', [
+        'sucursal', 'producto', 'sku', 'categoria', 'stock_actual',
+        'punto_reorden', 'requiere_restock', 'ultimo_restock'
+    ], (
+        (sucursal, producto, sku, categorias.get(categoria, categoria), stock,
+         reorden, stock <= reorden, ultimo_restock)
+        for sucursal, producto, sku, categoria, stock, reorden, ultimo_restock in rows
+    )
+
+
+def export_sales(user, params):
+    metodos = dict(Sale.PAYMENT_METHOD_CHOICES)
+    rows = sales_queryset(user, params).order_by('created_at', 'id').values_list(
+        'id', 'created_at', 'branch__name', 'user__username', 'payment_method', 'total_amount'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    return 'reporte_ventas', [
+        'id', 'fecha', 'sucursal', 'vendedor', 'metodo_pago', 'total'
+    ], (
+        (pk, fecha, sucursal, vendedor or 'N/A', metodos.get(metodo, metodo), total)
+        for pk, fecha, sucursal, vendedor, metodo, total in rows
+    )
+
+
+def export_suppliers(user, params):
+    # Una fila por proveedor con sus totales (sin el detalle de compras)
+    rows = suppliers_queryset(user, params).annotate(
+        total_compras=Count('purchases'),
+        monto_total=Sum('purchases__total_amount')
+    ).order_by('name', 'id').values_list(
+        'id', 'name', 'rut', 'contact_name', 'contact_email', 'contact_phone',
+        'is_active', 'total_compras', 'monto_total'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    return 'reporte_proveedores', [
+        'id', 'nombre', 'rut', 'contacto', 'email', 'telefono', 'activo',
+        'total_compras', 'monto_total_compras'
+    ], (row[:-1] + (row[-1] or 0,) for row in rows)
+
+
+def export_movements(user, params):
+    tipos = dict(InventoryMovement.MOVEMENT_TYPE_CHOICES)
+    rows = movements_queryset(user, params).order_by('created_at', 'id').values_list(
+        'created_at', 'movement_type', 'inventory__product__name', 'inventory__product__sku',
+        'inventory__branch__name', 'quantity', 'previous_stock', 'new_stock',
+        'user__username', 'notes'
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    return 'reporte_movimientos', [
+        'fecha', 'tipo', 'producto', 'sku', 'sucursal', 'cantidad',
+        'stock_anterior', 'stock_nuevo', 'usuario', 'notas'
+    ], (
+        (fecha, tipos.get(tipo, tipo), *resto, usuario or 'Sistema', notas)
+        for fecha, tipo, *resto, usuario, notas in rows
+    )
+
+
+EXPORTS = {
+    'STOCK': export_stock,
+    'VENTAS': export_sales,
+    'PROVEEDORES': export_suppliers,
+    'MOVIMIENTOS': export_movements,
+}
+
+# Filtros aceptados en ReportJob.params
+REPORT_PARAMS = ('branch', 'category', 'date_from', 'date_to', 'tipo')
+
+
+def run_report_job(job):
+    """
+    Genera el archivo de un ReportJob ya tomado por un worker.
+    Escribe en un archivo temporal y lo renombra al terminar, así una
+    descarga nunca ve un archivo a medias.
+    """
+    try:
+        _, columns, rows = EXPORTS[job.report_type](job.user, job.params)
+        relative = os.path.join(str(job.user.company_id or 'plataforma'), f'{job.pk}.{job.export_format}')
+        path = os.path.join(settings.REPORT_JOBS_ROOT, relative)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        row_count = 0
+
+        def counted(rows):
+            nonlocal row_count
+            for row in rows:
+                row_count += 1
+                yield row
+
+        with open(f'{path}.tmp', 'w', encoding='utf-8', newline='') as output:
+            for line in render_rows(job.export_format, columns, counted(rows)):
+                output.write(line)
+        os.replace(f'{path}.tmp', path)
+    except Exception:
+        logger.exception('Reporte %s (%s) falló', job.pk, job.report_type)
+        job.status = 'ERROR'
+        job.error = REPORT_JOB_ERROR
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        raise
+
+    job.status = 'COMPLETADO'
+    job.result_file = relative
+    job.row_count = row_count
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result_file', 'row_count', 'finished_at'])
+    return job
@@ -0,0 +1,317 @@
+"""
+Reservas de stock de las órdenes e-commerce del sistema POS + E-commerce de TemucoSoft S.A.
+
+Una orden PENDIENTE reserva las unidades de sus productos en los
+inventarios de las sucursales de la empresa (StockReservation), y cada
+inventario mantiene en `reserved` la suma de sus reservas activas. Lo que
+la tienda puede vender es `stock - reserved` (Inventory.available_stock).
+
+- Reservar y liberar son UPDATE condicionados en lote
+  (Inventory.apply_reserved_deltas): dos checkouts del mismo producto no
+  se bloquean más que lo que dura su propia transacción, y el que llega
+  tarde a la última unidad recibe ReservationError en vez de vender de más.
+- CONFIRMADO / ENVIADO / ENTREGADO consumen las reservas: el stock baja
+  con un movimiento VENTA por inventario (Inventory.consume_reserved).
+- CANCELADO libera las reservas de una orden pendiente y devuelve al stock
+  (DEVOLUCION) lo que consumió una confirmada. Los cambios de estado se
+  validan contra STATUS_TRANSITIONS (una cancelada no se reabre).
+- Las reservas que vencen (STOCK_RESERVATION_TTL) las libera por lotes
+  `manage.py release_expired_reservations`; si la orden se confirma
+  después, se vuelve a reservar si todavía hay stock.
+
+Las salidas de stock del POS y del libro de movimientos (ventas, ajustes
+negativos, transferencias) tampoco pueden tocar lo reservado: sus UPDATE
+condicionados exigen stock - reserved suficiente (Inventory.apply_stock_delta
+y apply_stock_deltas). Una reserva activa garantiza la confirmación de la
+orden en todos los canales.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import counters
+from .models import Inventory, InventoryMovement, InventoryMovementDailySummary, Order, StockReservation
+from .pos_lookup import bump_stock_version
+
+# Estados de la orden que retiran el stock reservado
+CONSUMING_STATUSES = ('CONFIRMADO', 'ENVIADO', 'ENTREGADO')
+
+# Cambios de estado permitidos. Una orden cancelada no se reabre y una
+# enviada ya no vuelve al stock: solo se cancela hasta CONFIRMADO
+STATUS_TRANSITIONS = {
+    'PENDIENTE': {'CONFIRMADO', 'ENVIADO', 'ENTREGADO', 'CANCELADO'},
+    'CONFIRMADO': {'ENVIADO', 'ENTREGADO', 'CANCELADO'},
+    'ENVIADO': {'ENTREGADO'},
+    'ENTREGADO': set(),
+    'CANCELADO': set(),
+}
+
+RESERVE_ATTEMPTS = 3
+SWEEP_BATCH_SIZE = 500
+
+
+class ReservationError(Exception):
+    """No hay stock disponible para reservar o consumir la orden"""
+
+
+class StatusTransitionError(Exception):
+    """Cambio de estado de la orden no permitido"""
+
+
+class _ReservationConflict(Exception):
+    """Otra transacción tomó el stock entre la lectura y el UPDATE"""
+
+
+def reservation_ttl():
+    return getattr(settings, 'STOCK_RESERVATION_TTL', 60 * 30)
+
+
+# ============================================================================
+# Reserva
+# ============================================================================
+
+def reserve(order, quantities, products=None):
+    """
+    Reserva {product_id: cantidad} para la orden en los inventarios de las
+    sucursales activas, empezando por las que tienen más stock disponible
+    (una línea puede repartirse entre sucursales). Debe llamarse dentro de
+    la transacción que crea o confirma la orden.
+
+    Cuesta una lectura de inventarios, un UPDATE y un INSERT; solo si otro
+    checkout se adelanta se repite (hasta RESERVE_ATTEMPTS veces).
+    """
+    for _ in range(RESERVE_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return _reserve_once(order, quantities, products or {})
+        except _ReservationConflict:
+            continue
+    raise ReservationError('El stock cambió mientras se reservaba la orden; intente nuevamente')
+
+
+def _reserve_once(order, quantities, products):
+    candidates = defaultdict(list)
+    for inventory in Inventory.objects.filter(
+        product_id__in=list(quantities),
+        branch__is_active=True,
+        stock__gt=F('reserved'),
+    ).order_by(F('reserved') - F('stock'), 'pk').values('id', 'product_id', 'stock', 'reserved'):
+        candidates[inventory['product_id']].append(inventory)
+
+    deltas = {}
+    for product_id, quantity in quantities.items():
+        remaining = quantity
+        for inventory in candidates[product_id]:
+            take = min(remaining, inventory['stock'] - inventory['reserved'])
+            deltas[inventory['id']] = take
+            remaining -= take
+            if not remaining:
+                break
+        if remaining:
+            product = products.get(product_id)
+            name = product.name if product is not None else f'Producto {product_id}'
+            raise ReservationError(
+                f'Stock insuficiente para {name}. Disponible: {quantity - remaining}, Solicitado: {quantity}'
+            )
+
+    if Inventory.apply_reserved_deltas(deltas) != len(deltas):
+        raise _ReservationConflict()
+
+    expires_at = timezone.now() + timedelta(seconds=reservation_ttl())
+    return StockReservation.objects.bulk_create([
+        StockReservation(order=order, inventory_id=inventory_id, quantity=quantity, expires_at=expires_at)
+        for inventory_id, quantity in deltas.items()
+    ])
+
+
+# ============================================================================
+# Liberación y consumo
+# ============================================================================
+
+def _release_rows(rows, status):
+    """
+    Descuenta el reserved de las reservas (dicts id/inventory_id/quantity) y
+    las marca. Lanza ReservationError, sin marcar nada, si algún inventario
+    tiene menos reservado que sus reservas: la transacción que llama debe
+    revertirse.
+    """
+    if not rows:
+        return 0
+    deltas = defaultdict(int)
+    for row in rows:
+        deltas[row['inventory_id']] -= row['quantity']
+    if Inventory.apply_reserved_deltas(deltas) != len(deltas):
+        raise ReservationError('El stock reservado del inventario no coincide con sus reservas')
+    StockReservation.objects.filter(pk__in=[row['id'] for row in rows]).update(status=status)
+    return len(rows)
+
+
+def release(order, status='LIBERADA'):
+    """Libera las reservas activas de la orden; devuelve cuántas liberó"""
+    with transaction.atomic():
+        rows = list(
+            StockReservation.objects.select_for_update().filter(order=order, status='ACTIVA')
+            .values('id', 'inventory_id', 'quantity')
+        )
+        return _release_rows(rows, status)
+
+
+def consume(order, user=None):
+    """
+    Retira del stock lo reservado por la orden, con un movimiento VENTA por
+    inventario. Si sus reservas vencieron, primero vuelve a reservar los
+    items de la orden. Las órdenes sin reservas (anteriores a las reservas)
+    no mueven stock. Lanza ReservationError si el stock ya no alcanza.
+    """
+    with transaction.atomic():
+        active = StockReservation.objects.select_for_update().filter(order=order, status='ACTIVA')
+        rows = list(active.values('id', 'inventory_id', 'quantity'))
+        if not rows:
+            if not order.reservations.filter(status='VENCIDA').exists():
+                return []
+            quantities = defaultdict(int)
+            for product_id, quantity in order.items.values_list('product_id', 'quantity'):
+                quantities[product_id] += quantity
+            rows = [
+                {'id': reservation.pk, 'inventory_id': reservation.inventory_id, 'quantity': reservation.quantity}
+                for reservation in reserve(order, quantities)
+            ]
+
+        quantities = _quantities_by_inventory(rows)
+        inventories = _lock_inventories(quantities)
+        if not Inventory.consume_reserved(quantities):
+            raise ReservationError(f'Stock insuficiente para confirmar la orden #{order.pk}')
+        StockReservation.objects.filter(pk__in=[row['id'] for row in rows]).update(status='CONSUMIDA')
+        return _record_movements(order, inventories, quantities, 'VENTA', user)
+
+
+def restock(order, user=None):
+    """
+    Devuelve al stock lo que la orden consumió (orden confirmada que se
+    cancela), con un movimiento DEVOLUCION por inventario. Sus reservas
+    quedan LIBERADAS.
+    """
+    with transaction.atomic():
+        consumed = StockReservation.objects.select_for_update().filter(order=order, status='CONSUMIDA')
+        rows = list(consumed.values('id', 'inventory_id', 'quantity'))
+        if not rows:
+            return []
+        quantities = _quantities_by_inventory(rows)
+        inventories = _lock_inventories(quantities)
+        if not Inventory.apply_stock_deltas(quantities):
+            raise ReservationError(f'No se pudo devolver al stock lo consumido por la orden #{order.pk}')
+        StockReservation.objects.filter(pk__in=[row['id'] for row in rows]).update(status='LIBERADA')
+        return _record_movements(order, inventories, quantities, 'DEVOLUCION', user)
+
+
+def _quantities_by_inventory(rows):
+    quantities = defaultdict(int)
+    for row in rows:
+        quantities[row['inventory_id']] += row['quantity']
+    return quantities
+
+
+def _lock_inventories(quantities):
+    """Inventarios bloqueados con su stock antes del cambio (para el libro de movimientos)"""
+    # of=('self',): no bloquear también las filas de las sucursales del JOIN
+    locked = Inventory.objects.select_for_update(of=('self',)).filter(pk__in=list(quantities))
+    return {
+        inventory['id']: inventory
+        for inventory in locked.values('id', 'branch_id', 'branch__company_id', 'stock', 'reorder_point')
+    }
+
+
+def _record_movements(order, inventories, quantities, movement_type, user):
+    """Registra los movimientos de un cambio de stock ya aplicado con un UPDATE en lote"""
+    sign = 1 if movement_type in InventoryMovement.INCOMING_TYPES else -1
+    movements = [
+        InventoryMovement(
+            inventory_id=inventory_id,
+            movement_type=movement_type,
+            quantity=quantity,
+            previous_stock=inventories[inventory_id]['stock'],
+            new_stock=inventories[inventory_id]['stock'] + sign * quantity,
+            user=user if user is not None and user.is_authenticated else None,
+            notes=f'Orden e-commerce #{order.pk}'
+        )
+        for inventory_id, quantity in quantities.items()
+    ]
+    # bulk_create no pasa por InventoryMovement.save: el stock ya se
+    # actualizó y los resúmenes, el índice del POS y los contadores del
+    # panel se actualizan aquí (igual que en services._write_sales)
+    InventoryMovement.objects.bulk_create(movements)
+    InventoryMovementDailySummary.apply_movements(movements)
+    bump_stock_version(*(inventory['branch_id'] for inventory in inventories.values()))
+    low_stock_changes = defaultdict(list)
+    for movement in movements:
+        inventory = inventories[movement.inventory_id]
+        low_stock_changes[inventory['branch__company_id']].append(
+            (movement.previous_stock, movement.new_stock, inventory['reorder_point'])
+        )
+    for company_id, changes in low_stock_changes.items():
+        counters.record_low_stock_changes(company_id, changes)
+    return movements
+
+
+# ============================================================================
+# Cambios de estado de la orden
+# ============================================================================
+
+def check_status_change(previous, new_status):
+    """Lanza StatusTransitionError si la orden no puede pasar de `previous` a `new_status`"""
+    if new_status != previous and new_status not in STATUS_TRANSITIONS[previous]:
+        raise StatusTransitionError(
+            f'Una orden {previous.lower()} no puede pasar a {new_status.lower()}'
+        )
+
+
+def apply_status_change(order, new_status, user=None):
+    """
+    Valida el cambio de `order` (aún con su estado anterior) a `new_status`
+    y aplica su efecto en el stock: consumir la reserva al confirmar,
+    liberarla al cancelar una pendiente o devolver lo consumido al cancelar
+    una confirmada. Debe llamarse dentro de la transacción que guarda el
+    nuevo estado: la fila de la orden queda bloqueada y el estado anterior
+    se relee, de modo que dos cambios simultáneos no consumen dos veces.
+    """
+    order.status = Order.objects.select_for_update().values_list('status', flat=True).get(pk=order.pk)
+    check_status_change(order.status, new_status)
+    if new_status == order.status:
+        return
+    if order.status == 'PENDIENTE':
+        if new_status in CONSUMING_STATUSES:
+            consume(order, user)
+        else:
+            release(order)
+    elif new_status == 'CANCELADO':
+        restock(order, user)
+
+
+# ============================================================================
+# Reservas vencidas
+# ============================================================================
+
+def release_expired(batch_size=SWEEP_BATCH_SIZE, now=None):
+    """
+    Libera las reservas activas vencidas, de a `batch_size` por transacción
+    (las filas tomadas por otra transacción se saltan y quedan para la
+    próxima pasada). Devuelve cuántas liberó.
+    """
+    now = now or timezone.now()
+    released = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(status='ACTIVA', expires_at__lte=now)
+                .order_by('expires_at')
+                .values('id', 'inventory_id', 'quantity')[:batch_size]
+            )
+            released += _release_rows(rows, 'VENCIDA')
+        if len(rows) < batch_size:
+            return released
+
@@ -0,0 +1,239 @@
+"""
+Búsqueda de productos con índice de texto completo del sistema POS + E-commerce de TemucoSoft S.A.
+
+- PostgreSQL: columna generada `search_vector` (tsvector) con la configuración
+  `spanish_unaccent` (raíces en español y sin tildes) y un índice GIN.
+- SQLite (desarrollo e instalaciones pequeñas): tabla FTS5 `pos_product_fts`
+  con contenido externo en la tabla de productos (sin tildes, sin raíces).
+
+En ambos casos la base de datos mantiene el índice al insertar, modificar o
+eliminar productos (columna generada / triggers), incluso con
+QuerySet.update(). Si una migración futura reconstruye la tabla de productos
+en SQLite, se pierden los triggers: `python manage.py rebuild_search_index`
+los vuelve a crear y reindexa.
+
+Las consultas usan cada palabra como prefijo y exigen todas (AND). Los
+resultados se ordenan por relevancia (`search_rank`, mayor es mejor) y
+traen el nombre y un fragmento de la descripción con las coincidencias
+marcadas (ver render_highlight).
+"""
+import re
+
+from django.db import connection as default_connection
+from django.db.models import BooleanField, FloatField, TextField
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from rest_framework.filters import SearchFilter
+
+from .models import Product
+
+SEARCH_CONFIG = 'spanish_unaccent'
+FTS_TABLE = 'pos_product_fts'
+MAX_SEARCH_TERMS = 10
+
+# Marcas de coincidencia que devuelve la base de datos; se reemplazan por
+# <mark> después de escapar el texto, así el HTML del producto no se interpreta
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+
+# Pesos por columna (nombre, sku, descripción) para bm25 en SQLite
+FTS_WEIGHTS = (10.0, 5.0, 1.0)
+
+
+def search_terms(query):
+    """Palabras de la búsqueda (solo letras y números, como máximo MAX_SEARCH_TERMS)"""
+    return re.findall(r'\w+', query or '')[:MAX_SEARCH_TERMS]
+
+
+def _product_column(name):
+    qn = default_connection.ops.quote_name
+    return f'{qn(Product._meta.db_table)}.{qn(name)}'
+
+
+def _match(terms, vendor):
+    """Condición SQL y parámetros de la búsqueda para el motor dado"""
+    if vendor == 'postgresql':
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        return (
+            f"{_product_column('search_vector')} @@ to_tsquery(%s::regconfig, %s)",
+            [SEARCH_CONFIG, tsquery]
+        )
+    fts_query = ' '.join(f'"{term}"*' for term in terms)
+    return (
+        f"{_product_column('id')} IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)",
+        [fts_query]
+    )
+
+
+def search_products(queryset, query, ranked=True):
+    """
+    Filtra `queryset` (de Product) por la búsqueda usando el índice.
+    Con `ranked` agrega `search_rank`, `name_highlight` y
+    `description_highlight` y ordena por relevancia.
+    Una búsqueda sin palabras válidas no devuelve productos.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset.none()
+    vendor = default_connection.vendor
+    condition, params = _match(terms, vendor)
+    queryset = queryset.filter(RawSQL(condition, params, output_field=BooleanField()))
+    if not ranked:
+        return queryset
+
+    if vendor == 'postgresql':
+        tsquery = params[1]
+        to_query = 'to_tsquery(%s::regconfig, %s)'
+        options = f'StartSel="{HIGHLIGHT_START}", StopSel="{HIGHLIGHT_STOP}"'
+        annotations = {
+            'search_rank': RawSQL(
+                f"ts_rank_cd({_product_column('search_vector')}, {to_query})",
+                [SEARCH_CONFIG, tsquery], output_field=FloatField()
+            ),
+            'name_highlight': RawSQL(
+                f"ts_headline(%s::regconfig, {_product_column('name')}, {to_query}, %s)",
+                [SEARCH_CONFIG, SEARCH_CONFIG, tsquery, f'{options}, HighlightAll=true'],
+                output_field=TextField()
+            ),
+            'description_highlight': RawSQL(
+                f"ts_headline(%s::regconfig, {_product_column('description')}, {to_query}, %s)",
+                [SEARCH_CONFIG, SEARCH_CONFIG, tsquery, f'{options}, MaxWords=25, MinWords=10'],
+                output_field=TextField()
+            ),
+        }
+    else:
+        fts_query = params[0]
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+
+        def fts(expression, output_field):
+            return RawSQL(
+                f"(SELECT {expression} FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+                f"AND rowid = {_product_column('id')})",
+                [fts_query], output_field=output_field
+            )
+
+        marks = f"char({ord(HIGHLIGHT_START)}), char({ord(HIGHLIGHT_STOP)})"
+        annotations = {
+            # bm25 es menor cuanto más relevante: se invierte el signo
+            'search_rank': fts(f'-bm25({FTS_TABLE}, {weights})', FloatField()),
+            'name_highlight': fts(f'highlight({FTS_TABLE}, 0, {marks})', TextField()),
+            'description_highlight': fts(f"snippet({FTS_TABLE}, 2, {marks}, '…', 25)", TextField()),
+        }
+    return queryset.annotate(**annotations).order_by('-search_rank', 'name', 'id')
+
+
+def render_highlight(text):
+    """Texto resaltado por la base de datos como HTML seguro con <mark>"""
+    if not text:
+        return ''
+    return mark_safe(
+        escape(text).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_STOP, '</mark>')
+    )
+
+
+class FullTextSearchFilter(SearchFilter):
+    """
+    `?search=` de la API con el índice de texto completo en vez de
+    `icontains` sobre `search_fields`. Sin `?ordering=` los resultados
+    vienen por relevancia.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not query.strip():
+            return queryset
+        ranked = not request.query_params.get('ordering')
+        return search_products(queryset, query, ranked=ranked)
+
+
+# ============================================================================
+# Instalación del índice (rebuild_search_index; la migración 0009 congela su propia copia)
+# ============================================================================
+
+def _postgresql_statements(table):
+    return [
+        'CREATE EXTENSION IF NOT EXISTS unaccent',
+        f"""
+        DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = '{SEARCH_CONFIG}') THEN
+                CREATE TEXT SEARCH CONFIGURATION {SEARCH_CONFIG} (COPY = spanish);
+                ALTER TEXT SEARCH CONFIGURATION {SEARCH_CONFIG}
+                    ALTER MAPPING FOR hword, hword_part, word WITH unaccent, spanish_stem;
+            END IF;
+        END $$
+        """,
+        f"""
+        ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('{SEARCH_CONFIG}'::regconfig, coalesce(name, '')), 'A') ||
+            setweight(to_tsvector('{SEARCH_CONFIG}'::regconfig, coalesce(sku, '')), 'A') ||
+            setweight(to_tsvector('{SEARCH_CONFIG}'::regconfig, coalesce(description, '')), 'B')
+        ) STORED
+        """,
+        f'CREATE INDEX IF NOT EXISTS pos_product_search_idx ON {table} USING GIN (search_vector)',
+    ]
+
+
+def _sqlite_statements(table):
+    columns = 'name, sku, description'
+    new_values = 'new.id, new.name, new.sku, new.description'
+    old_values = "'delete', old.id, old.name, old.sku, old.description"
+    return [
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+            {columns}, content={table}, content_rowid=id,
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES ({new_values});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ({old_values});
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON {table} BEGIN
+            INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ({old_values});
+            INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES ({new_values});
+        END
+        """,
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+    ]
+
+
+def install_search_index(connection):
+    """Crea (o completa) el índice de búsqueda y lo llena con los productos actuales"""
+    table = connection.ops.quote_name(Product._meta.db_table)
+    if connection.vendor == 'postgresql':
+        statements = _postgresql_statements(table)
+    elif connection.vendor == 'sqlite':
+        statements = _sqlite_statements(table)
+    else:
+        return
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def drop_search_index(connection):
+    """Elimina el índice de búsqueda (la configuración de PostgreSQL se conserva)"""
+    table = connection.ops.quote_name(Product._meta.db_table)
+    if connection.vendor == 'postgresql':
+        statements = [
+            'DROP INDEX IF EXISTS pos_product_search_idx',
+            f'ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector',
+        ]
+    elif connection.vendor == 'sqlite':
+        statements = [
+            f'DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}' for suffix in ('ai', 'ad', 'au')
+        ] + [f'DROP TABLE IF EXISTS {FTS_TABLE}']
+    else:
+        return
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
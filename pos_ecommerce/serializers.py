@@ -7,8 +7,12 @@ from django.contrib.auth import get_user_model
 from django.utils import timezone
 from .models import (
     Company, Subscription, Branch, Supplier, Product, Inventory, InventoryMovement,
-    Purchase, PurchaseItem, Sale, SaleItem, Order, OrderItem, CartItem, Payment
+    Purchase, PurchaseItem, Sale, SaleItem, Order, OrderItem, Payment, ReportJob
 )
+from .entitlements import adds_active, company_plans, limit_error, plan_is_valid
+from .reports import REPORT_PARAMS
+from .search import render_highlight
+from .services import create_sale, SaleRejectedError
 from .validators import (
     validar_rut_chileno,
     validar_fecha_no_futura,
@@ -19,6 +23,27 @@ from .validators import (
 User = get_user_model()
 
 
+def validar_limite_del_plan(serializer, data, resource):
+    """Rechaza el alta (o reactivación) de una sucursal o usuario que supere el plan de la empresa"""
+    instance = serializer.instance
+    company = data['company'] if 'company' in data else getattr(instance, 'company', None)
+    is_active = data.get('is_active', instance.is_active if instance else True)
+    company_id = company.pk if company else None
+    if adds_active(instance, is_active, company_id):
+        error = limit_error(company_id, resource)
+        if error:
+            raise serializers.ValidationError({'non_field_errors': [error]})
+
+
+class CompanyListSerializer(serializers.ListSerializer):
+    """Lee los planes de todas las empresas de la página con un solo get_many"""
+
+    def to_representation(self, data):
+        companies = list(data.all() if hasattr(data, 'all') else data)
+        self.child.plans = company_plans([company.pk for company in companies])
+        return super().to_representation(companies)
+
+
 class CompanySerializer(serializers.ModelSerializer):
     """Serializer para empresas/clientes (tenants)"""
     subscription_status = serializers.SerializerMethodField()
@@ -30,12 +55,14 @@ class CompanySerializer(serializers.ModelSerializer):
             'is_active', 'subscription_status', 'created_at', 'updated_at'
         ]
         read_only_fields = ['created_at', 'updated_at']
+        list_serializer_class = CompanyListSerializer
     
     def get_subscription_status(self, obj):
-        try:
-            return obj.subscription.is_valid()
-        except:
-            return False
+        # Plan cacheado (entitlements.py): sin consultas a Subscription
+        plans = getattr(self, 'plans', None)
+        if plans is None or obj.pk not in plans:
+            plans = company_plans([obj.pk])
+        return plan_is_valid(plans[obj.pk])
     
     def validate_rut(self, value):
         validar_rut_chileno(value)
@@ -104,6 +131,10 @@ class UserSerializer(serializers.ModelSerializer):
         instance.save()
         return instance
     
+    def validate(self, data):
+        validar_limite_del_plan(self, data, 'users')
+        return data
+    
     def validate_rut(self, value):
         validar_rut_chileno(value)
         return value
@@ -124,6 +155,7 @@ class UserCreateSerializer(serializers.ModelSerializer):
     def validate(self, data):
         if data['password'] != data['password_confirm']:
             raise serializers.ValidationError({'password': 'Las contraseñas no coinciden'})
+        validar_limite_del_plan(self, data, 'users')
         return data
     
     def validate_rut(self, value):
@@ -150,6 +182,10 @@ class BranchSerializer(serializers.ModelSerializer):
             'phone', 'is_active', 'created_at', 'updated_at'
         ]
         read_only_fields = ['created_at', 'updated_at']
+    
+    def validate(self, data):
+        validar_limite_del_plan(self, data, 'branches')
+        return data
 
 
 class SupplierSerializer(serializers.ModelSerializer):
@@ -176,19 +212,35 @@ class ProductSerializer(serializers.ModelSerializer):
     category_display = serializers.CharField(source='get_category_display', read_only=True)
     company_name = serializers.CharField(source='company.name', read_only=True)
     margin = serializers.SerializerMethodField()
+    # Solo presentes en resultados de ?search= (ver search.py)
+    search_rank = serializers.FloatField(read_only=True)
+    name_highlight = serializers.SerializerMethodField()
+    description_highlight = serializers.SerializerMethodField()
     
     class Meta:
         model = Product
         fields = [
             'id', 'company', 'company_name', 'sku', 'name', 'description',
             'category', 'category_display', 'price', 'cost', 'margin',
-            'is_active', 'image_url', 'created_at', 'updated_at'
+            'is_active', 'image_url', 'created_at', 'updated_at',
+            'search_rank', 'name_highlight', 'description_highlight'
         ]
         read_only_fields = ['created_at', 'updated_at']
     
     def get_margin(self, obj):
         return obj.get_margin()
     
+    def get_name_highlight(self, obj):
+        # HTML escapado con las coincidencias en <mark>
+        if hasattr(obj, 'name_highlight'):
+            return str(render_highlight(obj.name_highlight))
+        return None
+    
+    def get_description_highlight(self, obj):
+        if hasattr(obj, 'description_highlight'):
+            return str(render_highlight(obj.description_highlight))
+        return None
+    
     def validate_price(self, value):
         validar_precio_positivo(value)
         return value
@@ -204,18 +256,28 @@ class InventorySerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
     product_sku = serializers.CharField(source='product.sku', read_only=True)
     needs_restock = serializers.SerializerMethodField()
+    # Solo en /api/inventory/low-stock/ (by_restock_urgency)
+    restock_ratio = serializers.FloatField(read_only=True)
     
     class Meta:
         model = Inventory
         fields = [
             'id', 'branch', 'branch_name', 'product', 'product_name', 'product_sku',
-            'stock', 'reorder_point', 'needs_restock', 'last_restock_date',
+            'stock', 'reserved', 'reorder_point', 'needs_restock', 'restock_ratio', 'last_restock_date',
             'created_at', 'updated_at'
         ]
-        read_only_fields = ['created_at', 'updated_at', 'last_restock_date']
+        read_only_fields = ['created_at', 'updated_at', 'last_restock_date', 'reserved']
     
     def get_needs_restock(self, obj):
         return obj.needs_restock()
+    
+    def validate_stock(self, value):
+        # Lo reservado por órdenes pendientes no se puede quitar (ver reservations.py)
+        if self.instance is not None and value < self.instance.reserved:
+            raise serializers.ValidationError(
+                f'Hay {self.instance.reserved} unidades reservadas por órdenes pendientes'
+            )
+        return value
 
 
 class PurchaseItemSerializer(serializers.ModelSerializer):
@@ -262,12 +324,17 @@ class PurchaseSerializer(serializers.ModelSerializer):
 
 class SaleItemSerializer(serializers.ModelSerializer):
     """Serializer para items de venta"""
+    # Id plano: los productos se validan en bloque al crear la venta
+    product = serializers.IntegerField(source='product_id')
     product_name = serializers.CharField(source='product.name', read_only=True)
     subtotal = serializers.SerializerMethodField()
     
     class Meta:
         model = SaleItem
         fields = ['id', 'product', 'product_name', 'quantity', 'unit_price', 'subtotal']
+        extra_kwargs = {
+            'unit_price': {'required': False}  # Por defecto, precio del producto
+        }
     
     def get_subtotal(self, obj):
         return obj.get_subtotal()
@@ -281,21 +348,95 @@ class SaleItemSerializer(serializers.ModelSerializer):
         return value
 
 
+class SalePaymentSerializer(serializers.ModelSerializer):
+    """Pago opcional registrado junto con una venta POS"""
+    
+    class Meta:
+        model = Payment
+        fields = ['amount', 'payment_method', 'status', 'transaction_id', 'reference']
+        extra_kwargs = {
+            'amount': {'required': False},  # Por defecto, total de la venta
+            'payment_method': {'required': False},  # Por defecto, el de la venta
+        }
+
+
 class SaleSerializer(serializers.ModelSerializer):
-    """Serializer para ventas POS"""
+    """
+    Serializer para ventas POS.
+    Acepta items y pago anidados; todo se registra en una sola transacción.
+    """
     branch_name = serializers.CharField(source='branch.name', read_only=True)
     user_name = serializers.CharField(source='user.username', read_only=True)
     payment_method_display = serializers.CharField(source='get_payment_method_display', read_only=True)
-    items = SaleItemSerializer(many=True, read_only=True)
+    items = SaleItemSerializer(many=True, required=False)
+    payment = SalePaymentSerializer(required=False, write_only=True)
     
     class Meta:
         model = Sale
         fields = [
             'id', 'branch', 'branch_name', 'user', 'user_name',
             'payment_method', 'payment_method_display', 'total_amount',
-            'items', 'created_at', 'updated_at'
+            'items', 'payment', 'client_uuid', 'created_at', 'updated_at'
         ]
         read_only_fields = ['created_at', 'updated_at', 'total_amount']
+        extra_kwargs = {
+            # Un client_uuid repetido devuelve la venta existente (idempotencia)
+            'client_uuid': {'validators': []}
+        }
+    
+    def create(self, validated_data):
+        entry = {
+            'branch': validated_data['branch'].pk,
+            'payment_method': validated_data['payment_method'],
+            'items': [
+                {
+                    'product': item['product_id'],
+                    'quantity': item['quantity'],
+                    'unit_price': item.get('unit_price')
+                }
+                for item in validated_data.get('items', [])
+            ],
+        }
+        if 'payment' in validated_data:
+            entry['payment'] = validated_data['payment']
+        if validated_data.get('client_uuid'):
+            entry['client_uuid'] = validated_data['client_uuid']
+        
+        try:
+            # La sucursal ya la leyó el campo `branch`: el servicio no la vuelve a consultar
+            return create_sale(entry, validated_data.get('user'), branch=validated_data['branch'])
+        except SaleRejectedError as e:
+            raise serializers.ValidationError({'items': e.errors})
+    
+    def update(self, instance, validated_data):
+        validated_data.pop('client_uuid', None)
+        if 'items' in validated_data or 'payment' in validated_data:
+            raise serializers.ValidationError(
+                'Los items y el pago de una venta no se pueden modificar'
+            )
+        return super().update(instance, validated_data)
+
+
+class SaleBatchItemSerializer(serializers.Serializer):
+    """Item de una venta dentro de un lote (ids planos, sin consultas)"""
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(validators=[validar_cantidad_positiva])
+    unit_price = serializers.DecimalField(
+        max_digits=10, decimal_places=2, required=False,
+        validators=[validar_precio_positivo]
+    )
+
+
+class SaleBatchEntrySerializer(serializers.Serializer):
+    """
+    Venta dentro de un lote de ingesta POS.
+    Las referencias se validan en bloque en el servicio, no por fila.
+    """
+    branch = serializers.IntegerField()
+    payment_method = serializers.ChoiceField(choices=Sale.PAYMENT_METHOD_CHOICES)
+    items = SaleBatchItemSerializer(many=True, allow_empty=False)
+    payment = SalePaymentSerializer(required=False)
+    client_uuid = serializers.UUIDField(required=False)
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -337,21 +478,19 @@ class OrderSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at', 'total_amount']
 
 
-class CartItemSerializer(serializers.ModelSerializer):
-    """Serializer para items del carrito"""
+class CartLineSerializer(serializers.Serializer):
+    """
+    Línea del carrito (ver cart.py). El carrito no está en la base de datos:
+    cada línea se identifica por su producto (`id` es el id del producto).
+    """
+    id = serializers.IntegerField(read_only=True)
+    product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.filter(is_active=True))
     product_name = serializers.CharField(source='product.name', read_only=True)
     product_price = serializers.DecimalField(source='product.price', max_digits=10, decimal_places=2, read_only=True)
     product_image = serializers.URLField(source='product.image_url', read_only=True)
+    quantity = serializers.IntegerField(default=1)
     subtotal = serializers.SerializerMethodField()
     
-    class Meta:
-        model = CartItem
-        fields = [
-            'id', 'product', 'product_name', 'product_price', 'product_image',
-            'quantity', 'subtotal', 'created_at', 'updated_at'
-        ]
-        read_only_fields = ['created_at', 'updated_at']
-    
     def get_subtotal(self, obj):
         return obj.get_subtotal()
     
@@ -378,13 +517,13 @@ class PaymentSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at']
     
     def get_sale_info(self, obj):
-        if obj.sale:
-            return f"Venta #{obj.sale.id}"
+        if obj.sale_id:
+            return f"Venta #{obj.sale_id}"
         return None
     
     def get_order_info(self, obj):
-        if obj.order:
-            return f"Orden #{obj.order.id}"
+        if obj.order_id:
+            return f"Orden #{obj.order_id}"
         return None
     
     def validate_amount(self, value):
@@ -428,3 +567,38 @@ class InventoryMovementSerializer(serializers.ModelSerializer):
                     f"Stock insuficiente. Disponible: {inventory.stock}, Solicitado: {quantity}"
                 )
         return data
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    """Serializer para reportes en segundo plano"""
+    report_type_display = serializers.CharField(source='get_report_type_display', read_only=True)
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    download_url = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = ReportJob
+        fields = [
+            'id', 'report_type', 'report_type_display', 'export_format', 'params',
+            'status', 'status_display', 'row_count', 'error', 'download_url',
+            'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = [
+            'status', 'row_count', 'error', 'created_at', 'started_at', 'finished_at'
+        ]
+    
+    def get_download_url(self, obj):
+        if obj.status != 'COMPLETADO':
+            return None
+        request = self.context.get('request')
+        url = f'/api/report-jobs/{obj.pk}/download/'
+        return request.build_absolute_uri(url) if request else url
+    
+    def validate_params(self, value):
+        if not isinstance(value, dict):
+            raise serializers.ValidationError('Debe ser un objeto con los filtros del reporte')
+        unknown = set(value) - set(REPORT_PARAMS)
+        if unknown:
+            raise serializers.ValidationError(
+                f"Filtros no soportados: {', '.join(sorted(unknown))}"
+            )
+        return {key: str(val) for key, val in value.items() if val not in (None, '')}
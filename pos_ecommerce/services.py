@@ -0,0 +1,357 @@
+"""
+Servicios de dominio para el sistema POS + E-commerce de TemucoSoft S.A.
+Operaciones de escritura que abarcan varios modelos y deben ser atómicas.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch, prefetch_related_objects
+
+from .models import (
+    Branch, Product, Inventory, InventoryMovement, InventoryMovementDailySummary,
+    Sale, SaleItem, Payment, SalesDailyRollup, Order, OrderItem
+)
+from . import counters
+from .pos_lookup import bump_stock_version
+from .reservations import ReservationError, reserve
+
+
+class StockConflictError(Exception):
+    """El stock cambió durante la transacción y la escritura masiva no aplica"""
+
+
+class CheckoutError(Exception):
+    """El carrito no puede convertirse en orden (p. ej. está vacío)"""
+
+
+class SaleRejectedError(Exception):
+    """La venta no pudo registrarse (referencias inválidas o stock insuficiente)"""
+    
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def create_sales_batch(entries, user):
+    """
+    Registra un lote de ventas POS con inserciones masivas en una sola transacción.
+
+    `entries` es una lista de dicts ya validados con la forma
+    {branch, payment_method, items: [{product, quantity, unit_price?}],
+    payment?, client_uuid?}.
+    Cada venta se acepta o rechaza completa; las rechazadas no afectan al
+    resto del lote. Devuelve un resultado por venta, en el mismo orden.
+
+    Las ventas con un client_uuid ya registrado no se vuelven a escribir: se
+    informan como 'duplicate' con el id de la venta existente, de modo que
+    un terminal puede reenviar su cola sin crear ventas repetidas.
+
+    El costo en consultas es fijo: sucursales, productos, inventarios
+    (bloqueados), un INSERT por tabla, un único UPDATE de stock y un upsert
+    por cada resumen diario (ventas y movimientos).
+    """
+    results, _ = _write_sales(entries, user)
+    return results
+
+
+def create_sale(entry, user, branch=None):
+    """
+    Registra una venta POS con sus items y pago opcional en una sola transacción.
+    Usa el mismo camino que la ingesta masiva; lanza SaleRejectedError si la
+    venta no puede registrarse.
+
+    `branch` es la sucursal ya leída por quien llama (no se vuelve a
+    consultar). La venta se devuelve con su sucursal, usuario e items con
+    producto ya cargados, sin releerla; solo una venta repetida
+    (client_uuid) se lee de la base.
+    """
+    results, sales = _write_sales([entry], user, branches=[branch] if branch is not None else None)
+    if results[0]['status'] == 'duplicate':
+        return Sale.objects.select_related('branch', 'user').prefetch_related(
+            'items__product'
+        ).get(pk=results[0]['sale_id'])
+    if results[0]['status'] != 'created':
+        raise SaleRejectedError(results[0]['errors'])
+    return sales[0]
+
+
+def _write_sales(entries, user, branches=None):
+    """
+    Implementación común de create_sales_batch y create_sale.
+
+    Dos envíos simultáneos de la misma cola offline pueden pasar ambos la
+    verificación de client_uuid; el segundo choca con la restricción única
+    al insertar. En ese caso su transacción se revierte completa y el lote
+    se procesa de nuevo: las ventas ya registradas por el otro envío se
+    informan como 'duplicate'.
+    """
+    client_uuids = {entry['client_uuid'] for entry in entries if entry.get('client_uuid')}
+    try:
+        return _write_sales_once(entries, user, branches)
+    except IntegrityError:
+        if not client_uuids or not _existing_sales(client_uuids):
+            raise
+    return _write_sales_once(entries, user, branches)
+
+
+def _existing_sales(client_uuids):
+    """{client_uuid: id de la venta} de los client_uuid ya registrados"""
+    if not client_uuids:
+        return {}
+    return dict(Sale.objects.filter(client_uuid__in=client_uuids).values_list('client_uuid', 'id'))
+
+
+def _write_sales_once(entries, user, branches=None):
+    """`branches`: sucursales (Branch) ya leídas por quien llama; sin ellas se consultan"""
+    results = [None] * len(entries)
+
+    branch_ids = {entry['branch'] for entry in entries}
+    product_ids = {item['product'] for entry in entries for item in entry['items']}
+
+    if branches is None:
+        branches = Branch.objects.filter(pk__in=branch_ids, is_active=True)
+        if user.role != 'SUPER_ADMIN':
+            branches = branches.filter(company_id=user.company_id)
+        branches = branches.order_by().only('id', 'company_id', 'name', 'is_active')
+    branches = {
+        branch.pk: branch for branch in branches
+        if branch.pk in branch_ids and branch.is_active and (
+            user.role == 'SUPER_ADMIN' or branch.company_id == user.company_id
+        )
+    }
+    branch_company = {branch_id: branch.company_id for branch_id, branch in branches.items()}
+
+    # Instancias con solo lo necesario: las ventas se devuelven con el
+    # nombre de sus productos sin releerlas
+    products = {
+        product.pk: product
+        for product in Product.objects.filter(pk__in=product_ids, is_active=True).order_by().only(
+            'id', 'company_id', 'price', 'name'
+        )
+    }
+
+    client_uuids = {entry['client_uuid'] for entry in entries if entry.get('client_uuid')}
+    known_uuids = _existing_sales(client_uuids)
+    first_index = {}  # client_uuid -> índice de su primera aparición en el lote
+
+    with transaction.atomic():
+        inventories = {
+            (inv['branch_id'], inv['product_id']): inv
+            for inv in Inventory.objects.select_for_update().filter(
+                branch_id__in=branch_company, product_id__in=products
+            ).order_by('pk').values('id', 'branch_id', 'product_id', 'stock', 'reserved', 'reorder_point')
+        }
+        available = {inv['id']: inv['stock'] for inv in inventories.values()}
+        # Unidades reservadas por órdenes e-commerce pendientes: no se venden en caja
+        reserved = {inv['id']: inv['reserved'] for inv in inventories.values()}
+
+        pending = []  # (indice, venta, items, movimientos)
+        for index, entry in enumerate(entries):
+            client_uuid = entry.get('client_uuid')
+            if client_uuid in known_uuids:
+                results[index] = {'index': index, 'status': 'duplicate',
+                                  'sale_id': known_uuids[client_uuid]}
+                continue
+            if client_uuid in first_index:
+                # Repetida dentro del mismo lote: se resuelve tras insertar
+                results[index] = {'index': index, 'status': 'duplicate', 'sale_id': None}
+                continue
+            if client_uuid:
+                first_index[client_uuid] = index
+
+            errors = []
+            company_id = branch_company.get(entry['branch'])
+            if company_id is None:
+                results[index] = {'index': index, 'status': 'rejected',
+                                  'errors': ['Sucursal no encontrada']}
+                continue
+
+            lines = []
+            required = defaultdict(int)
+            for item in entry['items']:
+                product = products.get(item['product'])
+                if product is None or product.company_id != company_id:
+                    errors.append(f"Producto {item['product']} no encontrado")
+                    continue
+                inventory = inventories.get((entry['branch'], item['product']))
+                if inventory is None:
+                    errors.append(f"Producto {item['product']} sin inventario en la sucursal")
+                    continue
+                required[inventory['id']] += item['quantity']
+                unit_price = item.get('unit_price')
+                if unit_price is None:
+                    unit_price = product.price
+                lines.append((item, product, inventory['id'], unit_price))
+
+            for inventory_id, quantity in required.items():
+                free = max(0, available[inventory_id] - reserved[inventory_id])
+                if free < quantity:
+                    errors.append(
+                        f"Stock insuficiente. Disponible: {free}, "
+                        f"Solicitado: {quantity}"
+                    )
+
+            if errors:
+                results[index] = {'index': index, 'status': 'rejected', 'errors': errors}
+                continue
+
+            sale = Sale(
+                branch=branches[entry['branch']],
+                user=user,
+                payment_method=entry['payment_method'],
+                client_uuid=client_uuid,
+                total_amount=sum(
+                    (item['quantity'] * unit_price for item, _, _, unit_price in lines),
+                    Decimal('0')
+                )
+            )
+            sale_items = []
+            movements = []
+            for item, product, inventory_id, unit_price in lines:
+                sale_items.append(SaleItem(
+                    product=product,
+                    quantity=item['quantity'],
+                    unit_price=unit_price
+                ))
+                previous_stock = available[inventory_id]
+                available[inventory_id] = previous_stock - item['quantity']
+                movements.append(InventoryMovement(
+                    inventory_id=inventory_id,
+                    movement_type='VENTA',
+                    quantity=item['quantity'],
+                    previous_stock=previous_stock,
+                    new_stock=available[inventory_id],
+                    user=user
+                ))
+            pending.append((index, sale, sale_items, movements))
+
+        if not pending:
+            _resolve_batch_duplicates(entries, results, first_index)
+            return results, []
+
+        sales = Sale.objects.bulk_create([sale for _, sale, _, _ in pending])
+
+        all_items = []
+        all_movements = []
+        payments = []
+        for (index, _, sale_items, movements), sale in zip(pending, sales):
+            payment = entries[index].get('payment')
+            if payment is not None:
+                payments.append(Payment(
+                    sale=sale,
+                    amount=payment.get('amount') or sale.total_amount,
+                    payment_method=payment.get('payment_method') or sale.payment_method,
+                    status=payment.get('status', 'PENDIENTE'),
+                    transaction_id=payment.get('transaction_id', ''),
+                    reference=payment.get('reference', '')
+                ))
+            for sale_item in sale_items:
+                sale_item.sale = sale
+            # sale.items.all() responde con los items escritos, sin consultar
+            sale._prefetched_objects_cache = {'items': sale_items}
+            for movement in movements:
+                movement.sale = sale
+                movement.notes = f'Venta #{sale.pk}'
+            all_items.extend(sale_items)
+            all_movements.extend(movements)
+            results[index] = {
+                'index': index,
+                'status': 'created',
+                'sale_id': sale.pk,
+                'total_amount': sale.total_amount
+            }
+
+        _resolve_batch_duplicates(entries, results, first_index)
+
+        SaleItem.objects.bulk_create(all_items)
+        InventoryMovement.objects.bulk_create(all_movements)
+        if payments:
+            Payment.objects.bulk_create(payments)
+        # bulk_create no pasa por save(): los resúmenes diarios se suman aquí
+        SalesDailyRollup.apply_sales(sales)
+        InventoryMovementDailySummary.apply_movements(all_movements)
+
+        # bulk_create no pasa por InventoryMovement.save: el stock se descuenta
+        # aquí con un único UPDATE condicionado por inventario
+        deltas = defaultdict(int)
+        for movement in all_movements:
+            deltas[movement.inventory_id] -= movement.quantity
+        if not Inventory.apply_stock_deltas(deltas):
+            raise StockConflictError('El stock cambió durante el registro de ventas')
+        # apply_stock_deltas y bulk_create no emiten señales: el índice del
+        # POS y los contadores del panel se actualizan aquí
+        bump_stock_version(*(sale.branch_id for sale in sales))
+        counters.record_sales(user.pk, [sale.created_at for sale in sales])
+        low_stock_changes = defaultdict(list)
+        for inventory in inventories.values():
+            if inventory['id'] in deltas:
+                low_stock_changes[branch_company[inventory['branch_id']]].append(
+                    (inventory['stock'], available[inventory['id']], inventory['reorder_point'])
+                )
+        for company_id, changes in low_stock_changes.items():
+            counters.record_low_stock_changes(company_id, changes)
+
+    return results, sales
+
+
+def _resolve_batch_duplicates(entries, results, first_index):
+    """Copia a las ventas repetidas dentro del lote el resultado de la original"""
+    for index, entry in enumerate(entries):
+        result = results[index]
+        if result['status'] == 'duplicate' and result['sale_id'] is None:
+            original = results[first_index[entry['client_uuid']]]
+            if original['status'] == 'created':
+                result['sale_id'] = original['sale_id']
+            else:
+                results[index] = dict(original, index=index)
+
+
+def create_order_from_cart(cart, customer, user=None, company=None, shipping_cost=0, notes=''):
+    """
+    Convierte el carrito (ver cart.py) en una orden e-commerce PENDIENTE.
+
+    `customer` trae customer_name, customer_email, customer_phone y
+    customer_address. Sin `company`, la orden queda en la empresa del primer
+    producto. El total se calcula en una pasada sobre las líneas del carrito
+    y la orden se escribe completa en una sola transacción, junto con la
+    reserva de su stock (ver reservations.py); el carrito se vacía solo si
+    la orden se creó. Lanza CheckoutError si está vacío o si no hay stock.
+
+    El costo en consultas es fijo: productos del carrito (con su empresa),
+    INSERT de la orden, un INSERT de todos sus items, la reserva (lectura de
+    inventarios, un UPDATE y un INSERT) y la lectura de los items con sus
+    productos para la respuesta.
+    """
+    lines = cart.items()
+    if not lines:
+        raise CheckoutError('El carrito está vacío')
+
+    shipping_cost = Decimal(str(shipping_cost or 0))
+    order = Order(
+        company=company or lines[0].product.company,
+        user=user if user is not None and user.is_authenticated else None,
+        status='PENDIENTE',
+        shipping_cost=shipping_cost,
+        total_amount=sum((line.get_subtotal() for line in lines), Decimal('0')) + shipping_cost,
+        notes=notes,
+        **customer
+    )
+    with transaction.atomic():
+        order.save()
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=line.product, quantity=line.quantity, unit_price=line.product.price)
+            for line in lines
+        ])
+        try:
+            reserve(
+                order,
+                {line.product_id: line.quantity for line in lines},
+                {line.product_id: line.product for line in lines}
+            )
+        except ReservationError as e:
+            raise CheckoutError(str(e))
+    cart.clear()
+
+    prefetch_related_objects([order], Prefetch('items', queryset=OrderItem.objects.select_related('product')))
+    return order
@@ -0,0 +1,240 @@
+"""
+Señales del sistema POS + E-commerce de TemucoSoft S.A.
+Mantienen sincronizadas las tablas derivadas (resúmenes, contadores).
+"""
+from django.db import transaction
+from django.db.models import QuerySet
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .authentication import forget_users
+from .cart import merge_session_cart
+from .catalog import bump_catalog_version
+from . import counters, entitlements, reservations
+from .models import (
+    Company, Subscription, Branch, Product, Inventory, Order, Sale, SalesDailyRollup, InventoryMovement,
+    InventoryMovementDailySummary, User
+)
+from .pos_lookup import bump_company_version, bump_stock_version
+
+
+def _deleted_directly(model, origin):
+    """True si el borrado partió del propio modelo y no de un CASCADE"""
+    if isinstance(origin, QuerySet):
+        return origin.model is model
+    return isinstance(origin, model)
+
+
+@receiver(post_delete, sender=Sale)
+def descontar_venta_del_resumen(sender, instance, origin=None, **kwargs):
+    """
+    Al eliminar una venta, se resta su aporte del resumen diario.
+    Si la venta cae por CASCADE (sucursal o empresa eliminada), las filas
+    del resumen se eliminan por la misma cascada.
+    """
+    if _deleted_directly(Sale, origin):
+        SalesDailyRollup.apply_sales([instance], sign=-1)
+
+
+@receiver(post_delete, sender=InventoryMovement)
+def descontar_movimiento_del_resumen(sender, instance, origin=None, **kwargs):
+    """Al eliminar un movimiento, se resta su aporte del resumen diario"""
+    if _deleted_directly(InventoryMovement, origin):
+        InventoryMovementDailySummary.apply_movements([instance], sign=-1)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+def invalidar_catalogo(sender, **kwargs):
+    """
+    Cualquier cambio en productos o empresas invalida el catálogo cacheado.
+    Se espera al commit para que ninguna petición vuelva a cachear datos
+    anteriores al cambio. Los QuerySet.update() no emiten señales: quien
+    los use debe llamar a bump_catalog_version().
+    """
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Branch)
+@receiver(post_delete, sender=Branch)
+def invalidar_indice_pos(sender, instance, **kwargs):
+    """Productos o sucursales modificados: el índice SKU del POS se recarga"""
+    bump_company_version(instance.company_id)
+
+
+@receiver(post_save, sender=Inventory)
+@receiver(post_delete, sender=Inventory)
+def invalidar_stock_pos(sender, instance, **kwargs):
+    bump_stock_version(instance.branch_id)
+
+
+@receiver(post_save, sender=InventoryMovement)
+def invalidar_stock_pos_por_movimiento(sender, instance, created, **kwargs):
+    """Cada movimiento nuevo cambia el stock de su sucursal"""
+    if created:
+        bump_stock_version(instance.inventory.branch_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidar_usuario_cacheado(sender, instance, **kwargs):
+    """El usuario autenticado por JWT se vuelve a leer tras cualquier cambio"""
+    forget_users(instance.pk)
+
+
+@receiver(post_save, sender=Company)
+def invalidar_usuarios_de_empresa(sender, instance, created, **kwargs):
+    """Los usuarios cacheados llevan su empresa: se descartan si esta cambia"""
+    if not created:
+        forget_users(*instance.users.values_list('id', flat=True))
+
+
+@receiver(user_logged_in)
+def traspasar_carrito_anonimo(sender, request, user, **kwargs):
+    """Lo que el visitante agregó antes de iniciar sesión pasa a su carrito (cart.py)"""
+    merge_session_cart(request, user)
+
+
+@receiver(pre_delete, sender=Order)
+def liberar_reservas_de_orden(sender, instance, **kwargs):
+    """Antes de que el borrado en cascada elimine sus reservas, devolver lo reservado"""
+    reservations.release(instance)
+
+
+# ============================================================================
+# Contadores del panel (ver counters.py)
+# ============================================================================
+
+@receiver(post_save, sender=Company)
+def contar_empresa(sender, created, **kwargs):
+    if created:
+        counters.adjust(counters.platform_key('companies_count'), 1)
+
+
+@receiver(post_delete, sender=Company)
+def descontar_empresa(sender, **kwargs):
+    counters.adjust(counters.platform_key('companies_count'), -1)
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def recalcular_suscripciones_activas(sender, **kwargs):
+    # Sin el valor anterior de `active` no se puede ajustar: se recalcula
+    counters.forget(counters.platform_key('active_subscriptions'))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Branch)
+def contar_producto_o_sucursal(sender, instance, created, **kwargs):
+    if created:
+        name = 'products_count' if sender is Product else 'branches_count'
+        counters.adjust(counters.company_key(instance.company_id, name), 1)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Branch)
+def descontar_producto_o_sucursal(sender, instance, **kwargs):
+    name = 'products_count' if sender is Product else 'branches_count'
+    counters.adjust(counters.company_key(instance.company_id, name), -1)
+
+
+@receiver(post_save, sender=Inventory)
+def contar_stock_bajo_inventario(sender, instance, created, **kwargs):
+    key = counters.company_key(counters.branch_company_id(instance.branch_id), 'low_stock')
+    if created:
+        counters.adjust(key, int(instance.stock <= instance.reorder_point))
+    else:
+        # Edición directa de stock o punto de reorden: se desconoce el estado anterior
+        counters.forget(key)
+
+
+@receiver(post_delete, sender=Inventory)
+def descontar_stock_bajo_inventario(sender, instance, **kwargs):
+    if instance.stock <= instance.reorder_point:
+        counters.adjust(
+            counters.company_key(counters.branch_company_id(instance.branch_id), 'low_stock'), -1
+        )
+
+
+@receiver(post_save, sender=InventoryMovement)
+def contar_stock_bajo_movimiento(sender, instance, created, **kwargs):
+    if created:
+        inventory = instance.inventory
+        counters.record_low_stock_changes(
+            counters.branch_company_id(inventory.branch_id),
+            [(instance.previous_stock, instance.new_stock, inventory.reorder_point)]
+        )
+
+
+@receiver(post_save, sender=Sale)
+def contar_venta(sender, instance, created, **kwargs):
+    if created:
+        counters.record_sales(instance.user_id, [instance.created_at])
+
+
+@receiver(post_delete, sender=Sale)
+def descontar_venta(sender, instance, **kwargs):
+    if instance.user_id:
+        counters.adjust(
+            counters.seller_sales_key(instance.user_id, timezone.localdate(instance.created_at)), -1
+        )
+
+
+# ============================================================================
+# Plan de suscripción y uso (ver entitlements.py)
+# ============================================================================
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidar_plan(sender, instance, **kwargs):
+    entitlements.forget_plan(instance.company_id)
+
+
+def _usage_resource(sender):
+    return 'branches' if sender is Branch else 'users'
+
+
+def _may_change_usage(instance, update_fields):
+    # El login solo guarda last_login y no fuerza el recuento
+    return not instance._state.adding and (
+        update_fields is None or {'is_active', 'company'} & set(update_fields)
+    )
+
+
+@receiver(pre_save, sender=Branch)
+@receiver(pre_save, sender=User)
+def recordar_empresa_anterior(sender, instance, update_fields=None, **kwargs):
+    """Guarda la empresa actual en la base, por si el cambio la traslada a otra"""
+    if _may_change_usage(instance, update_fields):
+        instance._previous_company_id = (
+            sender.objects.filter(pk=instance.pk).values_list('company_id', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Branch)
+@receiver(post_save, sender=User)
+def contar_uso_del_plan(sender, instance, created, update_fields=None, **kwargs):
+    resource = _usage_resource(sender)
+    if created:
+        if instance.is_active:
+            entitlements.record_usage_change(instance.company_id, resource, 1)
+    elif update_fields is None or {'is_active', 'company'} & set(update_fields):
+        # Sin el estado anterior no se puede ajustar: se recuentan la
+        # empresa actual y, si cambió, la anterior
+        previous_company_id = instance.__dict__.pop('_previous_company_id', None)
+        entitlements.forget_usage(instance.company_id, resource)
+        if previous_company_id != instance.company_id:
+            entitlements.forget_usage(previous_company_id, resource)
+
+
+@receiver(post_delete, sender=Branch)
+@receiver(post_delete, sender=User)
+def descontar_uso_del_plan(sender, instance, **kwargs):
+    if instance.is_active:
+        entitlements.record_usage_change(instance.company_id, _usage_resource(sender), -1)
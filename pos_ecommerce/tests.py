@@ -1,3 +1,1653 @@
-from django.test import TestCase
+"""
+Tests del sistema POS + E-commerce de TemucoSoft S.A.
+"""
+import csv
+import importlib
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from unittest import mock
+from datetime import timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import F
+from django.utils import timezone
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .models import (
+    Company, Subscription, User, Branch, Supplier, Product, Inventory, InventoryMovement,
+    Purchase, PurchaseItem, Sale, SaleItem, Order, OrderItem, StockReservation, CartItem, Payment,
+    SalesDailyRollup, InventoryMovementDailySummary, ReportJob
+)
+from .authentication import flush_last_logins
+from .cart import Cart
+from .catalog import CATALOG_PAGE_SIZE
+from .entitlements import company_plans, has_feature, limit_error
+from .mixins import NON_ATOMIC_ADD_CACHES, check_idempotency_cache
+from .serializers import SaleSerializer
+from .pos_lookup import clear_indexes, lookup_sku
+from .query_plans import check_endpoints, regressions
+from .reports import REPORT_JOB_ERROR
+from .search import search_products
+from . import authentication, models, reservations, services
+from .services import create_sales_batch
+from .views import SaleViewSet
+
+
+def crear_inventario(stock=0):
+    """Crea una empresa, sucursal y producto mínimos con su inventario"""
+    company = Company.objects.create(
+        name='Empresa Test', rut='76.086.428-5', address='Calle 1',
+        phone='123', email='empresa@test.cl'
+    )
+    branch = Branch.objects.create(company=company, name='Central', address='Calle 1', phone='123')
+    product = Product.objects.create(
+        company=company, sku='SKU-001', name='Producto', price=Decimal('1000'), cost=Decimal('500')
+    )
+    return Inventory.objects.create(branch=branch, product=product, stock=stock)
+
+
+class InventoryMovementLedgerTest(TestCase):
+    """Actualización de stock a través del libro de movimientos"""
+
+    def test_movimiento_toma_stock_de_la_base_de_datos(self):
+        inventory = crear_inventario(stock=10)
+        # Instancia desactualizada: otro proceso vendió 4 unidades
+        Inventory.objects.filter(pk=inventory.pk).update(stock=6)
+
+        movement = InventoryMovement.objects.create(
+            inventory=inventory, movement_type='VENTA', quantity=2
+        )
+
+        self.assertEqual(movement.previous_stock, 6)
+        self.assertEqual(movement.new_stock, 4)
+        inventory.refresh_from_db()
+        self.assertEqual(inventory.stock, 4)
+
+    def test_salida_sin_stock_suficiente_se_rechaza(self):
+        inventory = crear_inventario(stock=3)
+
+        with self.assertRaises(ValidationError):
+            InventoryMovement.objects.create(
+                inventory=inventory, movement_type='AJUSTE_NEGATIVO', quantity=5
+            )
+
+        inventory.refresh_from_db()
+        self.assertEqual(inventory.stock, 3)
+        self.assertFalse(InventoryMovement.objects.exists())
+
+    def test_add_y_remove_stock(self):
+        inventory = crear_inventario(stock=5)
+
+        inventory.add_stock(5)
+        self.assertEqual(inventory.stock, 10)
+        self.assertTrue(inventory.remove_stock(10))
+        self.assertFalse(inventory.remove_stock(1))
+
+        inventory.refresh_from_db()
+        self.assertEqual(inventory.stock, 0)
+        self.assertIsNotNone(inventory.last_restock_date)
+
+    def test_update_returning_segun_la_version_de_sqlite(self):
+        for version, expected in (((3, 34, 1), False), ((3, 35, 0), True)):
+            with mock.patch.object(connection.Database, 'sqlite_version_info', version):
+                self.assertIs(models.supports_update_returning(), expected)
+
+    def test_apply_stock_delta_sin_returning(self):
+        inventory = crear_inventario(stock=5)
+
+        with mock.patch.object(models, 'supports_update_returning', return_value=False):
+            self.assertEqual(Inventory.apply_stock_delta(inventory.pk, -2), 3)
+            self.assertIsNone(Inventory.apply_stock_delta(inventory.pk, -4))
+
+
+class InventoryMovementConcurrencyTest(TransactionTestCase):
+    """Ventas concurrentes del mismo SKU desde varios terminales"""
+
+    THREADS = 8
+    SALES_PER_THREAD = 10
+
+    def test_ventas_concurrentes_no_pierden_actualizaciones(self):
+        initial_stock = self.THREADS * self.SALES_PER_THREAD - 5
+        inventory = crear_inventario(stock=initial_stock)
+        errors = []
+        rejected = []
+        barrier = threading.Barrier(self.THREADS)
+
+        def vender():
+            try:
+                barrier.wait()
+                for _ in range(self.SALES_PER_THREAD):
+                    try:
+                        InventoryMovement.objects.create(
+                            inventory_id=inventory.pk, movement_type='VENTA', quantity=1
+                        )
+                    except ValidationError:
+                        rejected.append(1)
+            except Exception as e:  # pragma: no cover - se reporta abajo
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=vender) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        inventory.refresh_from_db()
+        sold = InventoryMovement.objects.filter(inventory=inventory).count()
+
+        # Cada unidad vendida quedó registrada y el stock nunca fue negativo
+        self.assertEqual(inventory.stock, 0)
+        self.assertEqual(sold, initial_stock)
+        self.assertEqual(len(rejected), 5)
+
+        # Los valores del libro forman una cadena sin huecos ni duplicados
+        new_stocks = sorted(
+            InventoryMovement.objects.filter(inventory=inventory).values_list('new_stock', flat=True)
+        )
+        self.assertEqual(new_stocks, list(range(initial_stock)))
+
+
+class SaleBatchTest(TestCase):
+    """Ingesta masiva de ventas POS"""
+
+    def setUp(self):
+        self.inventory = crear_inventario(stock=10)
+        self.user = User.objects.create_user(
+            username='vendedor', password='clave-segura', rut='11.111.111-1',
+            role='VENDEDOR', company=self.inventory.branch.company
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def venta(self, quantity):
+        return {
+            'branch': self.inventory.branch_id,
+            'payment_method': 'EFECTIVO',
+            'items': [{'product': self.inventory.product_id, 'quantity': quantity}]
+        }
+
+    def test_lote_con_resultados_por_venta(self):
+        payload = {'sales': [self.venta(3), self.venta(20), {'branch': 1}, self.venta(7)]}
+
+        response = self.client.post('/api/sales/batch/', payload, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        statuses = [result['status'] for result in response.data['results']]
+        self.assertEqual(statuses, ['created', 'rejected', 'rejected', 'created'])
+        self.assertEqual(Sale.objects.count(), 2)
+        self.assertEqual(SaleItem.objects.count(), 2)
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.stock, 0)
+        self.assertEqual(
+            list(InventoryMovement.objects.order_by('pk').values_list('previous_stock', 'new_stock')),
+            [(10, 7), (7, 0)]
+        )
+
+    def test_lote_con_consultas_constantes(self):
+        payload = {'sales': [self.venta(1) for _ in range(10)]}
+
+        # sesión/usuario no aplican (force_authenticate): sucursales, productos,
+        # SAVEPOINT, inventarios, 3 INSERT, 2 upserts de resúmenes, UPDATE de stock, RELEASE
+        with self.assertNumQueries(11):
+            response = self.client.post('/api/sales/batch/', payload, format='json')
+
+        self.assertEqual(response.data['created'], 10)
+
+    def test_reenvio_con_client_uuid_no_duplica(self):
+        sale = dict(self.venta(2), client_uuid='8f14e45f-ceea-467f-a0e6-2c0b5a3b1f7e')
+
+        first = self.client.post('/api/sales/batch/', {'sales': [sale, sale]}, format='json')
+        retry = self.client.post('/api/sales/batch/', {'sales': [sale]}, format='json')
+
+        self.assertEqual(first.status_code, 201)
+        sale_id = first.data['results'][0]['sale_id']
+        self.assertEqual(first.data['results'][1], {'index': 1, 'status': 'duplicate', 'sale_id': sale_id})
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.data['results'][0]['sale_id'], sale_id)
+        self.assertEqual(Sale.objects.count(), 1)
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.stock, 8)
+
+
+class SaleSyncRaceTest(TransactionTestCase):
+    """Dos envíos simultáneos de la misma cola offline (reintento con red inestable)"""
+
+    def test_client_uuid_registrado_entre_la_verificacion_y_el_insert(self):
+        inventory = crear_inventario(stock=10)
+        user = User.objects.create_user(
+            username='vendedor', password='clave-segura', rut='11.111.111-1',
+            role='VENDEDOR', company=inventory.branch.company
+        )
+        venta = {
+            'branch': inventory.branch_id, 'payment_method': 'EFECTIVO',
+            'items': [{'product': inventory.product_id, 'quantity': 2}],
+            'client_uuid': '8f14e45f-ceea-467f-a0e6-2c0b5a3b1f7e',
+        }
+        # El otro envío ya confirmó la venta...
+        original = create_sales_batch([venta], user)[0]['sale_id']
+
+        # ...pero este la buscó antes de que se confirmara
+        real = services._existing_sales
+        lecturas = iter([{}])
+        client = APIClient()
+        client.force_authenticate(user)
+        with mock.patch.object(
+            services, '_existing_sales', side_effect=lambda uuids: next(lecturas, None) or real(uuids)
+        ):
+            nueva = {
+                'branch': inventory.branch_id, 'payment_method': 'EFECTIVO',
+                'items': [{'product': inventory.product_id, 'quantity': 1}],
+            }
+            response = client.post('/api/sales/batch/', {'sales': [venta, nueva]}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['results'][0], {'index': 0, 'status': 'duplicate', 'sale_id': original})
+        self.assertEqual(response.data['results'][1]['status'], 'created')
+        self.assertEqual(Sale.objects.count(), 2)
+        inventory.refresh_from_db()
+        self.assertEqual(inventory.stock, 7)
+
+
+class SaleNestedCreateTest(TestCase):
+    """Creación de ventas con items y pago anidados"""
+
+    def setUp(self):
+        self.inventory = crear_inventario(stock=50)
+        self.user = User.objects.create_user(
+            username='vendedor', password='clave-segura', rut='11.111.111-1',
+            role='VENDEDOR', company=self.inventory.branch.company
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def crear_venta(self, lines):
+        return self.client.post('/api/sales/', {
+            'branch': self.inventory.branch_id,
+            'payment_method': 'TARJETA_DEBITO',
+            'items': [
+                {'product': self.inventory.product_id, 'quantity': 1, 'unit_price': '990.00'}
+                for _ in range(lines)
+            ],
+            'payment': {'status': 'COMPLETADO', 'reference': 'caja-1'}
+        }, format='json')
+
+    def test_venta_con_items_y_pago(self):
+        response = self.crear_venta(3)
+
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['total_amount'], '2970.00')
+        self.assertEqual(len(response.data['items']), 3)
+        # La respuesta se arma con lo recién escrito, sin releer la venta
+        self.assertEqual(response.data['branch_name'], self.inventory.branch.name)
+        self.assertEqual(response.data['items'][0]['product_name'], self.inventory.product.name)
+        sale = Sale.objects.get()
+        payment = sale.payments.get()
+        self.assertEqual(payment.amount, Decimal('2970.00'))
+        self.assertEqual(payment.payment_method, 'TARJETA_DEBITO')
+        self.inventory.refresh_from_db()
+        self.assertEqual(self.inventory.stock, 47)
+
+    def test_consultas_no_dependen_de_la_cantidad_de_items(self):
+        with self.assertNumQueries(12) as few:
+            self.crear_venta(1)
+        with self.assertNumQueries(len(few.captured_queries)):
+            self.crear_venta(10)
+
+    def test_venta_sin_stock_no_escribe_nada(self):
+        self.inventory.remove_stock(50)
+
+        response = self.crear_venta(1)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Sale.objects.exists())
+
+
+class IdempotencyKeyTest(TestCase):
+    """Reintentos con cabecera Idempotency-Key"""
+
+    def setUp(self):
+        cache.clear()
+        self.inventory = crear_inventario(stock=10)
+        self.user = User.objects.create_user(
+            username='vendedor', password='clave-segura', rut='11.111.111-1',
+            role='VENDEDOR', company=self.inventory.branch.company
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.payload = {
+            'branch': self.inventory.branch_id,
+            'payment_method': 'EFECTIVO',
+            'items': [{'product': self.inventory.product_id, 'quantity': 2}]
+        }
+
+    def test_reintento_reproduce_la_respuesta(self):
+        first = self.client.post('/api/sales/', self.payload, format='json', HTTP_IDEMPOTENCY_KEY='k-1')
+        with self.assertNumQueries(0):
+            retry = self.client.post('/api/sales/', self.payload, format='json', HTTP_IDEMPOTENCY_KEY='k-1')
+
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data['id'], first.data['id'])
+        self.assertEqual(Sale.objects.count(), 1)
+
+    def test_misma_clave_con_otro_payload(self):
+        self.client.post('/api/sales/', self.payload, format='json', HTTP_IDEMPOTENCY_KEY='k-2')
+        self.payload['payment_method'] = 'TRANSFERENCIA'
+
+        response = self.client.post('/api/sales/', self.payload, format='json', HTTP_IDEMPOTENCY_KEY='k-2')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Sale.objects.count(), 1)
+
+    def test_cache_sin_add_atomico_no_pasa_el_chequeo(self):
+        self.assertEqual(check_idempotency_cache(None), [])
+        en_disco = {'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': '/tmp/cache'
+        }}
+        with override_settings(CACHES=en_disco):
+            errores = check_idempotency_cache(None)
+        self.assertEqual([error.id for error in errores], ['pos_ecommerce.E001'])
+
+
+class SalesDailyRollupTest(TestCase):
+    """Resumen diario de ventas mantenido de forma incremental"""
+
+    def setUp(self):
+        self.inventory = crear_inventario(stock=100)
+        self.branch = self.inventory.branch
+        self.user = User.objects.create_user(
+            username='vendedor', password='clave-segura', rut='11.111.111-1',
+            role='VENDEDOR', company=self.branch.company
+        )
+
+    def resumen(self):
+        return list(SalesDailyRollup.objects.values_list('payment_method', 'sales_count', 'total_amount'))
+
+    def test_resumen_sigue_a_las_ventas(self):
+        create_sales_batch([
+            {'branch': self.branch.pk, 'payment_method': 'EFECTIVO',
+             'items': [{'product': self.inventory.product_id, 'quantity': 2}]},
+            {'branch': self.branch.pk, 'payment_method': 'EFECTIVO',
+             'items': [{'product': self.inventory.product_id, 'quantity': 1}]},
+        ], self.user)
+        self.assertEqual(self.resumen(), [('EFECTIVO', 2, Decimal('3000'))])
+
+        sale = Sale.objects.order_by('pk').first()
+        sale.payment_method = 'TRANSFERENCIA'
+        sale.save()
+        self.assertEqual(sorted(self.resumen()), [
+            ('EFECTIVO', 1, Decimal('1000')), ('TRANSFERENCIA', 1, Decimal('2000'))
+        ])
+
+        sale.delete()
+        self.assertEqual(sorted(self.resumen()), [
+            ('EFECTIVO', 1, Decimal('1000')), ('TRANSFERENCIA', 0, Decimal('0'))
+        ])
+
+        SalesDailyRollup.rebuild()
+        self.assertEqual(self.resumen(), [('EFECTIVO', 1, Decimal('1000'))])
+
+    def test_eliminar_sucursal_elimina_su_resumen(self):
+        Sale.objects.create(branch=self.branch, user=self.user, payment_method='EFECTIVO', total_amount=500)
+
+        self.branch.delete()
+
+        self.assertFalse(SalesDailyRollup.objects.exists())
+
+
+class InventoryMovementDailySummaryTest(TestCase):
+    """Resumen diario de movimientos mantenido de forma incremental"""
+
+    def setUp(self):
+        self.inventory = crear_inventario(stock=100)
+        self.user = User.objects.create_user(
+            username='bodega', password='clave-segura', rut='11.111.111-1',
+            role='ADMIN_CLIENTE', company=self.inventory.branch.company
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def resumen(self):
+        return sorted(InventoryMovementDailySummary.objects.filter(movement_count__gt=0).values_list(
+            'movement_type', 'movement_count', 'total_quantity'
+        ))
+
+    def test_resumen_sigue_a_los_movimientos(self):
+        InventoryMovement.objects.create(inventory=self.inventory, movement_type='COMPRA', quantity=10)
+        create_sales_batch([
+            {'branch': self.inventory.branch_id, 'payment_method': 'EFECTIVO',
+             'items': [{'product': self.inventory.product_id, 'quantity': 3}]},
+        ], self.user)
+        ajuste = InventoryMovement.objects.create(
+            inventory=self.inventory, movement_type='AJUSTE_NEGATIVO', quantity=2
+        )
+        self.assertEqual(self.resumen(), [('AJUSTE_NEGATIVO', 1, 2), ('COMPRA', 1, 10), ('VENTA', 1, 3)])
+
+        ajuste.delete()
+        self.assertEqual(self.resumen(), [('COMPRA', 1, 10), ('VENTA', 1, 3)])
+
+        response = self.client.get('/api/inventory-movements/summary/')
+        self.assertEqual(response.data['total_movements'], 2)
+        self.assertEqual(
+            [(row['movement_type'], row['count'], row['total_quantity']) for row in response.data['summary']],
+            [('COMPRA', 1, 10), ('VENTA', 1, 3)]
+        )
+
+        InventoryMovementDailySummary.objects.all().delete()
+        InventoryMovementDailySummary.rebuild()
+        self.assertEqual(self.resumen(), [('COMPRA', 1, 10), ('VENTA', 1, 3)])
+
+
+class SupplierReportTest(TestCase):
+    """El reporte de proveedores usa un número fijo de consultas"""
+
+    def setUp(self):
+        self.branch = crear_inventario().branch
+        self.user = User.objects.create_user(
+            username='gerente', password='clave-segura', rut='11.111.111-1',
+            role='ADMIN_CLIENTE', company=self.branch.company
+        )
+        self.client.force_login(self.user)
+
+    def crear_proveedor(self, numero, compras):
+        supplier = Supplier.objects.create(
+            company=self.branch.company, name=f'Proveedor {numero}', rut=f'{numero}-K',
+            contact_name='Contacto', contact_email='p@test.cl', contact_phone='123', address='Calle 2'
+        )
+        for monto in range(1, compras + 1):
+            Purchase.objects.create(
+                company=self.branch.company, supplier=supplier, branch=self.branch,
+                user=self.user, total_amount=monto * 100
+            )
+        return supplier
+
+    def test_consultas_no_dependen_de_la_cantidad_de_proveedores(self):
+        self.crear_proveedor(1, compras=7)
+        self.crear_proveedor(2, compras=0)
+        company_plans([self.branch.company_id])  # el plan se lee de la cache (entitlements.py)
+        # sesión, usuario, proveedores con totales, últimas compras
+        with self.assertNumQueries(4):
+            response = self.client.get('/reportes/proveedores/')
+        datos = {fila['nombre']: fila for fila in response.context['datos']}
+        self.assertEqual(datos['Proveedor 1']['total_compras'], 7)
+        self.assertEqual(datos['Proveedor 1']['monto_total_compras'], 2800.0)
+        self.assertEqual(len(datos['Proveedor 1']['ultimas_compras']), 5)
+        self.assertEqual(datos['Proveedor 2']['ultimas_compras'], [])
+
+        for numero in range(3, 8):
+            self.crear_proveedor(numero, compras=2)
+        with self.assertNumQueries(4):
+            self.client.get('/reportes/proveedores/')
+
+
+class EagerLoadingTest(TestCase):
+    """Los listados de la API cuestan un número fijo de consultas"""
+
+    def setUp(self):
+        self.inventory = crear_inventario(stock=1000)
+        self.user = User.objects.create_user(
+            username='gerente', password='clave-segura', rut='11.111.111-1',
+            role='ADMIN_CLIENTE', company=self.inventory.branch.company
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def crear_ventas(self, cantidad):
+        create_sales_batch([
+            {'branch': self.inventory.branch_id, 'payment_method': 'EFECTIVO',
+             'items': [{'product': self.inventory.product_id, 'quantity': 1}], 'payment': {}}
+            for _ in range(cantidad)
+        ], self.user)
+
+    def contar_consultas(self, url):
+        with CaptureQueriesContext(connection) as contexto:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(contexto.captured_queries)
+
+    def test_consultas_no_dependen_de_las_filas(self):
+        urls = ['/api/sales/', '/api/inventory-movements/', '/api/payments/', '/api/inventory/']
+        self.crear_ventas(1)
+        pocas = {url: self.contar_consultas(url) for url in urls}
+        self.crear_ventas(5)
+        muchas = {url: self.contar_consultas(url) for url in urls}
+        self.assertEqual(pocas, muchas)
+
+    def test_rutas_derivadas_del_serializer(self):
+        select, prefetch = SaleViewSet.get_eager_paths(SaleSerializer, Sale)
+        self.assertEqual(select, ['branch', 'user'])
+        self.assertEqual(prefetch, ['items', 'items__product'])
+
+
+def sembrar_empresa(numero, sucursales=2, productos=6, ventas=12):
+    """
+    Crea una empresa con datos de todas las tablas (sucursales, inventario,
+    proveedores, compras, ventas con pago, órdenes, carrito) y su admin.
+    """
+    hoy = timezone.localdate()
+    company = Company.objects.create(
+        name=f'Empresa {numero}', rut=f'7{numero}.000.000-{numero}', address='Calle 1',
+        phone='123', email=f'empresa{numero}@test.cl'
+    )
+    Subscription.objects.create(
+        company=company, plan_name='PREMIUM', start_date=hoy - timedelta(days=30),
+        end_date=hoy + timedelta(days=30), max_branches=10, max_users=10,
+        has_api_access=True, has_reports=True
+    )
+    admin = User.objects.create_user(
+        username=f'admin{numero}', password='clave-segura', rut=f'{numero}.111.111-1',
+        role='ADMIN_CLIENTE', company=company
+    )
+    branches = [
+        Branch.objects.create(company=company, name=f'Sucursal {i}', address='Calle 1', phone='123')
+        for i in range(sucursales)
+    ]
+    products = [
+        Product.objects.create(
+            company=company, sku=f'E{numero}-{i}', name=f'Producto {i}', category='OTROS',
+            price=Decimal('1000') + i, cost=Decimal('500')
+        )
+        for i in range(productos)
+    ]
+    for branch in branches:
+        for product in products:
+            inventory = Inventory.objects.create(branch=branch, product=product, stock=0, reorder_point=10)
+            InventoryMovement.objects.create(
+                inventory=inventory, movement_type='COMPRA', quantity=100, user=admin
+            )
+    for i in range(3):
+        supplier = Supplier.objects.create(
+            company=company, name=f'Proveedor {i}', rut=f'{numero}{i}-K', contact_name='Contacto',
+            contact_email='p@test.cl', contact_phone='123', address='Calle 2'
+        )
+        purchase = Purchase.objects.create(
+            company=company, supplier=supplier, branch=branches[0], user=admin, total_amount=5000
+        )
+        for product in products[:3]:
+            PurchaseItem.objects.create(purchase=purchase, product=product, quantity=5, unit_cost=500)
+    create_sales_batch([
+        {'branch': branches[i % sucursales].pk, 'payment_method': 'EFECTIVO', 'payment': {},
+         'items': [{'product': products[i % productos].pk, 'quantity': 1},
+                   {'product': products[(i + 1) % productos].pk, 'quantity': 2}]}
+        for i in range(ventas)
+    ], admin)
+    for i in range(3):
+        order = Order.objects.create(
+            company=company, user=admin, customer_name='Cliente', customer_email='c@test.cl',
+            customer_phone='123', customer_address='Calle 3'
+        )
+        for product in products[:2]:
+            OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=product.price)
+        Payment.objects.create(order=order, amount=2000, payment_method='TRANSFERENCIA')
+    cart = Cart.for_user(admin)
+    for product in products[:3]:
+        cart.add(product.pk, 1)
+    return company, admin
+
+
+class QueryBudgetTest(TestCase):
+    """
+    Presupuesto de consultas SQL por endpoint.
+
+    Siembra dos empresas con datos en todas las tablas y recorre los listados
+    y detalles de la API y los reportes HTML. Falla si un endpoint supera su
+    presupuesto o si ejecuta dos veces la misma consulta (síntoma de N+1).
+    Con QUERY_BUDGET_VERBOSE=1 imprime consultas y tiempo por endpoint.
+    """
+
+    maxDiff = None
+
+    # Listados y reportes, medidos como ADMIN_CLIENTE (sesión incluida)
+    BUDGETS = {
+        '/api/subscriptions/': 5,
+        '/api/users/': 5,
+        '/api/branches/': 5,
+        '/api/suppliers/': 5,
+        '/api/products/': 5,
+        '/api/inventory/': 5,
+        '/api/inventory/low-stock/': 5,
+        '/api/purchases/': 7,
+        '/api/sales/': 6,
+        '/api/orders/': 6,
+        '/api/cart/': 4,
+        '/api/payments/': 4,
+        '/api/inventory-movements/': 4,
+        '/api/report-jobs/': 4,
+        '/reportes/stock/': 4,
+        '/reportes/ventas/': 6,
+        '/reportes/proveedores/': 4,
+        '/reportes/movimientos/': 5,
+    }
+    # Detalle (<ruta>/<id>/) de cada ViewSet del router
+    DETAIL_BUDGETS = {
+        'subscriptions': (Subscription, 4),
+        'users': (User, 4),
+        'branches': (Branch, 4),
+        'suppliers': (Supplier, 4),
+        'products': (Product, 4),
+        'inventory': (Inventory, 4),
+        'purchases': (Purchase, 6),
+        'sales': (Sale, 6),
+        'orders': (Order, 6),
+        # El carrito está en la cache: el detalle es por producto
+        'cart': (Product, 3),
+        'payments': (Payment, 4),
+        'inventory-movements': (InventoryMovement, 4),
+        'report-jobs': (ReportJob, 3),
+    }
+    # Endpoints exclusivos de SUPER_ADMIN
+    SUPERADMIN_BUDGETS = {
+        '/api/companies/': 4,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company, cls.admin = sembrar_empresa(1)
+        sembrar_empresa(2)
+        for report_type in ('VENTAS', 'STOCK'):
+            ReportJob.objects.create(user=cls.admin, report_type=report_type)
+        cls.superadmin = User.objects.create_user(
+            username='root', password='clave-segura', rut='9.999.999-9', role='SUPER_ADMIN'
+        )
+
+    def medir(self, user, url):
+        """Ejecuta un GET y devuelve (respuesta, consultas, segundos)"""
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as contexto:
+            inicio = time.perf_counter()
+            response = self.client.get(url)
+            segundos = time.perf_counter() - inicio
+        return response, contexto.captured_queries, segundos
+
+    def revisar(self, user, url, budget, errores):
+        response, queries, segundos = self.medir(user, url)
+        if os.environ.get('QUERY_BUDGET_VERBOSE'):
+            print(f'{url:45} {len(queries):3} consultas {segundos * 1000:7.1f} ms')
+        if response.status_code != 200:
+            errores.append(f'{url}: status {response.status_code}')
+            return
+        if len(queries) > budget:
+            errores.append(f'{url}: {len(queries)} consultas (presupuesto {budget})')
+        repetidas = [sql for sql, veces in Counter(q['sql'] for q in queries).items() if veces > 1]
+        for sql in repetidas:
+            errores.append(f'{url}: consulta repetida: {sql[:200]}')
+
+    def test_presupuesto_de_consultas(self):
+        # Se mide con los planes ya en la cache (entitlements.py)
+        company_plans(Company.objects.values_list('pk', flat=True))
+        errores = []
+        for url, budget in self.BUDGETS.items():
+            self.revisar(self.admin, url, budget, errores)
+        for ruta, (model, budget) in self.DETAIL_BUDGETS.items():
+            if model is User:
+                obj = self.admin
+            elif model is ReportJob:
+                obj = model.objects.filter(user=self.admin).first()
+            else:
+                obj = model.objects.filter(pk__in=self.visibles(model)).order_by('pk').first()
+            self.revisar(self.admin, f'/api/{ruta}/{obj.pk}/', budget, errores)
+        for url, budget in self.SUPERADMIN_BUDGETS.items():
+            self.revisar(self.superadmin, url, budget, errores)
+        self.assertEqual(errores, [])
+
+    def visibles(self, model):
+        """Ids del modelo que pertenecen a la empresa sembrada del admin"""
+        lookup = {
+            Subscription: 'company', Branch: 'company', Supplier: 'company', Product: 'company',
+            Inventory: 'branch__company', Purchase: 'company', Sale: 'branch__company',
+            Order: 'company', Payment: 'order__company', InventoryMovement: 'inventory__branch__company',
+        }[model]
+        return model.objects.filter(**{lookup: self.company}).values('pk')
+
+
+class KeysetPaginationTest(TestCase):
+    """Paginación por cursor sobre (created_at, id) en los libros de alto volumen"""
+
+    def setUp(self):
+        self.inventory = crear_inventario(stock=1000)
+        self.user = User.objects.create_user(
+            username='gerente', password='clave-segura', rut='11.111.111-1',
+            role='ADMIN_CLIENTE', company=self.inventory.branch.company
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        # Todas con el mismo created_at: el desempate por id debe ser estable
+        create_sales_batch([
+            {'branch': self.inventory.branch_id, 'payment_method': 'EFECTIVO',
+             'items': [{'product': self.inventory.product_id, 'quantity': 1}]}
+            for _ in range(7)
+        ], self.user)
+        Sale.objects.update(created_at=timezone.now())
+
+    def test_recorre_todo_sin_repetir_y_vuelve_atras(self):
+        esperado = list(Sale.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        vistos = []
+        paginas = []
+        url = '/api/sales/?page_size=3'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            paginas.append([venta['id'] for venta in response.data['results']])
+            vistos.extend(paginas[-1])
+            url = response.data['next']
+        self.assertEqual(vistos, esperado)
+        self.assertEqual([len(pagina) for pagina in paginas], [3, 3, 1])
+
+        anterior = self.client.get(response.data['previous'])
+        self.assertEqual([venta['id'] for venta in anterior.data['results']], paginas[1])
+
+    def test_total_aproximado_opcional_y_cursor_invalido(self):
+        response = self.client.get('/api/sales/?total=approx')
+        self.assertEqual(response.data['approximate_total'], 7)
+        self.assertEqual(self.client.get('/api/sales/?cursor=xyz').status_code, 404)
+
+    def test_ordering_no_se_acepta(self):
+        for url in ('/api/sales/', '/api/orders/', '/api/payments/', '/api/inventory-movements/'):
+            response = self.client.get(f'{url}?ordering=-total_amount')
+            self.assertEqual(response.status_code, 400, url)
+            self.assertIn('ordering', response.data)
+
+
+class ReportExportTest(TestCase):
+    """Exportación de reportes en streaming (CSV / NDJSON)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company, cls.admin = sembrar_empresa(1)
+        sembrar_empresa(2)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def descargar(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_movimientos_csv_sin_limite_y_solo_de_la_empresa(self):
+        contenido = self.descargar('/reportes/movimientos/?format=csv')
+        filas = list(csv.reader(io.StringIO(contenido)))
+        self.assertEqual(filas[0][:3], ['fecha', 'tipo', 'producto'])
+        esperado = InventoryMovement.objects.filter(inventory__branch__company=self.company).count()
+        self.assertEqual(len(filas) - 1, esperado)
+
+    def test_ventas_ndjson_respeta_filtros(self):
+        branch = Branch.objects.filter(company=self.company).order_by('pk').first()
+        contenido = self.descargar(f'/reportes/ventas/?format=ndjson&branch={branch.pk}')
+        ventas = [json.loads(linea) for linea in contenido.splitlines()]
+        self.assertEqual(len(ventas), Sale.objects.filter(branch=branch).count())
+        self.assertEqual({venta['sucursal'] for venta in ventas}, {branch.name})
+        self.assertEqual(ventas[0]['metodo_pago'], 'Efectivo')
+
+    def test_stock_y_proveedores(self):
+        stock = list(csv.reader(io.StringIO(self.descargar('/reportes/stock/?format=csv'))))
+        self.assertEqual(len(stock) - 1, Inventory.objects.filter(branch__company=self.company).count())
+        proveedores = self.descargar('/reportes/proveedores/?format=ndjson').splitlines()
+        self.assertEqual(json.loads(proveedores[0])['total_compras'], 1)
+
+
+class ReportJobTest(TestCase):
+    """Reportes en segundo plano: solicitud, worker y descarga"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company, cls.admin = sembrar_empresa(1)
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        ajustes = override_settings(REPORT_JOBS_ROOT=self.root, REPORT_JOBS_ACCEL_PREFIX=None)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def solicitar(self, **datos):
+        response = self.client.post('/api/report-jobs/', datos, format='json')
+        self.assertEqual(response.status_code, 202, response.data)
+        return response.data['id']
+
+    def test_worker_genera_el_archivo_y_se_descarga(self):
+        job_id = self.solicitar(report_type='MOVIMIENTOS', export_format='csv', params={'tipo': 'VENTA'})
+        self.assertEqual(self.client.get(f'/api/report-jobs/{job_id}/download/').status_code, 409)
+
+        call_command('run_report_worker', '--once', stdout=io.StringIO())
+
+        job = self.client.get(f'/api/report-jobs/{job_id}/').data
+        self.assertEqual(job['status'], 'COMPLETADO')
+        esperado = InventoryMovement.objects.filter(movement_type='VENTA').count()
+        self.assertEqual(job['row_count'], esperado)
+
+        response = self.client.get(f'/api/report-jobs/{job_id}/download/')
+        filas = list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(filas) - 1, esperado)
+
+        with override_settings(REPORT_JOBS_ACCEL_PREFIX='/protected/report-jobs/'):
+            response = self.client.get(f'/api/report-jobs/{job_id}/download/')
+        self.assertEqual(
+            response['X-Accel-Redirect'], f'/protected/report-jobs/{self.company.pk}/{job_id}.csv'
+        )
+
+    def test_filtros_desconocidos_y_reportes_ajenos(self):
+        response = self.client.post('/api/report-jobs/', {
+            'report_type': 'VENTAS', 'params': {'company': 2}
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        job_id = self.solicitar(report_type='VENTAS')
+        _, otro_admin = sembrar_empresa(2)
+        self.client.force_authenticate(otro_admin)
+        self.assertEqual(self.client.get(f'/api/report-jobs/{job_id}/').status_code, 404)
+
+    def test_el_error_no_expone_el_detalle_interno(self):
+        job_id = self.solicitar(report_type='STOCK')
+        falla = mock.patch('pos_ecommerce.reports.render_rows', side_effect=OSError('/var/lib/secreto: sin espacio'))
+        with falla, self.assertLogs('pos_ecommerce.reports', 'ERROR') as logs:
+            call_command('run_report_worker', '--once', stdout=io.StringIO(), stderr=io.StringIO())
+
+        job = self.client.get(f'/api/report-jobs/{job_id}/').data
+        self.assertEqual((job['status'], job['error']), ('ERROR', REPORT_JOB_ERROR))
+        self.assertIn('/var/lib/secreto', logs.output[0])
+
+    def test_un_trabajo_lo_toma_un_solo_worker(self):
+        job_id = self.solicitar(report_type='STOCK')
+        self.assertEqual(str(ReportJob.claim_next().pk), job_id)
+        self.assertIsNone(ReportJob.claim_next())
+
+    @override_settings(REPORT_JOBS_TIMEOUT=60, REPORT_JOBS_MAX_ATTEMPTS=2)
+    def test_trabajos_abandonados_se_reintentan_y_luego_fallan(self):
+        job_id = self.solicitar(report_type='STOCK')
+        ReportJob.claim_next()
+        # Sigue en proceso dentro del plazo: nadie más lo toma
+        self.assertIsNone(ReportJob.claim_next())
+
+        def abandonar():
+            ReportJob.objects.filter(pk=job_id).update(started_at=timezone.now() - timedelta(minutes=5))
+
+        abandonar()
+        job = ReportJob.claim_next()
+        self.assertEqual((str(job.pk), job.status, job.attempts), (job_id, 'EN_PROCESO', 2))
+
+        abandonar()
+        self.assertIsNone(ReportJob.claim_next())
+        response = self.client.get(f'/api/report-jobs/{job_id}/')
+        self.assertEqual(response.data['status'], 'ERROR')
+
+
+class DeploymentConfigTest(SimpleTestCase):
+    """Los servicios de systemd cargan la configuración de producción que espera Nginx"""
+
+    def leer(self, nombre):
+        with open(os.path.join(settings.BASE_DIR, nombre), encoding='utf-8') as archivo:
+            return archivo.read()
+
+    def test_servicios_usan_settings_production(self):
+        for unidad in ('gunicorn.service', 'report-worker.service'):
+            modulos = re.findall(r'DJANGO_SETTINGS_MODULE=([\w.]+)', self.leer(unidad))
+            self.assertEqual(modulos, ['temucosoft.settings_production'], unidad)
+
+    def test_descarga_de_reportes_por_nginx(self):
+        produccion = importlib.import_module('temucosoft.settings_production')
+        nginx = self.leer('nginx.conf')
+        prefijo = produccion.REPORT_JOBS_ACCEL_PREFIX
+        self.assertTrue(prefijo)
+        location = re.search(r'location %s \{(.*?)\}' % re.escape(prefijo), nginx, re.S)
+        self.assertIsNotNone(location)
+        self.assertIn('internal;', location.group(1))
+        self.assertIn(f'alias {str(produccion.REPORT_JOBS_ROOT).rstrip("/")}/;', location.group(1))
+
+    def test_cache_de_produccion_con_add_atomico(self):
+        produccion = importlib.import_module('temucosoft.settings_production')
+        self.assertNotIn(produccion.CACHES['default']['BACKEND'], NON_ATOMIC_ADD_CACHES)
+
+
+class ProductCatalogTest(TestCase):
+    """Catálogo de la tienda paginado, con facetas y cacheado por versión"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company, _ = sembrar_empresa(1, productos=30)
+        Product.objects.filter(sku__in=['E1-0', 'E1-1']).update(category='LIBROS')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_facetas_y_paginacion(self):
+        response = self.client.get('/tienda/')
+        facetas = {valor: cantidad for valor, _, cantidad in response.context['facets']}
+        self.assertEqual(facetas['OTROS'], 28)
+        self.assertEqual(facetas['LIBROS'], 2)
+        self.assertEqual(response.context['num_pages'], 2)
+
+        response = self.client.get('/tienda/', {'category': 'OTROS', 'page': 2})
+        self.assertEqual(response.context['page'], 2)
+        self.assertEqual(response.context['total'], 28)
+        self.assertEqual(response.content.decode().count('form="form-agregar"'), 28 - CATALOG_PAGE_SIZE)
+
+    def test_visitante_anonimo_no_consulta_la_base_de_datos(self):
+        self.client.get('/tienda/', {'search': 'Producto 1'})
+        with self.assertNumQueries(0):
+            response = self.client.get('/tienda/', {'search': 'Producto 1'})
+        self.assertContains(response, 'Producto 1')
+
+    def test_cambios_en_productos_y_empresas_invalidan_el_catalogo(self):
+        self.client.get('/tienda/', {'category': 'LIBROS'})
+        producto = Product.objects.get(sku='E1-0')
+        with self.captureOnCommitCallbacks(execute=True):
+            producto.name = 'Producto renombrado'
+            producto.save()
+        self.assertContains(self.client.get('/tienda/', {'category': 'LIBROS'}), 'Producto renombrado')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.company.is_active = False
+            self.company.save()
+        self.assertEqual(self.client.get('/tienda/').context['total'], 0)
+
+
+class ProductSearchTest(TestCase):
+    """Búsqueda de productos con el índice de texto completo"""
+
+    @classmethod
+    def setUpTestData(cls):
+        company, _ = sembrar_empresa(1, productos=2)
+        for sku, nombre, descripcion in [
+            ('ZAP-1', 'Zapatilla running', 'Calzado liviano para correr'),
+            ('CAM-1', 'Camión de juguete', 'Juguete de madera'),
+            ('POL-1', 'Polera', 'Algodón, ideal para correr y zapatilla a juego'),
+        ]:
+            Product.objects.create(
+                company=company, sku=sku, name=nombre, description=descripcion,
+                price=Decimal('1000'), cost=Decimal('500')
+            )
+
+    def buscar(self, query):
+        return list(search_products(Product.objects.all(), query).values_list('sku', flat=True))
+
+    def test_orden_por_relevancia_prefijos_y_tildes(self):
+        # El nombre pesa más que la descripción
+        self.assertEqual(self.buscar('zapatilla'), ['ZAP-1', 'POL-1'])
+        self.assertEqual(self.buscar('camion jug'), ['CAM-1'])
+        # Los signos de la consulta no llegan al motor de búsqueda
+        self.assertEqual(self.buscar('"correr" OR *'), [])
+        self.assertEqual(self.buscar('*'), [])
+
+    def test_el_indice_sigue_los_cambios_del_producto(self):
+        Product.objects.filter(sku='CAM-1').update(name='Tren de juguete')
+        self.assertEqual(self.buscar('tren'), ['CAM-1'])
+        Product.objects.get(sku='CAM-1').delete()
+        self.assertEqual(self.buscar('juguete'), [])
+
+    def test_resaltado_escapado_en_api_y_catalogo(self):
+        Product.objects.filter(sku='POL-1').update(name='Polera <b>correr</b>')
+        response = APIClient().get('/api/products/', {'search': 'correr'})
+        resultados = {item['sku']: item for item in response.data['results']}
+        self.assertEqual(
+            resultados['POL-1']['name_highlight'], 'Polera &lt;b&gt;<mark>correr</mark>&lt;/b&gt;'
+        )
+        self.assertIn('<mark>correr</mark>', resultados['ZAP-1']['description_highlight'])
+
+        cache.clear()
+        response = self.client.get('/tienda/', {'search': 'correr'})
+        self.assertEqual(response.context['total'], 2)
+        self.assertContains(response, 'Polera &lt;b&gt;<mark>correr</mark>&lt;/b&gt;')
+
+
+class PosLookupTest(TestCase):
+    """Búsqueda por SKU del POS con el índice en memoria"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company, cls.admin = sembrar_empresa(1, ventas=0)
+        cls.branch = cls.company.branches.order_by('pk').first()
+
+    def setUp(self):
+        cache.clear()
+        clear_indexes()
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def buscar(self, sku, **params):
+        return self.client.get('/api/pos/lookup/', {'sku': sku, 'branch': self.branch.pk, **params})
+
+    def test_sku_exacto_sin_consultas_con_el_indice_cargado(self):
+        response = self.buscar('E1-2')
+        self.assertEqual(response.status_code, 200)
+        producto = response.data['results'][0]
+        self.assertEqual((producto['sku'], producto['stock']), ('E1-2', 100))
+
+        with self.assertNumQueries(0):
+            resultados = lookup_sku(self.company.pk, self.branch.pk, 'E1-2')
+        self.assertEqual(resultados[0]['id'], producto['id'])
+        self.assertEqual(self.buscar('NO-EXISTE').status_code, 404)
+
+    def test_prefijo(self):
+        response = self.buscar('E1-', prefix=1)
+        self.assertEqual([p['sku'] for p in response.data['results']], [f'E1-{i}' for i in range(6)])
+        self.assertEqual(self.buscar('X', prefix=1).data['results'], [])
+
+    def test_ventas_y_cambios_de_producto_invalidan_el_indice(self):
+        self.buscar('E1-0')
+        producto = Product.objects.get(sku='E1-0')
+        with self.captureOnCommitCallbacks(execute=True):
+            create_sales_batch([{
+                'branch': self.branch.pk, 'payment_method': 'EFECTIVO', 'payment': {},
+                'items': [{'product': producto.pk, 'quantity': 3}]
+            }], self.admin)
+        self.assertEqual(self.buscar('E1-0').data['results'][0]['stock'], 97)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            producto.price = Decimal('1500')
+            producto.save()
+        self.assertEqual(self.buscar('E1-0').data['results'][0]['price'], Decimal('1500'))
+
+    def test_sucursal_de_otra_empresa(self):
+        otra_empresa, _ = sembrar_empresa(2, ventas=0)
+        otra_sucursal = otra_empresa.branches.first()
+        response = self.client.get('/api/pos/lookup/', {'sku': 'E2-0', 'branch': otra_sucursal.pk})
+        self.assertEqual(response.status_code, 404)
+
+
+class DashboardCountersTest(TestCase):
+    """Contadores del panel mantenidos en la cache"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company, cls.admin = sembrar_empresa(1, ventas=0)
+        cls.branch = cls.company.branches.order_by('pk').first()
+        cls.vendedor = User.objects.create_user(
+            username='vendedor1', password='clave-segura', rut='9.999.999-9',
+            role='VENDEDOR', company=cls.company
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def panel(self, user):
+        self.client.force_login(user)
+        self.client.get('/panel/')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/panel/')
+        conteos = [q['sql'] for q in queries.captured_queries if 'COUNT(' in q['sql'].upper()]
+        self.assertEqual(conteos, [])
+        return response.context
+
+    def test_panel_sin_conteos_y_ajustes_incrementales(self):
+        context = self.panel(self.admin)
+        self.assertEqual((context['products_count'], context['branches_count'], context['low_stock']), (6, 2, 0))
+        self.assertEqual(self.panel(self.vendedor)['sales_today'], 0)
+
+        producto = Product.objects.get(sku='E1-0')
+        with self.captureOnCommitCallbacks(execute=True):
+            create_sales_batch([
+                {'branch': self.branch.pk, 'payment_method': 'EFECTIVO', 'payment': {},
+                 'items': [{'product': producto.pk, 'quantity': 45}]}
+                for _ in range(2)
+            ], self.vendedor)
+            Product.objects.create(
+                company=self.company, sku='E1-NUEVO', name='Nuevo', price=Decimal('10'), cost=Decimal('5')
+            )
+
+        self.assertEqual(self.panel(self.vendedor)['sales_today'], 2)
+        context = self.panel(self.admin)
+        self.assertEqual((context['products_count'], context['low_stock']), (7, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            InventoryMovement.objects.create(
+                inventory=Inventory.objects.get(branch=self.branch, product=producto),
+                movement_type='COMPRA', quantity=50
+            )
+        self.assertEqual(self.panel(self.admin)['low_stock'], 0)
+
+    def test_reconciliacion(self):
+        # Un cambio que no emite señales deja el contador desfasado
+        self.panel(self.admin)
+        Inventory.objects.filter(branch=self.branch).update(stock=0)
+        self.assertEqual(self.panel(self.admin)['low_stock'], 0)
+
+        call_command('reconcile_dashboard_counters', stdout=io.StringIO())
+        self.assertEqual(self.panel(self.admin)['low_stock'], 6)
+
+
+class LowStockFeedTest(TestCase):
+    """Inventarios con stock bajo por el índice parcial y ordenados por urgencia"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company, cls.admin = sembrar_empresa(1, ventas=0)
+        cls.branch = cls.company.branches.order_by('pk').first()
+        inventarios = list(Inventory.objects.filter(branch=cls.branch).order_by('product__sku'))
+        # stock / punto de reorden: 5/10, 1/10, 0/0, 10/10 y el resto sobre el punto
+        for inventario, (stock, reorden) in zip(inventarios, [(5, 10), (1, 10), (0, 0), (10, 10)]):
+            Inventory.objects.filter(pk=inventario.pk).update(stock=stock, reorder_point=reorden)
+        sembrar_empresa(2, ventas=0)
+        Inventory.objects.filter(branch__company__name='Empresa 2').update(stock=0)
+
+    def test_feed_ordenado_por_proporcion(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        response = client.get('/api/inventory/low-stock/', {'branch': self.branch.pk})
+        self.assertEqual(response.data['count'], 4)
+        self.assertEqual(
+            [(item['product_sku'], item['restock_ratio']) for item in response.data['results']],
+            [('E1-2', None), ('E1-1', 0.1), ('E1-0', 0.5), ('E1-3', 1.0)]
+        )
+        # Sin filtro de sucursal: solo inventarios de la propia empresa
+        self.assertEqual(client.get('/api/inventory/low-stock/').data['count'], 4)
+
+    def test_consulta_usa_el_indice_parcial(self):
+        queryset = Inventory.objects.filter(branch=self.branch).needs_restock()
+        plan = queryset.explain()
+        if connection.vendor == 'sqlite':
+            self.assertIn('pos_inventory_restock_idx', plan)
+        self.assertEqual(queryset.count(), 4)
+
+
+class QueryPlanTest(TestCase):
+    """
+    Planes de ejecución de los listados y reportes sobre un volumen de datos
+    mayor: falla si una consulta recorre secuencialmente una tabla grande
+    (ver query_plans.LARGE_TABLES) o si un filtro deja de usar su índice.
+    """
+    maxDiff = None
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company, cls.admin = sembrar_empresa(1, sucursales=3, productos=40, ventas=300)
+        sembrar_empresa(2, sucursales=3, productos=40, ventas=300)
+
+    def test_sin_recorridos_secuenciales_en_tablas_grandes(self):
+        report = check_endpoints(self.admin, prefer_indexes=True)
+        # /api/companies/ es solo de SUPER_ADMIN
+        self.assertEqual([e['path'] for e in report if e['status'] not in (200, 403)], [])
+        self.assertEqual(regressions(report), [])
+
+    def test_detecta_indice_eliminado(self):
+        path = '/api/payments/?status=COMPLETADO'
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX pos_payment_status_created_idx')
+        report = check_endpoints(self.admin, paths=[path], prefer_indexes=True)
+        self.assertEqual(regressions(report), [f'{path}: no usa el índice pos_payment_status_created_idx'])
+
+
+@override_settings(LAST_LOGIN_FLUSH_INTERVAL=60 * 60)
+class JWTPrincipalCacheTest(TestCase):
+    """Autenticación JWT con claims de rol/empresa y usuario cacheado"""
+
+    def setUp(self):
+        cache.clear()
+        self.company, self.admin = sembrar_empresa(1, sucursales=1, productos=2, ventas=1)
+        self.client = APIClient()
+        response = self.client.post(
+            '/api/token/', {'username': 'admin1', 'password': 'clave-segura'}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.token = response.data['access']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def test_claims_y_last_login_en_lote(self):
+        from rest_framework_simplejwt.tokens import AccessToken
+        token = AccessToken(self.token)
+        self.assertEqual(token['role'], 'ADMIN_CLIENTE')
+        self.assertEqual(token['company_id'], self.company.pk)
+
+        self.admin.refresh_from_db()
+        self.assertIsNone(self.admin.last_login)
+        with self.assertNumQueries(1):
+            self.assertEqual(flush_last_logins(), 1)
+        self.admin.refresh_from_db()
+        self.assertIsNotNone(self.admin.last_login)
+
+    def test_peticiones_sin_consultas_de_autenticacion(self):
+        self.assertEqual(self.client.get('/api/branches/').status_code, 200)
+        # Solo el COUNT y la página de sucursales: ni usuario ni empresa
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get('/api/branches/').status_code, 200)
+        flush_last_logins()
+
+    def test_cambio_de_rol_invalida_el_token(self):
+        self.assertEqual(self.client.get('/api/branches/').status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin.role = 'GERENTE'
+            self.admin.save()
+        self.assertEqual(self.client.get('/api/branches/').status_code, 401)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.admin.role = 'ADMIN_CLIENTE'
+            self.admin.is_active = False
+            self.admin.save()
+        self.assertEqual(self.client.get('/api/branches/').status_code, 401)
+        flush_last_logins()
+
+
+class LastLoginTimerTest(TransactionTestCase):
+    """Los last_login en lote se escriben aunque el worker no reciba más logins"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='vendedor', password='clave-segura', rut='8.888.888-8', role='VENDEDOR'
+        )
+        flush_last_logins()
+
+    @override_settings(LAST_LOGIN_FLUSH_INTERVAL=0.05)
+    def test_temporizador_escribe_lo_pendiente(self):
+        authentication.record_login(self.user.pk)
+        timer = authentication._flush_timer
+        self.assertIsNotNone(timer)
+        timer.join(5)
+
+        self.user.refresh_from_db()
+        self.assertIsNotNone(self.user.last_login)
+        self.assertIsNone(authentication._flush_timer)
+
+    @override_settings(LAST_LOGIN_FLUSH_INTERVAL=60 * 60)
+    def test_error_al_terminar_queda_en_el_log(self):
+        authentication.record_login(self.user.pk)
+        falla = mock.patch.object(User.objects, 'bulk_update', side_effect=RuntimeError('sin conexión'))
+        with falla, self.assertLogs('pos_ecommerce.authentication', 'ERROR'):
+            authentication._flush_at_exit()
+        self.assertIsNone(authentication._flush_timer)
+
+
+class PlanEntitlementsTest(TestCase):
+    """Límites y funcionalidades del plan, leídos de la cache"""
+
+    def setUp(self):
+        cache.clear()
+        self.company, self.admin = sembrar_empresa(1, sucursales=1, productos=1, ventas=1)
+        self.subscription = self.company.subscription
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def cambiar_plan(self, **campos):
+        with self.captureOnCommitCallbacks(execute=True):
+            for campo, valor in campos.items():
+                setattr(self.subscription, campo, valor)
+            self.subscription.save()
+
+    def crear_sucursal(self, nombre, **extra):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/branches/', {
+                'company': self.company.pk, 'name': nombre, 'address': 'Calle 1', 'phone': '123', **extra
+            }, format='json')
+
+    def test_limite_de_sucursales(self):
+        self.cambiar_plan(max_branches=2)
+        self.assertEqual(self.crear_sucursal('Segunda').status_code, 201)
+        response = self.crear_sucursal('Tercera')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('como máximo 2 sucursales', str(response.data))
+        # Las inactivas no cuentan
+        self.assertEqual(self.crear_sucursal('Bodega', is_active=False).status_code, 201)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Branch.objects.get(name='Segunda').delete()
+        self.assertEqual(self.crear_sucursal('Tercera').status_code, 201)
+
+    def test_verificaciones_sin_consultas_con_la_cache_caliente(self):
+        self.assertIsNone(limit_error(self.company.pk, 'users'))
+        with self.assertNumQueries(0):
+            self.assertIsNone(limit_error(self.company.pk, 'users'))
+            self.assertTrue(has_feature(self.company.pk, 'has_reports'))
+
+    def test_funcionalidades_del_plan(self):
+        self.cambiar_plan(has_reports=False)
+        self.assertEqual(self.client.get('/api/report-jobs/').status_code, 403)
+        self.client.force_login(self.admin)
+        self.assertRedirects(self.client.get('/reportes/stock/'), '/panel/', fetch_redirect_response=False)
+
+        self.cambiar_plan(has_api_access=False)
+        response = APIClient().post(
+            '/api/token/', {'username': 'admin1', 'password': 'clave-segura'}, format='json'
+        )
+        self.assertEqual(response.status_code, 403)
+
+        # Suscripción vencida: pierde las funcionalidades aunque el plan las incluya
+        self.cambiar_plan(has_reports=True, end_date=timezone.localdate() - timedelta(days=1))
+        self.assertEqual(self.client.get('/api/report-jobs/').status_code, 403)
+
+    def test_id_de_empresa_como_texto_no_envenena_la_cache(self):
+        usuarios = User.objects.filter(company=self.company, is_active=True).count()
+        self.cambiar_plan(max_users=usuarios, has_reports=False)
+        superadmin = User.objects.create_user(
+            username='root', password='clave-segura', rut='9.999.999-9', role='SUPER_ADMIN'
+        )
+        self.client.force_login(superadmin)
+        datos = {'username': 'nuevo', 'password': 'clave-segura', 'role': 'VENDEDOR', 'is_active': 'on'}
+
+        self.client.post('/usuarios/crear/', {**datos, 'company': str(self.company.pk)})
+        self.assertFalse(User.objects.filter(username='nuevo').exists())
+        self.assertIsNotNone(limit_error(str(self.company.pk), 'users'))
+        self.assertIsNotNone(company_plans([self.company.pk])[self.company.pk])
+        self.assertFalse(has_feature(self.company.pk, 'has_reports'))
+
+        response = self.client.post('/usuarios/crear/', {**datos, 'company': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(User.objects.filter(username='nuevo').exists())
+
+    def test_usuario_trasladado_libera_el_cupo_de_la_empresa_anterior(self):
+        otra, _ = sembrar_empresa(2, sucursales=1, productos=1, ventas=1)
+        vendedor = User.objects.create_user(
+            username='vendedor', password='clave-segura', rut='8.888.888-8',
+            role='VENDEDOR', company=self.company
+        )
+        # Empresa 1 en su límite; a la empresa 2 le queda un cupo
+        for empresa, extra in ((self.company, 0), (otra, 1)):
+            suscripcion = Subscription.objects.get(company=empresa)
+            suscripcion.max_users = User.objects.filter(company=empresa, is_active=True).count() + extra
+            with self.captureOnCommitCallbacks(execute=True):
+                suscripcion.save()
+        self.assertIsNotNone(limit_error(self.company.pk, 'users'))
+        self.assertIsNone(limit_error(otra.pk, 'users'))
+
+        vendedor.company = otra
+        with self.captureOnCommitCallbacks(execute=True):
+            vendedor.save()
+
+        self.assertIsNone(limit_error(self.company.pk, 'users'))
+        self.assertIsNotNone(limit_error(otra.pk, 'users'))
+
+
+class CacheCartTest(TestCase):
+    """Carrito en la cache: sin filas hasta el checkout"""
+
+    def setUp(self):
+        cache.clear()
+        self.company, self.admin = sembrar_empresa(1, sucursales=1, productos=3, ventas=1)
+        self.products = list(Product.objects.filter(company=self.company).order_by('pk'))
+        self.cliente = User.objects.create_user(
+            username='cliente', password='clave-segura', rut='12.345.678-5', role='CLIENTE_FINAL'
+        )
+        CartItem.objects.all().delete()
+
+    def test_carrito_anonimo_pasa_al_usuario_al_iniciar_sesion(self):
+        self.client.get('/carrito/')
+        self.assertNotIn('sessionid', self.client.cookies)
+
+        with CaptureQueriesContext(connection) as captured:
+            self.client.post('/carrito/agregar/', {'product': self.products[0].pk, 'quantity': 2})
+        # Solo se lee el producto y se crea la sesión; el carrito no toca la base de datos
+        self.assertNotIn('pos_ecommerce_cartitem', ' '.join(q['sql'] for q in captured.captured_queries))
+        self.client.post('/carrito/agregar/', {'product': self.products[1].pk})
+        self.assertFalse(CartItem.objects.exists())
+
+        Cart.for_user(self.cliente).add(self.products[0].pk, 1)
+        self.client.post('/iniciar-sesion/', {'username': 'cliente', 'password': 'clave-segura'})
+        lineas = {linea.product_id: linea.quantity for linea in Cart.for_user(self.cliente).items()}
+        self.assertEqual(lineas, {self.products[0].pk: 3, self.products[1].pk: 1})
+
+        self.client.post('/pagar/procesar/', {
+            'full_name': 'Cliente', 'email': 'c@test.cl', 'phone': '+56911111111',
+            'address': 'Av. Alemania 100', 'city': 'Temuco', 'payment_method': 'TRANSFERENCIA',
+        })
+        order = Order.objects.get(user=self.cliente)
+        self.assertEqual(order.items.count(), 2)
+        self.assertFalse(Cart.for_user(self.cliente))
+        self.assertFalse(CartItem.objects.exists())
+
+    @override_settings(CART_MAX_ITEMS=2, CART_MAX_QUANTITY=5)
+    def test_api_del_carrito_y_limites(self):
+        client = APIClient()
+        client.force_authenticate(self.cliente)
+        uno, dos, tres = (product.pk for product in self.products)
+
+        self.assertEqual(client.post('/api/cart/add/', {'product': uno, 'quantity': 2}).data['quantity'], 2)
+        self.assertEqual(client.post('/api/cart/', {'product': dos}).status_code, 200)
+        response = client.post('/api/cart/add/', {'product': tres})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('2 productos distintos', response.data['error'])
+        self.assertEqual(client.patch(f'/api/cart/{uno}/', {'quantity': 6}).status_code, 400)
+        self.assertEqual(client.patch(f'/api/cart/{uno}/', {'quantity': 4}).data['quantity'], 4)
+        self.assertEqual(client.delete(f'/api/cart/{dos}/').status_code, 204)
+        self.assertEqual(client.get(f'/api/cart/{dos}/').status_code, 404)
+
+        response = client.get('/api/cart/')
+        self.assertEqual([(linea['id'], linea['quantity']) for linea in response.data['results']], [(uno, 4)])
+
+        response = client.post('/api/cart/checkout/', {
+            'customer_name': 'Cliente', 'customer_email': 'c@test.cl', 'customer_phone': '+56911111111',
+            'customer_address': 'Av. Alemania 100, Temuco',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(client.get('/api/cart/').data['count'], 0)
+
+    def test_carritos_guardados_en_la_tabla_se_traspasan(self):
+        CartItem.objects.create(user=self.cliente, product=self.products[2], quantity=3)
+        self.assertEqual(
+            [(linea.product_id, linea.quantity) for linea in Cart.for_user(self.cliente).items()],
+            [(self.products[2].pk, 3)]
+        )
+        self.assertFalse(CartItem.objects.exists())
+        # Ya en la cache: leerlo no consulta la tabla CartItem
+        with CaptureQueriesContext(connection) as captured:
+            Cart.for_user(self.cliente).items()
+        self.assertNotIn('pos_ecommerce_cartitem', ' '.join(q['sql'] for q in captured.captured_queries))
+
+    def test_checkout_con_consultas_fijas(self):
+        client = APIClient()
+        client.force_authenticate(self.cliente)
+        datos = {
+            'customer_name': 'Cliente', 'customer_email': 'c@test.cl', 'customer_phone': '+56911111111',
+            'customer_address': 'Av. Alemania 100, Temuco', 'shipping_cost': '2500',
+        }
+        consultas = []
+        for products in (self.products[:1], self.products):
+            cart = Cart.for_user(self.cliente)
+            for product in products:
+                cart.add(product.pk, 2)
+            with CaptureQueriesContext(connection) as captured:
+                response = client.post('/api/cart/checkout/', datos, format='json')
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(len(response.data['items']), len(products))
+            consultas.append(len(captured.captured_queries))
+
+            order = Order.objects.get(pk=response.data['id'])
+            self.assertEqual(order.total_amount, sum(p.price * 2 for p in products) + 2500)
+        self.assertEqual(consultas[0], consultas[1])
+        self.assertEqual(client.post('/api/cart/checkout/', datos, format='json').status_code, 400)
+
+
+class StockReservationTest(TestCase):
+    """Reservas de stock de órdenes e-commerce"""
+
+    def setUp(self):
+        cache.clear()
+        self.company, self.admin = sembrar_empresa(1, sucursales=2, productos=1, ventas=1)
+        self.product = Product.objects.get(company=self.company)
+        Inventory.objects.filter(product=self.product).update(stock=3)
+        self.cliente = User.objects.create_user(
+            username='cliente', password='clave-segura', rut='12.345.678-5', role='CLIENTE_FINAL'
+        )
+        self.api = APIClient()
+        self.api.force_authenticate(self.cliente)
+        self.staff = APIClient()
+        self.staff.force_authenticate(self.admin)
+
+    def comprar(self, quantity):
+        Cart.for_user(self.cliente).add(self.product.pk, quantity)
+        return self.checkout()
+
+    def checkout(self):
+        return self.api.post('/api/cart/checkout/', {
+            'customer_name': 'Cliente', 'customer_email': 'c@test.cl', 'customer_phone': '+56911111111',
+            'customer_address': 'Av. Alemania 100, Temuco',
+        }, format='json')
+
+    def stock(self):
+        return sorted(Inventory.objects.filter(product=self.product).values_list('stock', 'reserved'))
+
+    def test_checkout_reserva_y_no_sobrevende(self):
+        response = self.comprar(5)
+        self.assertEqual(response.status_code, 201)
+        # Repartida entre las dos sucursales; el stock no se toca hasta confirmar
+        self.assertEqual(self.stock(), [(3, 2), (3, 3)])
+
+        pedidos = Order.objects.count()
+        response = self.comprar(2)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Disponible: 1', response.data['error'])
+        self.assertEqual(Order.objects.count(), pedidos)
+        self.assertEqual(Cart.for_user(self.cliente).quantity(self.product.pk), 2)
+
+        order_id = Order.objects.get(user=self.cliente).pk
+        response = self.staff.post(f'/api/orders/{order_id}/update_status/', {'status': 'CANCELADO'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(), [(3, 0), (3, 0)])
+        # El carrito rechazado sigue disponible para reintentar
+        self.assertEqual(self.checkout().status_code, 201)
+
+    def test_confirmar_consume_la_reserva(self):
+        order_id = self.comprar(4).data['id']
+        response = self.staff.patch(f'/api/orders/{order_id}/', {'status': 'CONFIRMADO'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(), [(0, 0), (2, 0)])
+        movements = InventoryMovement.objects.filter(movement_type='VENTA', notes=f'Orden e-commerce #{order_id}')
+        self.assertEqual(sorted(movements.values_list('quantity', flat=True)), [1, 3])
+        self.assertFalse(StockReservation.objects.filter(status='ACTIVA').exists())
+
+        # Pasar a ENVIADO no vuelve a descontar
+        self.staff.post(f'/api/orders/{order_id}/update_status/', {'status': 'ENVIADO'})
+        self.assertEqual(self.stock(), [(0, 0), (2, 0)])
+
+    def test_liberar_o_devolver_sin_aplicar_el_update_no_toca_las_reservas(self):
+        order = Order.objects.get(pk=self.comprar(4).data['id'])
+        # reserved desfasado: el UPDATE condicionado no encuentra tanto reservado
+        Inventory.objects.filter(product=self.product).update(reserved=0)
+        with self.assertRaises(reservations.ReservationError):
+            reservations.release(order)
+        self.assertEqual(order.reservations.filter(status='ACTIVA').count(), 2)
+
+        Inventory.objects.filter(product=self.product).update(reserved=F('stock'))
+        with self.captureOnCommitCallbacks(execute=True):
+            reservations.consume(order)
+        movimientos = InventoryMovement.objects.count()
+        with mock.patch.object(Inventory, 'apply_stock_deltas', return_value=False):
+            with self.assertRaises(reservations.ReservationError):
+                reservations.restock(order)
+        self.assertEqual(InventoryMovement.objects.count(), movimientos)
+        self.assertEqual(order.reservations.filter(status='CONSUMIDA').count(), 2)
+
+    def test_el_pos_no_vende_lo_reservado(self):
+        order_id = self.comprar(4).data['id']
+        primero, segundo = Inventory.objects.filter(product=self.product).order_by('pk')
+        self.assertEqual((primero.reserved, segundo.reserved), (3, 1))
+
+        venta = {'payment_method': 'EFECTIVO', 'items': [{'product': self.product.pk, 'quantity': 3}]}
+        resultado = create_sales_batch([dict(venta, branch=segundo.branch_id)], self.admin)[0]
+        self.assertEqual(resultado['status'], 'rejected')
+        self.assertIn('Disponible: 2', resultado['errors'][0])
+        with self.assertRaises(ValidationError):
+            InventoryMovement.objects.create(inventory=primero, movement_type='AJUSTE_NEGATIVO', quantity=1)
+        self.assertFalse(primero.remove_stock(1))
+        response = self.staff.patch(f'/api/inventory/{primero.pk}/', {'stock': 2}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        # Lo no reservado sí se vende, y la orden se confirma igual
+        resultado = create_sales_batch(
+            [dict(venta, branch=segundo.branch_id, items=[{'product': self.product.pk, 'quantity': 2}])],
+            self.admin
+        )[0]
+        self.assertEqual(resultado['status'], 'created')
+        response = self.staff.post(f'/api/orders/{order_id}/update_status/', {'status': 'CONFIRMADO'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(), [(0, 0), (0, 0)])
+
+    def test_cancelar_una_orden_confirmada_devuelve_el_stock(self):
+        order_id = self.comprar(4).data['id']
+        self.staff.post(f'/api/orders/{order_id}/update_status/', {'status': 'CONFIRMADO'})
+        self.assertEqual(self.stock(), [(0, 0), (2, 0)])
+
+        response = self.staff.post(f'/api/orders/{order_id}/update_status/', {'status': 'CANCELADO'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(), [(3, 0), (3, 0)])
+        devoluciones = InventoryMovement.objects.filter(
+            movement_type='DEVOLUCION', notes=f'Orden e-commerce #{order_id}'
+        )
+        self.assertEqual(sorted(devoluciones.values_list('quantity', flat=True)), [1, 3])
+
+    def test_una_orden_cancelada_no_se_reabre(self):
+        order_id = self.comprar(2).data['id']
+        self.staff.post(f'/api/orders/{order_id}/update_status/', {'status': 'CANCELADO'})
+
+        response = self.staff.post(f'/api/orders/{order_id}/update_status/', {'status': 'CONFIRMADO'})
+        self.assertEqual(response.status_code, 400)
+        response = self.staff.patch(f'/api/orders/{order_id}/', {'status': 'ENVIADO'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('status', response.data)
+        self.assertEqual(Order.objects.get(pk=order_id).status, 'CANCELADO')
+        self.assertEqual(self.stock(), [(3, 0), (3, 0)])
+
+    def test_una_orden_enviada_no_se_cancela(self):
+        order_id = self.comprar(2).data['id']
+        self.staff.patch(f'/api/orders/{order_id}/', {'status': 'ENVIADO'}, format='json')
+        response = self.staff.patch(f'/api/orders/{order_id}/', {'status': 'CANCELADO'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.get(pk=order_id).status, 'ENVIADO')
+        self.assertEqual(self.stock(), [(1, 0), (3, 0)])
+
+    def test_reservas_vencidas_se_liberan_por_lotes(self):
+        primera = self.comprar(3).data['id']
+        segunda = self.comprar(2).data['id']
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+
+        out = io.StringIO()
+        call_command('release_expired_reservations', batch_size=1, stdout=out)
+        self.assertIn('liberadas: 2', out.getvalue())
+        self.assertEqual(self.stock(), [(3, 0), (3, 0)])
+
+        # Confirmar una orden vencida vuelve a reservar si todavía hay stock
+        Inventory.objects.filter(product=self.product).update(stock=1)
+        response = self.staff.post(f'/api/orders/{segunda}/update_status/', {'status': 'CONFIRMADO'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stock(), [(0, 0), (0, 0)])
+        response = self.staff.post(f'/api/orders/{primera}/update_status/', {'status': 'CONFIRMADO'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Order.objects.get(pk=primera).status, 'PENDIENTE')
+
+
+class CartSessionCleanupTest(TestCase):
+    """Limpieza por lotes de carritos abandonados y sesiones vencidas"""
+
+    def setUp(self):
+        self.product = crear_inventario(stock=5).product
+        self.cliente = User.objects.create_user(
+            username='cliente', password='clave-segura', rut='12.345.678-5', role='CLIENTE_FINAL'
+        )
+
+    def test_limpieza_por_lotes_de_carritos_y_sesiones(self):
+        for i in range(5):
+            CartItem.objects.create(session_key=f'viejo{i}', product=self.product, quantity=1)
+        CartItem.objects.update(updated_at=timezone.now() - timedelta(days=30))
+        vigente = CartItem.objects.create(user=self.cliente, product=self.product, quantity=1)
+        for _ in range(3):
+            session = SessionStore()
+            session.set_expiry(-60)
+            session.save()
+        activa = SessionStore()
+        activa.save()
+
+        out = io.StringIO()
+        call_command('cleanup_carts_and_sessions', batch_size=2, stdout=out)
+        self.assertIn('eliminados: 5 filas; sesiones vencidas eliminadas: 3', out.getvalue())
+        self.assertEqual(list(CartItem.objects.values_list('pk', flat=True)), [vigente.pk])
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), [activa.session_key])
@@ -10,6 +10,7 @@ from .views import (
     CompanyViewSet, SubscriptionViewSet, UserViewSet, BranchViewSet,
     SupplierViewSet, ProductViewSet, InventoryViewSet, PurchaseViewSet,
     SaleViewSet, OrderViewSet, CartItemViewSet, PaymentViewSet, InventoryMovementViewSet,
+    ReportJobViewSet, PosLookupView,
     # Reportes HTML
     stock_report, sales_report, supplier_report, inventory_movements_report,
     # Vistas de Templates
@@ -37,6 +38,7 @@ router.register(r'orders', OrderViewSet, basename='order')
 router.register(r'cart', CartItemViewSet, basename='cart')
 router.register(r'payments', PaymentViewSet, basename='payment')
 router.register(r'inventory-movements', InventoryMovementViewSet, basename='inventory-movement')
+router.register(r'report-jobs', ReportJobViewSet, basename='report-job')
 
 urlpatterns = [
     # ========== API Endpoints ==========
@@ -44,6 +46,9 @@ urlpatterns = [
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     
+    # Búsqueda por SKU para el escáner del POS
+    path('api/pos/lookup/', PosLookupView.as_view(), name='pos_lookup'),
+    
     # Endpoints CRUD (todos los ViewSets)
     path('api/', include(router.urls)),
     
@@ -2,31 +2,56 @@
 Views y ViewSets para el sistema POS + E-commerce de TemucoSoft S.A.
 Implementa todos los endpoints API REST y vistas de templates requeridos.
 """
-from rest_framework import viewsets, status
+from rest_framework import viewsets, status, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.csrf import ensure_csrf_cookie
 from django.contrib.auth import authenticate, login, logout
 from django.contrib import messages
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.utils import timezone
-from django.db.models import Sum, Count, Q, F
-from django.http import JsonResponse
+from django.utils.safestring import mark_safe
+from django.db.models import Sum, Count, Q, F, Window
+from django.db.models.functions import RowNumber
+from django.db import transaction
+from django.http import Http404, JsonResponse, HttpResponse, FileResponse
+from django.conf import settings
 from datetime import datetime, timedelta
+from collections import defaultdict
+import os
 
 from .models import (
     Company, Subscription, User, Branch, Supplier, Product, Inventory, InventoryMovement,
-    Purchase, PurchaseItem, Sale, SaleItem, Order, OrderItem, CartItem, Payment
+    Purchase, PurchaseItem, Sale, SaleItem, Order, Payment,
+    SalesDailyRollup, InventoryMovementDailySummary, ReportJob
 )
 from .serializers import (
     CompanySerializer, SubscriptionSerializer, UserSerializer, UserCreateSerializer,
     BranchSerializer, SupplierSerializer, ProductSerializer, InventorySerializer,
     PurchaseSerializer, PurchaseItemSerializer, SaleSerializer, SaleItemSerializer,
-    OrderSerializer, OrderItemSerializer, CartItemSerializer, PaymentSerializer,
-    InventoryMovementSerializer
+    OrderSerializer, OrderItemSerializer, CartLineSerializer, PaymentSerializer,
+    InventoryMovementSerializer, SaleBatchEntrySerializer, ReportJobSerializer
+)
+from .services import create_sales_batch, create_order_from_cart, CheckoutError, StockConflictError
+from .mixins import IdempotentMixin, EagerLoadingMixin
+from .pagination import KeysetPagination
+from .exports import CONTENT_TYPES, get_export_format, export_query, stream_export
+from .cart import Cart, CartError, CartLine
+from .catalog import normalize_filters, get_catalog_page
+from .search import FullTextSearchFilter
+from .pos_lookup import bump_stock_version, lookup_sku
+from . import counters, reservations
+from .reservations import ReservationError, StatusTransitionError
+from .entitlements import company_plan, company_usage, limit_error, plan_feature_required
+from .reports import (
+    EXPORTS, parse_report_date, inventory_queryset, sales_queryset, suppliers_queryset,
+    movements_queryset
 )
 from .permissions import (
     IsSuperAdmin, IsAdminCliente, IsGerente, IsVendedor,
@@ -40,7 +65,7 @@ from .permissions import (
 # API ViewSets
 # ============================================================================
 
-class CompanyViewSet(viewsets.ModelViewSet):
+class CompanyViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     """
     ViewSet para empresas/clientes (tenants).
     Solo super_admin puede crear y modificar empresas.
@@ -54,7 +79,7 @@ class CompanyViewSet(viewsets.ModelViewSet):
     ordering_fields = ['name', 'created_at']
 
 
-class SubscriptionViewSet(viewsets.ModelViewSet):
+class SubscriptionViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     """
     ViewSet para suscripciones.
     Super_admin gestiona, admin_cliente solo puede ver la suya.
@@ -90,7 +115,7 @@ class SubscriptionViewSet(viewsets.ModelViewSet):
         return Response({'status': 'Suscripción desactivada'})
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     """
     ViewSet para usuarios del sistema.
     Super_admin y admin_cliente pueden crear usuarios.
@@ -127,7 +152,7 @@ class UserViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class BranchViewSet(viewsets.ModelViewSet):
+class BranchViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     """
     ViewSet para sucursales.
     Admin_cliente y gerente pueden gestionar sucursales.
@@ -151,12 +176,12 @@ class BranchViewSet(viewsets.ModelViewSet):
     def inventory(self, request, pk=None):
         """Obtener inventario de una sucursal"""
         branch = self.get_object()
-        inventory = Inventory.objects.filter(branch=branch)
+        inventory = self.eager_load(Inventory.objects.filter(branch=branch), InventorySerializer)
         serializer = InventorySerializer(inventory, many=True)
         return Response(serializer.data)
 
 
-class SupplierViewSet(viewsets.ModelViewSet):
+class SupplierViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     """
     ViewSet para proveedores.
     Admin_cliente y gerente pueden gestionar proveedores.
@@ -181,7 +206,7 @@ class SupplierViewSet(viewsets.ModelViewSet):
         serializer.save(company=self.request.user.company)
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     """
     ViewSet para productos.
     Lectura pública para e-commerce, escritura para admin_cliente y gerente.
@@ -189,7 +214,8 @@ class ProductViewSet(viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    # ?search= usa el índice de texto completo (search.py), ordenado por relevancia
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OrderingFilter]
     filterset_fields = ['company', 'category', 'is_active']
     search_fields = ['sku', 'name', 'description']
     ordering_fields = ['name', 'price', 'created_at']
@@ -208,7 +234,7 @@ class ProductViewSet(viewsets.ModelViewSet):
         return Product.objects.filter(is_active=True)
 
 
-class InventoryViewSet(viewsets.ModelViewSet):
+class InventoryViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     """
     ViewSet para inventario.
     Admin_cliente y gerente pueden gestionar inventario.
@@ -229,6 +255,18 @@ class InventoryViewSet(viewsets.ModelViewSet):
             return Inventory.objects.filter(branch__company=user.company)
         return Inventory.objects.none()
     
+    @action(detail=False, methods=['get'], url_path='low-stock')
+    def low_stock(self, request):
+        """
+        Inventarios con stock bajo, del más urgente al menos urgente
+        (stock / punto de reorden). Acepta los mismos filtros del listado.
+        GET /api/inventory/low-stock/?branch=<id>
+        """
+        queryset = self.filter_queryset(self.get_queryset()).needs_restock().by_restock_urgency()
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+    
     @action(detail=False, methods=['post'], permission_classes=[IsAdminClienteOrGerente])
     def adjust(self, request):
         """
@@ -243,23 +281,34 @@ class InventoryViewSet(viewsets.ModelViewSet):
         try:
             inventory = Inventory.objects.get(branch_id=branch_id, product_id=product_id)
             
+            # El ajuste pasa por el libro de movimientos (UPDATE condicionado)
             if action_type == 'add':
-                inventory.add_stock(quantity)
+                movement_type = 'AJUSTE_POSITIVO'
                 message = f'Se agregaron {quantity} unidades al stock'
             elif action_type == 'remove':
-                if inventory.remove_stock(quantity):
-                    message = f'Se quitaron {quantity} unidades del stock'
-                else:
-                    return Response(
-                        {'error': 'Stock insuficiente'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
+                movement_type = 'AJUSTE_NEGATIVO'
+                message = f'Se quitaron {quantity} unidades del stock'
             else:
                 return Response(
                     {'error': 'Acción inválida. Use "add" o "remove"'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
+            try:
+                InventoryMovement.objects.create(
+                    inventory=inventory,
+                    movement_type=movement_type,
+                    quantity=quantity,
+                    user=request.user,
+                    notes='Ajuste manual de stock'
+                )
+            except DjangoValidationError:
+                return Response(
+                    {'error': 'Stock insuficiente'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            inventory.refresh_from_db()
             serializer = self.get_serializer(inventory)
             return Response({
                 'message': message,
@@ -273,7 +322,7 @@ class InventoryViewSet(viewsets.ModelViewSet):
             )
 
 
-class PurchaseViewSet(viewsets.ModelViewSet):
+class PurchaseViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     """
     ViewSet para compras a proveedores.
     Admin_cliente y gerente pueden registrar compras.
@@ -298,17 +347,19 @@ class PurchaseViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
 
-class SaleViewSet(viewsets.ModelViewSet):
+class SaleViewSet(IdempotentMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     """
     ViewSet para ventas POS.
     Admin_cliente, gerente y vendedor pueden registrar ventas.
     """
     queryset = Sale.objects.all()
     serializer_class = SaleSerializer
+    pagination_class = KeysetPagination
     permission_classes = [CanCreateSale]
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, SearchFilter]
     filterset_fields = ['branch', 'user', 'payment_method']
-    ordering_fields = ['created_at', 'total_amount']
+    idempotent_actions = ['create', 'batch']
+    MAX_BATCH_SIZE = 500
     
     def get_queryset(self):
         user = self.request.user
@@ -338,9 +389,65 @@ class SaleViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
+    
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Ingesta masiva de ventas POS (cierre de turno, terminales con mala conexión).
+        Payload: {sales: [{branch, payment_method, items: [{product, quantity, unit_price?}],
+                           client_uuid?}]}
+        Devuelve un resultado por venta, en el mismo orden del payload. Las ventas
+        con client_uuid ya registrado se informan como 'duplicate' (reintento seguro).
+        """
+        entries = request.data.get('sales')
+        if not isinstance(entries, list) or not entries:
+            return Response(
+                {'error': 'Se requiere una lista "sales" con al menos una venta'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(entries) > self.MAX_BATCH_SIZE:
+            return Response(
+                {'error': f'El lote no puede superar {self.MAX_BATCH_SIZE} ventas'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        results = [None] * len(entries)
+        valid_indexes = []
+        valid_entries = []
+        for index, entry in enumerate(entries):
+            serializer = SaleBatchEntrySerializer(data=entry)
+            if serializer.is_valid():
+                valid_indexes.append(index)
+                valid_entries.append(serializer.validated_data)
+            else:
+                results[index] = {'index': index, 'status': 'rejected', 'errors': serializer.errors}
+        
+        if valid_entries:
+            try:
+                batch_results = create_sales_batch(valid_entries, request.user)
+            except StockConflictError as e:
+                return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+            for index, result in zip(valid_indexes, batch_results):
+                result['index'] = index
+                results[index] = result
+        
+        created = sum(1 for result in results if result['status'] == 'created')
+        duplicates = sum(1 for result in results if result['status'] == 'duplicate')
+        if created:
+            response_status = status.HTTP_201_CREATED
+        elif duplicates:
+            response_status = status.HTTP_200_OK
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response({
+            'created': created,
+            'duplicates': duplicates,
+            'rejected': len(results) - created - duplicates,
+            'results': results
+        }, status=response_status)
 
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(IdempotentMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     """
     ViewSet para órdenes de e-commerce.
     Admin_cliente y gerente gestionan todas las órdenes.
@@ -348,11 +455,12 @@ class OrderViewSet(viewsets.ModelViewSet):
     """
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    pagination_class = KeysetPagination
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, SearchFilter]
     filterset_fields = ['company', 'status', 'user']
     search_fields = ['customer_name', 'customer_email']
-    ordering_fields = ['created_at', 'total_amount', 'status']
+    idempotent_actions = ['update_status']
     
     def get_queryset(self):
         user = self.request.user
@@ -364,6 +472,16 @@ class OrderViewSet(viewsets.ModelViewSet):
             # Clientes finales ven solo sus órdenes
             return Order.objects.filter(user=user)
     
+    def perform_update(self, serializer):
+        """Un cambio de estado por PUT/PATCH consume o libera las reservas igual que update_status"""
+        new_status = serializer.validated_data.get('status', serializer.instance.status)
+        try:
+            with transaction.atomic():
+                reservations.apply_status_change(serializer.instance, new_status, self.request.user)
+                serializer.save()
+        except (ReservationError, StatusTransitionError) as e:
+            raise serializers.ValidationError({'status': str(e)})
+    
     @action(detail=True, methods=['post'], permission_classes=[IsAdminClienteOrGerente])
     def update_status(self, request, pk=None):
         """Actualizar estado de una orden"""
@@ -371,8 +489,13 @@ class OrderViewSet(viewsets.ModelViewSet):
         new_status = request.data.get('status')
         
         if new_status in dict(Order.STATUS_CHOICES):
-            order.status = new_status
-            order.save()
+            try:
+                with transaction.atomic():
+                    reservations.apply_status_change(order, new_status, request.user)
+                    order.status = new_status
+                    order.save()
+            except (ReservationError, StatusTransitionError) as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
             serializer = self.get_serializer(order)
             return Response(serializer.data)
         
@@ -382,104 +505,96 @@ class OrderViewSet(viewsets.ModelViewSet):
         )
 
 
-class CartItemViewSet(viewsets.ModelViewSet):
+class CartItemViewSet(IdempotentMixin, viewsets.GenericViewSet):
     """
     ViewSet para items del carrito de compras.
-    Los usuarios gestionan su propio carrito.
+    Los usuarios gestionan su propio carrito; los visitantes, el de su sesión.
+    El carrito vive en la cache (ver cart.py) y cada línea se identifica por
+    el id de su producto: solo el checkout escribe en la base de datos.
     """
-    queryset = CartItem.objects.all()
-    serializer_class = CartItemSerializer
+    serializer_class = CartLineSerializer
     permission_classes = [AllowAny]  # Permitir carritos sin autenticación
+    idempotent_actions = ['checkout']
+    lookup_value_regex = r'\d+'
+    
+    def get_cart(self, create=False):
+        return Cart.for_request(self.request, create=create)
+    
+    def get_line(self, pk):
+        for line in self.get_cart().items():
+            if line.id == int(pk):
+                return line
+        raise Http404
+    
+    def list(self, request):
+        items = self.get_cart().items()
+        page = self.paginate_queryset(items)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(items, many=True).data)
+    
+    def retrieve(self, request, pk=None):
+        return Response(self.get_serializer(self.get_line(pk)).data)
+    
+    def create(self, request):
+        """Igual que add: suma la cantidad si el producto ya está en el carrito"""
+        return self.add(request)
+    
+    def update(self, request, pk=None, partial=False):
+        """Cambia la cantidad de un producto del carrito"""
+        line = self.get_line(pk)
+        data = {'product': line.id}
+        if 'quantity' in request.data:
+            data['quantity'] = request.data['quantity']
+        serializer = self.get_serializer(line, data=data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        quantity = serializer.validated_data.get('quantity', line.quantity)
+        try:
+            line.quantity = self.get_cart(create=True).set_quantity(line.id, quantity)
+        except CartError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(line).data)
     
-    def get_queryset(self):
-        if self.request.user.is_authenticated:
-            return CartItem.objects.filter(user=self.request.user)
-        else:
-            # Para usuarios no autenticados, usar session_key
-            session_key = self.request.session.session_key
-            if not session_key:
-                self.request.session.create()
-                session_key = self.request.session.session_key
-            return CartItem.objects.filter(session_key=session_key)
+    def partial_update(self, request, pk=None):
+        return self.update(request, pk, partial=True)
+    
+    def destroy(self, request, pk=None):
+        if not self.get_cart().remove(int(pk)):
+            raise Http404
+        return Response(status=status.HTTP_204_NO_CONTENT)
     
     @action(detail=False, methods=['post'])
     def add(self, request):
         """Agregar producto al carrito"""
-        product_id = request.data.get('product')
-        quantity = int(request.data.get('quantity', 1))
-        
-        if not product_id:
-            return Response(
-                {'error': 'Se requiere product_id'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Obtener o crear session key para usuarios no autenticados
-        if request.user.is_authenticated:
-            cart_item, created = CartItem.objects.get_or_create(
-                user=request.user,
-                product_id=product_id,
-                defaults={'quantity': quantity}
-            )
-        else:
-            session_key = request.session.session_key
-            if not session_key:
-                request.session.create()
-                session_key = request.session.session_key
-            
-            cart_item, created = CartItem.objects.get_or_create(
-                session_key=session_key,
-                product_id=product_id,
-                defaults={'quantity': quantity}
-            )
-        
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
-        
-        serializer = self.get_serializer(cart_item)
-        return Response(serializer.data)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        product = serializer.validated_data['product']
+        try:
+            quantity = self.get_cart(create=True).add(product.pk, serializer.validated_data['quantity'])
+        except CartError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(CartLine(product, quantity)).data)
     
     @action(detail=False, methods=['post'])
     def checkout(self, request):
         """Convertir carrito en orden"""
-        cart_items = self.get_queryset()
-        
-        if not cart_items.exists():
-            return Response(
-                {'error': 'El carrito está vacío'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Crear orden
-        order_data = {
-            'company': cart_items.first().product.company,
-            'customer_name': request.data.get('customer_name'),
-            'customer_email': request.data.get('customer_email'),
-            'customer_phone': request.data.get('customer_phone'),
-            'customer_address': request.data.get('customer_address'),
-            'shipping_cost': request.data.get('shipping_cost', 0),
-        }
-        
-        if request.user.is_authenticated:
-            order_data['user'] = request.user
-        
-        order = Order.objects.create(**order_data)
-        
-        # Crear items de la orden
-        for cart_item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                quantity=cart_item.quantity,
-                unit_price=cart_item.product.price
+        shipping_cost = serializers.DecimalField(
+            max_digits=10, decimal_places=2, min_value=0
+        ).run_validation(request.data.get('shipping_cost', 0))
+        try:
+            order = create_order_from_cart(
+                self.get_cart(),
+                customer={
+                    'customer_name': request.data.get('customer_name'),
+                    'customer_email': request.data.get('customer_email'),
+                    'customer_phone': request.data.get('customer_phone'),
+                    'customer_address': request.data.get('customer_address'),
+                },
+                user=request.user,
+                shipping_cost=shipping_cost,
             )
-        
-        # Calcular total
-        order.calculate_total()
-        
-        # Vaciar carrito
-        cart_items.delete()
+        except CheckoutError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
         serializer = OrderSerializer(order)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -487,23 +602,23 @@ class CartItemViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['post', 'delete'])
     def clear(self, request):
         """Vaciar el carrito"""
-        self.get_queryset().delete()
+        self.get_cart().clear()
         return Response({'message': 'Carrito vaciado'})
 
 
-class PaymentViewSet(viewsets.ModelViewSet):
+class PaymentViewSet(IdempotentMixin, EagerLoadingMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestión de pagos.
     Registra pagos de ventas POS y órdenes e-commerce.
     """
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
+    pagination_class = KeysetPagination
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, SearchFilter]
     filterset_fields = ['status', 'payment_method', 'sale', 'order']
     search_fields = ['transaction_id', 'reference']
-    ordering_fields = ['created_at', 'amount']
-    ordering = ['-created_at']
+    idempotent_actions = ['complete']
     
     def get_queryset(self):
         user = self.request.user
@@ -536,7 +651,7 @@ class PaymentViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
-class InventoryMovementViewSet(viewsets.ModelViewSet):
+class InventoryMovementViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
     """
     ViewSet para gestión de movimientos de inventario.
     Registra entradas, salidas y ajustes de stock.
@@ -552,12 +667,11 @@ class InventoryMovementViewSet(viewsets.ModelViewSet):
     """
     queryset = InventoryMovement.objects.all()
     serializer_class = InventoryMovementSerializer
+    pagination_class = KeysetPagination
     permission_classes = [IsAuthenticated]
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, SearchFilter]
     filterset_fields = ['movement_type', 'inventory', 'inventory__branch', 'inventory__product']
     search_fields = ['inventory__product__name', 'inventory__product__sku', 'notes']
-    ordering_fields = ['created_at', 'quantity']
-    ordering = ['-created_at']
     
     def get_queryset(self):
         user = self.request.user
@@ -571,7 +685,11 @@ class InventoryMovementViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         """Al crear, asignar el usuario actual"""
-        serializer.save(user=self.request.user)
+        try:
+            serializer.save(user=self.request.user)
+        except DjangoValidationError as e:
+            # El UPDATE condicionado rechazó la salida por falta de stock
+            raise serializers.ValidationError(e.messages)
     
     @action(detail=False, methods=['get'])
     def by_product(self, request):
@@ -580,7 +698,7 @@ class InventoryMovementViewSet(viewsets.ModelViewSet):
         if not product_id:
             return Response({'error': 'Se requiere product_id'}, status=400)
         
-        movements = self.get_queryset().filter(inventory__product_id=product_id)
+        movements = self.eager_load(self.get_queryset().filter(inventory__product_id=product_id))
         serializer = self.get_serializer(movements, many=True)
         return Response(serializer.data)
     
@@ -591,60 +709,154 @@ class InventoryMovementViewSet(viewsets.ModelViewSet):
         if not branch_id:
             return Response({'error': 'Se requiere branch_id'}, status=400)
         
-        movements = self.get_queryset().filter(inventory__branch_id=branch_id)
+        movements = self.eager_load(self.get_queryset().filter(inventory__branch_id=branch_id))
         serializer = self.get_serializer(movements, many=True)
         return Response(serializer.data)
     
     @action(detail=False, methods=['get'])
     def summary(self, request):
-        """Resumen de movimientos por tipo"""
-        queryset = self.get_queryset()
+        """
+        Resumen de movimientos por tipo, leído del resumen diario.
+        date_from / date_to se interpretan como días completos (YYYY-MM-DD).
+        """
+        user = request.user
+        summaries = InventoryMovementDailySummary.objects.all()
+        if user.role != 'SUPER_ADMIN':
+            if not user.company:
+                summaries = summaries.none()
+            else:
+                summaries = summaries.filter(inventory__branch__company=user.company)
         
         # Filtros opcionales
-        date_from = request.query_params.get('date_from')
-        date_to = request.query_params.get('date_to')
+        date_from = parse_report_date(request.query_params.get('date_from'))
+        date_to = parse_report_date(request.query_params.get('date_to'))
         
         if date_from:
-            queryset = queryset.filter(created_at__gte=date_from)
+            summaries = summaries.filter(day__gte=date_from)
         if date_to:
-            queryset = queryset.filter(created_at__lte=date_to)
+            summaries = summaries.filter(day__lte=date_to)
         
-        summary = queryset.values('movement_type').annotate(
-            count=Count('id'),
-            total_quantity=Sum('quantity')
-        ).order_by('movement_type')
+        summary = [
+            {
+                'movement_type': row['movement_type'],
+                'count': row['count'] or 0,
+                'total_quantity': row['total_quantity'] or 0
+            }
+            for row in summaries.values('movement_type').annotate(
+                count=Sum('movement_count'),
+                total_quantity=Sum('total_quantity')
+            ).order_by('movement_type')
+            if row['count']
+        ]
         
         return Response({
-            'summary': list(summary),
-            'total_movements': queryset.count()
+            'summary': summary,
+            'total_movements': sum(row['count'] for row in summary)
         })
 
 
+class ReportJobViewSet(EagerLoadingMixin, viewsets.ModelViewSet):
+    """
+    ViewSet para reportes en segundo plano.
+    POST crea el trabajo (report_type, export_format, params) y devuelve su id;
+    `manage.py run_report_worker` lo procesa fuera de Gunicorn. El estado se
+    consulta con GET y el archivo se baja desde `download` cuando está COMPLETADO.
+    """
+    queryset = ReportJob.objects.all()
+    serializer_class = ReportJobSerializer
+    permission_classes = [CanViewReports]
+    http_method_names = ['get', 'post', 'delete', 'head', 'options']
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
+    filterset_fields = ['report_type', 'status']
+    ordering = ['-created_at']
+    
+    def get_queryset(self):
+        # Cada usuario ve solo los reportes que solicitó
+        return ReportJob.objects.filter(user=self.request.user)
+    
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+    
+    def perform_destroy(self, instance):
+        instance.delete_result()
+        instance.delete()
+    
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response.status_code = status.HTTP_202_ACCEPTED
+        return response
+    
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Descarga el resultado; en producción lo entrega Nginx (X-Accel-Redirect)"""
+        job = self.get_object()
+        if job.status != 'COMPLETADO' or not job.result_file:
+            return Response(
+                {'error': 'El reporte aún no está listo', 'status': job.status},
+                status=status.HTTP_409_CONFLICT
+            )
+        
+        filename = f'reporte_{job.report_type.lower()}_{timezone.localtime(job.created_at):%Y%m%d}.{job.export_format}'
+        content_type = CONTENT_TYPES[job.export_format]
+        prefix = settings.REPORT_JOBS_ACCEL_PREFIX
+        if prefix:
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = prefix + job.result_file.replace(os.sep, '/')
+        else:
+            if not os.path.exists(job.result_path):
+                return Response({'error': 'Archivo no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+            response = FileResponse(open(job.result_path, 'rb'), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class PosLookupView(APIView):
+    """
+    Búsqueda de productos por SKU para el escáner del POS.
+    GET /api/pos/lookup/?sku=<sku>&branch=<id>[&prefix=1]
+    Se resuelve con el índice en memoria de pos_lookup.py: id, nombre,
+    precio y stock en la sucursal, sin consultas mientras nada cambie.
+    """
+    permission_classes = [IsAdminClienteOrGerenteOrVendedor]
+    
+    def get(self, request):
+        sku = request.query_params.get('sku', '').strip()
+        try:
+            branch_id = int(request.query_params.get('branch', ''))
+        except ValueError:
+            branch_id = None
+        if not sku or branch_id is None:
+            return Response(
+                {'error': 'Los parámetros sku y branch son requeridos'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        prefix = request.query_params.get('prefix') in ('1', 'true')
+        results = lookup_sku(request.user.company_id, branch_id, sku, prefix=prefix)
+        if results is None:
+            return Response({'error': 'Sucursal no encontrada'}, status=status.HTTP_404_NOT_FOUND)
+        if not prefix and not results:
+            return Response({'error': 'Producto no encontrado'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'results': results})
+
+
 # ============================================================================
 # Reportes (Vistas HTML)
 # ============================================================================
 
 @login_required
+@plan_feature_required('has_reports')
 def stock_report(request):
     """
     Reporte de stock por sucursal.
-    GET /reportes/stock/?branch=<id>
+    GET /reportes/stock/?branch=<id>&format=<csv|ndjson>
     """
-    branch_id = request.GET.get('branch')
-    category = request.GET.get('category')
-    user = request.user
+    export_format = get_export_format(request)
+    if export_format:
+        return stream_export(export_format, *EXPORTS['STOCK'](request.user, request.GET))
     
     # Filtrar inventario
-    inventory = Inventory.objects.select_related('branch', 'product').all()
-    
-    if user.role != 'SUPER_ADMIN' and user.company:
-        inventory = inventory.filter(branch__company=user.company)
-    
-    if branch_id:
-        inventory = inventory.filter(branch_id=branch_id)
-    
-    if category:
-        inventory = inventory.filter(product__category=category)
+    inventory = inventory_queryset(request.user, request.GET).select_related('branch', 'product')
     
     # Construir reporte
     report_data = []
@@ -665,7 +877,8 @@ def stock_report(request):
         'titulo': 'Reporte de Stock por Sucursal',
         'fecha_generacion': timezone.now().strftime('%d/%m/%Y %H:%M'),
         'total_registros': len(report_data),
-        'datos': report_data
+        'datos': report_data,
+        'export_query': export_query(request)
     }
     
     # Renderizar HTML
@@ -673,43 +886,46 @@ def stock_report(request):
 
 
 @login_required
+@plan_feature_required('has_reports')
 def sales_report(request):
     """
     Reporte de ventas por período.
-    GET /reportes/ventas/?branch=<id>&date_from=<date>&date_to=<date>
+    GET /reportes/ventas/?branch=<id>&date_from=<date>&date_to=<date>&format=<csv|ndjson>
+    La exportación incluye todas las ventas del período, no solo las 50 del detalle.
     """
     branch_id = request.GET.get('branch')
-    date_from = request.GET.get('date_from')
-    date_to = request.GET.get('date_to')
+    date_from = parse_report_date(request.GET.get('date_from'))
+    date_to = parse_report_date(request.GET.get('date_to'))
     user = request.user
     
-    # Filtrar ventas
-    sales = Sale.objects.select_related('branch', 'user').all()
+    export_format = get_export_format(request)
+    if export_format:
+        return stream_export(export_format, *EXPORTS['VENTAS'](user, request.GET))
+    
+    # Filtrar ventas (detalle) y resumen diario (estadísticas)
+    sales = sales_queryset(user, request.GET).select_related('branch', 'user')
+    rollups = SalesDailyRollup.objects.all()
     
-    if user.role != 'SUPER_ADMIN' and user.company:
-        sales = sales.filter(branch__company=user.company)
+    if user.role != 'SUPER_ADMIN' and user.company_id:
+        rollups = rollups.filter(branch__company_id=user.company_id)
     
     if branch_id:
-        sales = sales.filter(branch_id=branch_id)
+        rollups = rollups.filter(branch_id=branch_id)
     if date_from:
-        sales = sales.filter(created_at__gte=date_from)
+        rollups = rollups.filter(business_date__gte=date_from)
     if date_to:
-        sales = sales.filter(created_at__lte=date_to)
+        rollups = rollups.filter(business_date__lte=date_to)
     
-    # Calcular estadísticas
-    stats = sales.aggregate(
-        total_ventas=Count('id'),
+    # Estadísticas desde el resumen diario: el costo depende de los días, no de las boletas
+    stats = rollups.aggregate(
+        total_ventas=Sum('sales_count'),
         monto_total=Sum('total_amount')
     )
     
-    # Agrupar por día usando TruncDate
-    from django.db.models.functions import TruncDate
-    daily_sales = sales.annotate(
-        dia=TruncDate('created_at')
-    ).values('dia').annotate(
-        cantidad=Count('id'),
+    daily_sales = rollups.values('business_date').annotate(
+        cantidad=Sum('sales_count'),
         total=Sum('total_amount')
-    ).order_by('dia')
+    ).order_by('business_date')
     
     # Detalle de ventas
     ventas_detalle = []
@@ -732,13 +948,15 @@ def sales_report(request):
         },
         'ventas_por_dia': [
             {
-                'dia': item['dia'].strftime('%d/%m/%Y') if item['dia'] else None,
+                'dia': item['business_date'].strftime('%d/%m/%Y'),
                 'cantidad': item['cantidad'],
                 'total': float(item['total'] or 0)
             }
             for item in daily_sales
+            if item['cantidad']
         ],
-        'detalle_ventas': ventas_detalle
+        'detalle_ventas': ventas_detalle,
+        'export_query': export_query(request)
     }
     
     # Renderizar HTML
@@ -746,30 +964,46 @@ def sales_report(request):
 
 
 @login_required
+@plan_feature_required('has_reports')
 def supplier_report(request):
     """
     Reporte de proveedores con productos asociados y últimos pedidos.
-    GET /reportes/proveedores/
+    GET /reportes/proveedores/?format=<csv|ndjson>
     """
-    user = request.user
+    export_format = get_export_format(request)
+    if export_format:
+        return stream_export(export_format, *EXPORTS['PROVEEDORES'](request.user, request.GET))
+    
+    suppliers = suppliers_queryset(request.user)
+    
+    # Últimas 5 compras de cada proveedor en una sola consulta con ventana
+    last_purchases = Purchase.objects.filter(supplier__in=suppliers.values('pk')).annotate(
+        fila=Window(
+            expression=RowNumber(),
+            partition_by=[F('supplier_id')],
+            order_by=[F('purchase_date').desc(), F('id').desc()]
+        )
+    ).filter(fila__lte=5).order_by('supplier_id', 'fila').values(
+        'id', 'supplier_id', 'purchase_date', 'total_amount', 'branch__name'
+    )
     
-    suppliers = Supplier.objects.all()
-    if user.role != 'SUPER_ADMIN' and user.company:
-        suppliers = suppliers.filter(company=user.company)
+    # Totales por proveedor en la misma consulta de proveedores
+    suppliers = suppliers.annotate(
+        total_compras=Count('purchases'),
+        monto_total=Sum('purchases__total_amount')
+    )
     
-    report_data = []
-    for supplier in suppliers:
-        last_purchases = Purchase.objects.filter(
-            supplier=supplier
-        ).select_related('branch').order_by('-purchase_date')[:5]
-        
-        # Contar total de compras y monto
-        purchase_stats = Purchase.objects.filter(supplier=supplier).aggregate(
-            total_compras=Count('id'),
-            monto_total=Sum('total_amount')
-        )
-        
-        report_data.append({
+    purchases_by_supplier = defaultdict(list)
+    for p in last_purchases:
+        purchases_by_supplier[p['supplier_id']].append({
+            'id': p['id'],
+            'fecha': p['purchase_date'].strftime('%d/%m/%Y'),
+            'total': float(p['total_amount']),
+            'sucursal': p['branch__name']
+        })
+    
+    report_data = [
+        {
             'id': supplier.id,
             'nombre': supplier.name,
             'rut': supplier.rut,
@@ -777,24 +1011,19 @@ def supplier_report(request):
             'email': supplier.contact_email,
             'telefono': supplier.contact_phone,
             'activo': supplier.is_active,
-            'total_compras': purchase_stats['total_compras'] or 0,
-            'monto_total_compras': float(purchase_stats['monto_total'] or 0),
-            'ultimas_compras': [
-                {
-                    'id': p.id,
-                    'fecha': p.purchase_date.strftime('%d/%m/%Y'),
-                    'total': float(p.total_amount),
-                    'sucursal': p.branch.name
-                }
-                for p in last_purchases
-            ]
-        })
+            'total_compras': supplier.total_compras or 0,
+            'monto_total_compras': float(supplier.monto_total or 0),
+            'ultimas_compras': purchases_by_supplier[supplier.id]
+        }
+        for supplier in suppliers
+    ]
     
     context = {
         'titulo': 'Reporte de Proveedores',
         'fecha_generacion': timezone.now().strftime('%d/%m/%Y %H:%M'),
         'total_proveedores': len(report_data),
-        'datos': report_data
+        'datos': report_data,
+        'export_query': export_query(request)
     }
     
     # Renderizar HTML
@@ -802,43 +1031,43 @@ def supplier_report(request):
 
 
 @login_required
+@plan_feature_required('has_reports')
 def inventory_movements_report(request):
     """
     Reporte de movimientos de inventario.
-    GET /reportes/movimientos/?tipo=<tipo>&date_from=<date>&date_to=<date>
+    GET /reportes/movimientos/?tipo=<tipo>&date_from=<date>&date_to=<date>&format=<csv|ndjson>
+    La exportación incluye todos los movimientos del período, no solo los 100 del detalle.
     """
     user = request.user
-    tipo = request.GET.get('tipo')
-    date_from = request.GET.get('date_from')
-    date_to = request.GET.get('date_to')
+    date_from = parse_report_date(request.GET.get('date_from'))
+    date_to = parse_report_date(request.GET.get('date_to'))
+    
+    export_format = get_export_format(request)
+    if export_format:
+        return stream_export(export_format, *EXPORTS['MOVIMIENTOS'](user, request.GET))
     
-    # Filtrar movimientos
-    movements = InventoryMovement.objects.select_related(
+    # Filtrar movimientos (detalle) y resumen diario (totales por tipo)
+    movements = movements_queryset(user, request.GET).select_related(
         'inventory__product', 'inventory__branch', 'user'
-    ).all()
+    )
+    summaries = InventoryMovementDailySummary.objects.all()
     
-    if user.role != 'SUPER_ADMIN' and user.company:
-        movements = movements.filter(inventory__branch__company=user.company)
+    if user.role != 'SUPER_ADMIN' and user.company_id:
+        summaries = summaries.filter(inventory__branch__company_id=user.company_id)
     
-    if tipo:
-        movements = movements.filter(movement_type=tipo)
     if date_from:
-        movements = movements.filter(created_at__gte=date_from)
+        summaries = summaries.filter(day__gte=date_from)
     if date_to:
-        movements = movements.filter(created_at__lte=date_to)
+        summaries = summaries.filter(day__lte=date_to)
     
     # Ordenar por fecha descendente y limitar
     movements = movements.order_by('-created_at')[:100]
     
-    # Resumen por tipo
-    all_movements = InventoryMovement.objects.all()
-    if user.role != 'SUPER_ADMIN' and user.company:
-        all_movements = all_movements.filter(inventory__branch__company=user.company)
-    
-    resumen_tipos = all_movements.values('movement_type').annotate(
-        cantidad=Count('id'),
-        total_cantidad=Sum('quantity')
-    ).order_by('movement_type')
+    # Resumen por tipo desde el resumen diario, sin recorrer el libro de movimientos
+    resumen_tipos = summaries.values('movement_type').annotate(
+        cantidad=Sum('movement_count'),
+        total_cantidad=Sum('total_quantity')
+    ).filter(cantidad__gt=0).order_by('movement_type')
     
     # Mapear tipos a nombres legibles
     tipo_choices = dict(InventoryMovement.MOVEMENT_TYPE_CHOICES)
@@ -874,7 +1103,8 @@ def inventory_movements_report(request):
         'fecha_generacion': timezone.now().strftime('%d/%m/%Y %H:%M'),
         'total_movimientos': len(movimientos_data),
         'resumen_tipos': resumen_tipos_data,
-        'movimientos': movimientos_data
+        'movimientos': movimientos_data,
+        'export_query': export_query(request)
     }
     
     return render(request, 'reportes/movimientos_report.html', context)
@@ -928,48 +1158,38 @@ def dashboard(request):
     user = request.user
     context = {'user': user}
     
+    # Contadores mantenidos en la cache (counters.py): sin COUNT(*) por visita
     if user.role == 'SUPER_ADMIN':
-        context['companies_count'] = Company.objects.count()
-        context['active_subscriptions'] = Subscription.objects.filter(active=True).count()
+        context.update(counters.platform_counters())
     
     elif user.role in ['ADMIN_CLIENTE', 'GERENTE']:
-        if user.company:
-            context['products_count'] = Product.objects.filter(company=user.company).count()
-            context['branches_count'] = Branch.objects.filter(company=user.company).count()
-            context['low_stock'] = Inventory.objects.filter(
-                branch__company=user.company,
-                stock__lte=F('reorder_point')
-            ).count()
+        if user.company_id:
+            context.update(counters.company_counters(user.company_id))
     
     elif user.role == 'VENDEDOR':
-        context['sales_today'] = Sale.objects.filter(
-            user=user,
-            created_at__date=timezone.now().date()
-        ).count()
+        context['sales_today'] = counters.seller_sales_today(user.pk)
     
     return render(request, 'panel.html', context)
 
 
 def product_catalog(request):
-    """Catálogo de productos para e-commerce"""
-    # Filtrar productos activos de empresas activas
-    products = Product.objects.filter(is_active=True, company__is_active=True)
-    
-    category = request.GET.get('category')
-    search = request.GET.get('search')
-    
-    # Aplicar filtros
-    if category:
-        products = products.filter(category=category)
-    
-    if search:
-        products = products.filter(
-            Q(name__icontains=search) | Q(description__icontains=search)
-        )
-    
+    """
+    Catálogo de productos para e-commerce.
+    La grilla, las facetas y la paginación salen de la cache (ver catalog.py):
+    un visitante anónimo no genera consultas mientras el catálogo no cambie.
+    """
+    category, search, page = normalize_filters(request.GET)
+    data = get_catalog_page(category, search, page)
+
+    filters = request.GET.copy()
+    filters.pop('page', None)
     context = {
-        'products': products,
-        'categories': Product.CATEGORY_CHOICES,
+        'products_html': mark_safe(data['products_html']),
+        'facets': data['facets'],
+        'total': data['total'],
+        'page': data['page'],
+        'num_pages': data['num_pages'],
+        'filter_query': filters.urlencode(),
         'selected_category': category,
         'search_query': search,
     }
@@ -985,15 +1205,7 @@ def product_detail(request, pk):
 
 def cart_view(request):
     """Vista del carrito de compras"""
-    if request.user.is_authenticated:
-        cart_items = CartItem.objects.filter(user=request.user)
-    else:
-        session_key = request.session.session_key
-        if not session_key:
-            request.session.create()
-            session_key = request.session.session_key
-        cart_items = CartItem.objects.filter(session_key=session_key)
-    
+    cart_items = Cart.for_request(request).items()
     total = sum(item.get_subtotal() for item in cart_items)
     
     context = {
@@ -1007,39 +1219,15 @@ def add_to_cart(request):
     """Agregar producto al carrito (vista de template)"""
     if request.method == 'POST':
         product_id = request.POST.get('product')
-        quantity = int(request.POST.get('quantity', 1))
         
         try:
+            quantity = int(request.POST.get('quantity', 1))
             product = Product.objects.get(id=product_id, is_active=True)
-            
-            if request.user.is_authenticated:
-                cart_item, created = CartItem.objects.get_or_create(
-                    user=request.user,
-                    product=product,
-                    defaults={'quantity': quantity}
-                )
-                if not created:
-                    cart_item.quantity += quantity
-                    cart_item.save()
-            else:
-                session_key = request.session.session_key
-                if not session_key:
-                    request.session.create()
-                    session_key = request.session.session_key
-                
-                cart_item, created = CartItem.objects.get_or_create(
-                    session_key=session_key,
-                    product=product,
-                    defaults={'quantity': quantity}
-                )
-                if not created:
-                    cart_item.quantity += quantity
-                    cart_item.save()
-            
+            Cart.for_request(request, create=True).add(product.pk, quantity)
             messages.success(request, f'{product.name} agregado al carrito')
-        except Product.DoesNotExist:
+        except (Product.DoesNotExist, ValueError):
             messages.error(request, 'Producto no encontrado')
-        except Exception as e:
+        except CartError as e:
             messages.error(request, f'Error al agregar al carrito: {str(e)}')
     
     return redirect('cart')
@@ -1048,41 +1236,26 @@ def add_to_cart(request):
 def cart_clear_view(request):
     """Vaciar el carrito completamente"""
     if request.method == 'POST':
-        if request.user.is_authenticated:
-            CartItem.objects.filter(user=request.user).delete()
-        else:
-            session_key = request.session.session_key
-            if session_key:
-                CartItem.objects.filter(session_key=session_key).delete()
+        Cart.for_request(request).clear()
         messages.success(request, 'Carrito vaciado')
     return redirect('cart')
 
 
 def cart_remove_item_view(request, item_id):
-    """Eliminar un item específico del carrito"""
+    """Eliminar un producto del carrito (item_id es el id del producto, ver cart.py)"""
     if request.method == 'POST':
-        try:
-            if request.user.is_authenticated:
-                item = CartItem.objects.get(id=item_id, user=request.user)
-            else:
-                session_key = request.session.session_key
-                item = CartItem.objects.get(id=item_id, session_key=session_key)
-            item.delete()
+        if Cart.for_request(request).remove(item_id):
             messages.success(request, 'Producto eliminado del carrito')
-        except CartItem.DoesNotExist:
+        else:
             messages.error(request, 'Item no encontrado')
     return redirect('cart')
 
 
 def checkout_view(request):
     """Vista de checkout"""
-    if request.user.is_authenticated:
-        cart_items = CartItem.objects.filter(user=request.user)
-    else:
-        session_key = request.session.session_key
-        cart_items = CartItem.objects.filter(session_key=session_key) if session_key else CartItem.objects.none()
+    cart_items = Cart.for_request(request).items()
     
-    if not cart_items.exists():
+    if not cart_items:
         return redirect('cart')
     
     total = sum(item.get_subtotal() for item in cart_items)
@@ -1097,58 +1270,30 @@ def checkout_view(request):
 def process_order(request):
     """Procesar orden de compra"""
     if request.method == 'POST':
-        # Obtener items del carrito
-        if request.user.is_authenticated:
-            cart_items = CartItem.objects.filter(user=request.user)
-        else:
-            session_key = request.session.session_key
-            cart_items = CartItem.objects.filter(session_key=session_key) if session_key else CartItem.objects.none()
-        
-        if not cart_items.exists():
-            messages.error(request, 'El carrito está vacío')
-            return redirect('cart')
-        
         try:
-            # Calcular total
-            subtotal = sum(item.get_subtotal() for item in cart_items)
-            shipping_cost = 5000
-            total = subtotal + shipping_cost
-            
-            # Obtener la primera empresa con productos (o la del usuario si está autenticado)
-            company = request.user.company if request.user.is_authenticated and request.user.company else cart_items.first().product.company
-            
-            # Crear orden
-            order = Order.objects.create(
-                company=company,
-                user=request.user if request.user.is_authenticated else None,
-                customer_name=request.POST.get('full_name'),
-                customer_email=request.POST.get('email'),
-                customer_phone=request.POST.get('phone'),
-                customer_address=f"{request.POST.get('address')}, {request.POST.get('city')}",
-                status='PENDIENTE',
-                total_amount=total,
-                shipping_cost=shipping_cost,
+            order = create_order_from_cart(
+                Cart.for_request(request),
+                customer={
+                    'customer_name': request.POST.get('full_name'),
+                    'customer_email': request.POST.get('email'),
+                    'customer_phone': request.POST.get('phone'),
+                    'customer_address': f"{request.POST.get('address')}, {request.POST.get('city')}",
+                },
+                user=request.user,
+                # La empresa del usuario si tiene; si no, la del primer producto
+                company=request.user.company if request.user.is_authenticated else None,
+                shipping_cost=5000,
                 notes=f"Método de pago: {request.POST.get('payment_method')}"
             )
-            
-            # Crear items de la orden
-            for cart_item in cart_items:
-                OrderItem.objects.create(
-                    order=order,
-                    product=cart_item.product,
-                    quantity=cart_item.quantity,
-                    unit_price=cart_item.product.price
-                )
-            
-            # Limpiar carrito
-            cart_items.delete()
-            
-            messages.success(request, f'¡Orden #{order.id} creada exitosamente! Te contactaremos pronto.')
-            return redirect('product_catalog')
-            
+        except CheckoutError as e:
+            messages.error(request, str(e))
+            return redirect('cart')
         except Exception as e:
             messages.error(request, f'Error al procesar orden: {str(e)}')
             return redirect('checkout')
+        
+        messages.success(request, f'¡Orden #{order.id} creada exitosamente! Te contactaremos pronto.')
+        return redirect('product_catalog')
     
     return redirect('checkout')
 
@@ -1198,6 +1343,7 @@ def sales_view(request):
 
 
 @login_required
+@plan_feature_required('has_reports')
 def reports_view(request):
     """Vista de reportes - Solo para ADMIN_CLIENTE y GERENTE"""
     context = {}
@@ -1207,18 +1353,16 @@ def reports_view(request):
         if request.user.company:
             # Reporte de stock bajo
             low_stock = Inventory.objects.filter(
-                branch__company=request.user.company,
-                stock__lte=F('reorder_point')
-            )
+                branch__company_id=request.user.company_id
+            ).needs_restock()
             
-            # Ventas del mes
-            month_start = timezone.now().replace(day=1, hour=0, minute=0, second=0)
-            monthly_sales = Sale.objects.filter(
+            # Ventas del mes (desde el resumen diario)
+            monthly_sales = SalesDailyRollup.objects.filter(
                 branch__company=request.user.company,
-                created_at__gte=month_start
+                business_date__gte=timezone.localdate().replace(day=1)
             ).aggregate(
                 total=Sum('total_amount'),
-                count=Count('id')
+                count=Sum('sales_count')
             )
             
             # Proveedores activos
@@ -1239,14 +1383,13 @@ def reports_view(request):
     
     # SUPER_ADMIN puede ver todo
     elif request.user.role == 'SUPER_ADMIN':
-        low_stock = Inventory.objects.filter(stock__lte=F('reorder_point'))
+        low_stock = Inventory.objects.needs_restock()
         
-        month_start = timezone.now().replace(day=1, hour=0, minute=0, second=0)
-        monthly_sales = Sale.objects.filter(
-            created_at__gte=month_start
+        monthly_sales = SalesDailyRollup.objects.filter(
+            business_date__gte=timezone.localdate().replace(day=1)
         ).aggregate(
             total=Sum('total_amount'),
-            count=Count('id')
+            count=Sum('sales_count')
         )
         
         suppliers_count = Supplier.objects.filter(is_active=True).count()
@@ -1263,17 +1406,20 @@ def reports_view(request):
 
 
 @login_required
+@ensure_csrf_cookie  # La cola offline envía ventas a la API con sesión + CSRF
 def pos_view(request):
     """Vista POS (Punto de Venta) para vendedores"""
     products = Product.objects.none()
+    branches = Branch.objects.none()
     
     if request.user.role == 'VENDEDOR' and request.user.company:
         products = Product.objects.filter(
             company=request.user.company,
             is_active=True
         ).select_related('company')
+        branches = Branch.objects.filter(company=request.user.company, is_active=True)
     
-    context = {'products': products}
+    context = {'products': products, 'branches': branches}
     return render(request, 'pos.html', context)
 
 
@@ -1283,6 +1429,10 @@ def branches_view(request):
     if request.method == 'POST':
         # Crear nueva sucursal
         if request.user.company:
+            error = limit_error(request.user.company_id, 'branches') if request.POST.get('is_active') == 'on' else None
+            if error:
+                messages.error(request, error)
+                return redirect('branches')
             try:
                 Branch.objects.create(
                     company=request.user.company,
@@ -1326,6 +1476,22 @@ def users_create_view(request):
             messages.error(request, 'El nombre de usuario ya existe')
             return render(request, 'usuarios_crear.html')
         
+        # Validar el límite de usuarios del plan de la empresa destino
+        if request.user.role == 'SUPER_ADMIN':
+            company_id = request.POST.get('company') or None
+            if company_id is not None:
+                try:
+                    company_id = int(company_id)
+                except ValueError:
+                    messages.error(request, 'Empresa inválida')
+                    return render(request, 'usuarios_crear.html', status=400)
+        else:
+            company_id = request.user.company_id
+        error = limit_error(company_id, 'users') if request.POST.get('is_active') == 'on' else None
+        if error:
+            messages.error(request, error)
+            return render(request, 'usuarios_crear.html')
+        
         # Crear usuario
         user = User.objects.create_user(
             username=username,
@@ -1341,7 +1507,6 @@ def users_create_view(request):
         
         # Asignar empresa
         if request.user.role == 'SUPER_ADMIN':
-            company_id = request.POST.get('company')
             if company_id:
                 user.company_id = company_id
                 user.save()
@@ -1367,17 +1532,20 @@ def subscription_view(request):
     branches_percentage = 0
     
     if request.user.role in ['ADMIN_CLIENTE', 'SUPER_ADMIN'] and request.user.company:
-        try:
-            subscription = Subscription.objects.get(company=request.user.company)
-            current_users = User.objects.filter(company=request.user.company, is_active=True).count()
-            current_branches = Branch.objects.filter(company=request.user.company, is_active=True).count()
+        # Plan y uso desde la cache (entitlements.py)
+        plan = company_plan(request.user.company_id)
+        if plan is not None:
+            subscription = Subscription(company_id=request.user.company_id, **plan)
+            usage = company_usage(request.user.company_id)
+            current_users = usage['users']
+            current_branches = usage['branches']
             
             # Calcular porcentajes para las barras de progreso
             if subscription.max_users > 0:
                 users_percentage = min(100, (current_users / subscription.max_users) * 100)
             if subscription.max_branches > 0:
                 branches_percentage = min(100, (current_branches / subscription.max_branches) * 100)
-        except Subscription.DoesNotExist:
+        else:
             messages.warning(request, 'No hay información de suscripción disponible')
     
     context = {
@@ -1435,7 +1603,14 @@ def purchase_create_view(request):
                             branch_id=branch_id,
                             product_id=product_id
                         )
+                        previous_stock = inventory.stock
                         inventory.add_stock(int(quantity))
+                        # add_stock no pasa por el libro de movimientos
+                        bump_stock_version(inventory.branch_id)
+                        counters.record_low_stock_changes(
+                            request.user.company_id,
+                            [(previous_stock, inventory.stock, inventory.reorder_point)]
+                        )
                     except Inventory.DoesNotExist:
                         # Crear inventario si no existe
                         inventory = Inventory.objects.create(
@@ -1575,15 +1750,9 @@ def superadmin_company_users(request, company_id):
         admin_count = users.filter(role='ADMIN_CLIENTE').count()
         active_count = users.filter(is_active=True).count()
         
-        # Obtener límite del plan
-        plan_limit = 0
-        if hasattr(company, 'subscription'):
-            plan_limits = {
-                'BASICO': 5,
-                'ESTANDAR': 20,
-                'PREMIUM': 100
-            }
-            plan_limit = plan_limits.get(company.subscription.plan_name, 0)
+        # Límite de usuarios del plan (entitlements.py)
+        plan = company_plan(company.pk)
+        plan_limit = plan['max_users'] if plan else 0
         
         context = {
             'company': company,
@@ -1608,6 +1777,10 @@ def superadmin_create_user(request, company_id):
     if request.method == 'POST':
         try:
             company = Company.objects.get(id=company_id)
+            error = limit_error(company.pk, 'users')
+            if error:
+                messages.error(request, error)
+                return redirect('superadmin_company_users', company_id=company_id)
             
             User.objects.create_user(
                 username=request.POST['username'],
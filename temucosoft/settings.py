@@ -112,6 +112,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Base de tests en archivo (no en memoria compartida) para que los
+        # tests de concurrencia usen bloqueos de base de datos reales
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -188,7 +193,7 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST Framework Configuration
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'pos_ecommerce.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -205,6 +210,30 @@ REST_FRAMEWORK = {
 }
 
 
+# Idempotency-Key: tiempo que se conserva la respuesta de cada clave (segundos)
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+
+
+# Carrito de compras en la cache (pos_ecommerce/cart.py)
+CART_TIMEOUT = 60 * 60 * 24 * 7  # segundos sin actividad antes de descartarlo
+CART_MAX_ITEMS = 50  # productos distintos
+CART_MAX_QUANTITY = 99  # unidades por producto
+
+# Reservas de stock de órdenes e-commerce pendientes (pos_ecommerce/reservations.py)
+STOCK_RESERVATION_TTL = 60 * 30  # segundos; luego las libera release_expired_reservations
+
+
+# Reportes en segundo plano (manage.py run_report_worker)
+# Directorio privado: no debe quedar bajo MEDIA_ROOT ni STATIC_ROOT
+REPORT_JOBS_ROOT = BASE_DIR / 'report_jobs'
+# Prefijo de la location `internal` de Nginx; None entrega el archivo desde Django
+REPORT_JOBS_ACCEL_PREFIX = None
+REPORT_JOBS_RETENTION_DAYS = 7
+# Un trabajo EN_PROCESO por más tiempo se da por abandonado y se reintenta
+REPORT_JOBS_TIMEOUT = 60 * 30  # segundos; debe superar al reporte más largo
+REPORT_JOBS_MAX_ATTEMPTS = 3
+
+
 # Simple JWT Configuration
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=1),
@@ -226,8 +255,16 @@ SIMPLE_JWT = {
     
     'AUTH_TOKEN_CLASSES': ('rest_framework_simplejwt.tokens.AccessToken',),
     'TOKEN_TYPE_CLAIM': 'token_type',
+
+    # Claims role y company_id, last_login en lote (ver pos_ecommerce/authentication.py)
+    'TOKEN_OBTAIN_SERIALIZER': 'pos_ecommerce.authentication.PosTokenObtainPairSerializer',
 }
 
+# Usuario autenticado por JWT guardado en la cache (segundos)
+AUTH_USER_CACHE_TIMEOUT = 60 * 5
+# Cada cuánto se escriben los last_login acumulados (segundos)
+LAST_LOGIN_FLUSH_INTERVAL = 60
+
 
 # CORS Configuration
 # AWS DEPLOYMENT: Configurar orígenes permitidos
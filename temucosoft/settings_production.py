@@ -59,6 +59,10 @@ STATIC_URL = '/static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Resultados de reportes en segundo plano, entregados por Nginx (X-Accel-Redirect)
+REPORT_JOBS_ROOT = os.environ.get('REPORT_JOBS_ROOT', '/var/lib/temucosoft/report_jobs')
+REPORT_JOBS_ACCEL_PREFIX = '/protected/report-jobs/'
+
 # =============================================================================
 # SEGURIDAD HTTPS/SSL
 # =============================================================================
@@ -138,21 +142,28 @@ LOGGING = {
 # CACHE (Opcional - Redis)
 # =============================================================================
 
-# Si tienes Redis instalado:
-# CACHES = {
-#     'default': {
-#         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
-#         'LOCATION': 'redis://127.0.0.1:6379/1',
-#     }
-# }
-
-# Cache en memoria (simple, para empezar)
-CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+# La cache debe ser compartida entre los workers de Gunicorn: guarda las
+# respuestas de Idempotency-Key y otros datos que no pueden quedar en la
+# memoria de un solo proceso.
+if os.environ.get('REDIS_URL'):
+    # Requiere el paquete redis (ver requirements.txt)
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    # Sin Redis: cache en la base de datos, compartida por los workers. La
+    # cache en disco no sirve: su add() no es atómico entre procesos y el
+    # bloqueo de Idempotency-Key lo necesita (chequeo pos_ecommerce.E001).
+    # La tabla se crea con `manage.py createcachetable` (deploy.sh).
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'pos_cache',
+        }
     }
-}
 
 # =============================================================================
 # EMAIL (Opcional - para notificaciones)